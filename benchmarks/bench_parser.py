@@ -0,0 +1,150 @@
+"""Parser throughput benchmarks, on synthetic aseprite files.
+
+Run from anywhere, e.g.:
+
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --width 1024 --height 1024 --frames 4 --color-mode indexed
+
+Without any shape options, a default set of shapes is benchmarked. Krita
+is not needed, the parser core doesn't depend on it.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from krita_aseprite import ase_file
+from synthetic import COLOR_MODES, SyntheticShape, make_ase_file
+
+
+DEFAULT_SHAPES = [
+    SyntheticShape(256, 256, 16, 4, "rgba"),
+    SyntheticShape(256, 256, 16, 4, "rgba", compressed=False),
+    SyntheticShape(256, 256, 16, 4, "grayscale"),
+    SyntheticShape(256, 256, 16, 4, "indexed"),
+    SyntheticShape(1024, 1024, 2, 2, "indexed", palette_size=32),
+    SyntheticShape(64, 64, 300, 8, "rgba"),
+]
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _peak_memory(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _read_header(filename: str):
+    with open(filename, "rb") as f:
+        return ase_file.read_ase_header(f)
+
+def _convert_indexed(ase: ase_file.AsepriteFile) -> None:
+    luts: dict[tuple[int, bool], bytes] = {}
+    for frame in ase.frames:
+        for cel in frame.cels:
+            _, _, pixels = cel.data
+            ase_file.indexed_to_rgba(pixels, ase_file.layer_palette_lut(ase, cel.layer_idx, luts, bgra=True))
+
+def _swap_red_blue(ase: ase_file.AsepriteFile) -> None:
+    for frame in ase.frames:
+        for cel in frame.cels:
+            _, _, pixels = cel.data
+            ase_file.swap_red_blue(pixels)
+
+def bench_shape(shape: SyntheticShape, directory: str, repeat: int, executor: ThreadPoolExecutor) -> list[dict]:
+    filename = os.path.join(directory, f"bench_{shape.color_mode}_{shape.width}x{shape.height}.aseprite")
+    file_size = make_ase_file(filename, shape)
+
+    ase = ase_file.read_ase_file(filename)
+    assert ase is not None
+    num_cels = sum(len(frame.cels) for frame in ase.frames)
+    num_pixels = sum(cel.data[0] * cel.data[1] for frame in ase.frames for cel in frame.cels)
+
+    cases = [
+        ("read_ase_file", lambda: ase_file.read_ase_file(filename)),
+        ("read_ase_file stream", lambda: ase_file.read_ase_file(filename, use_mmap=False)),
+        ("read_ase_file lazy", lambda: ase_file.read_ase_file(filename, lazy=True)),
+        ("read_ase_file threads", lambda: ase_file.read_ase_file(filename, executor=executor)),
+        ("read_ase_header", lambda: _read_header(filename)),
+        ("probe_ase_file", lambda: ase_file.probe_ase_file(filename, metadata=True)),
+    ]
+    if shape.color_mode == "indexed":
+        cases.append(("indexed_to_rgba", lambda: _convert_indexed(ase)))
+    elif shape.color_mode == "rgba":
+        cases.append(("swap_red_blue", lambda: _swap_red_blue(ase)))
+
+    results = []
+    for name, fn in cases:
+        seconds = _time(fn, repeat)
+        result = {
+            "shape": str(shape),
+            "case": name,
+            "seconds": seconds,
+            "mb_per_s": file_size / seconds / 1e6,
+            "cels_per_s": num_cels / seconds,
+            "peak_memory": _peak_memory(fn),
+        }
+        if name in ("indexed_to_rgba", "swap_red_blue"):
+            result["mpx_per_s"] = num_pixels / seconds / 1e6
+        results.append(result)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument("--frames", type=int)
+    parser.add_argument("--layers", type=int)
+    parser.add_argument("--color-mode", choices=COLOR_MODES)
+    parser.add_argument("--raw", action="store_true", help="store cels uncompressed")
+    parser.add_argument("--palette-size", type=int)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the best one is reported")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="worker threads for the threaded case")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON to FILE")
+    args = parser.parse_args()
+
+    shape_args = {
+        "width": args.width,
+        "height": args.height,
+        "frames": args.frames,
+        "layers": args.layers,
+        "color_mode": args.color_mode,
+        "palette_size": args.palette_size,
+    }
+    shape_args = {k: v for k, v in shape_args.items() if v is not None}
+    if shape_args or args.raw:
+        shapes = [SyntheticShape(**shape_args, compressed=not args.raw)]
+    else:
+        shapes = DEFAULT_SHAPES
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(args.threads) as executor:
+        for shape in shapes:
+            print(shape)
+            for result in bench_shape(shape, directory, args.repeat, executor):
+                extra = f" {result['mpx_per_s']:8.1f} Mpx/s" if "mpx_per_s" in result else ""
+                print(f"  {result['case']:<22} {result['seconds']*1000:9.3f} ms {result['mb_per_s']:9.1f} MB/s "
+                      f"{result['cels_per_s']:11.0f} cels/s {result['peak_memory']/1e6:9.2f} MB peak{extra}")
+                results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
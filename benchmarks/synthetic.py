@@ -0,0 +1,119 @@
+"""Generator for synthetic aseprite files of a controlled shape, for benchmarks.
+
+The files are written directly with `struct`, independently of the plugin,
+so they can also be used to check the parser against.
+"""
+from dataclasses import dataclass
+import random
+import struct
+import zlib
+
+
+COLOR_MODES = {
+    "rgba": 32,
+    "grayscale": 16,
+    "indexed": 8,
+}
+
+
+@dataclass
+class SyntheticShape:
+    width: int = 256
+    height: int = 256
+    frames: int = 16
+    layers: int = 4
+    color_mode: str = "rgba"
+    compressed: bool = True
+    palette_size: int = 256
+    seed: int = 0
+    user_data: bool = False     # a user data chunk (text) for each layer and cel
+
+    @property
+    def bpp(self) -> int:
+        return COLOR_MODES[self.color_mode]
+
+    def __str__(self) -> str:
+        return (f"{self.width}x{self.height} {self.color_mode} {self.frames}f {self.layers}l "
+                f"{'comp' if self.compressed else 'raw'} pal{self.palette_size}")
+
+
+def _string(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return struct.pack("<H", len(data)) + data
+
+def _chunk(chunk_type: int, data: bytes) -> bytes:
+    return struct.pack("<IH", len(data) + 6, chunk_type) + data
+
+def _frame(chunks: list[bytes], duration: int) -> bytes:
+    data = b"".join(chunks)
+    return struct.pack("<IHHH2xI", len(data) + 16, 0xF1FA, min(len(chunks), 0xFFFF), duration, len(chunks)) + data
+
+def _layer_chunk(name: str, flags: int) -> bytes:
+    return _chunk(0x2004, struct.pack("<HHHHHHB3x", flags, 0, 0, 0, 0, 0, 255) + _string(name))
+
+def _user_data_chunk(text: str) -> bytes:
+    return _chunk(0x2020, struct.pack("<I", 1) + _string(text))
+
+def _palette_chunk(colors: list[tuple[int, int, int, int]]) -> bytes:
+    data = struct.pack("<III8x", len(colors), 0, len(colors) - 1)
+    data += b"".join(struct.pack("<HBBBB", 0, *color) for color in colors)
+    return _chunk(0x2019, data)
+
+def _cel_chunk(layer_idx: int, w: int, h: int, pixels: bytes, compressed: bool) -> bytes:
+    data = struct.pack("<HhhBHh5xHH", layer_idx, 0, 0, 255, 2 if compressed else 0, 0, w, h)
+    data += zlib.compress(pixels) if compressed else pixels
+    return _chunk(0x2005, data)
+
+def _cel_pixels(shape: SyntheticShape, rnd: random.Random, frame: int, layer: int) -> bytes:
+    # horizontal runs of "colors" with some noise, so the data compresses
+    # somewhat like real pixel art (neither trivially nor not at all)
+    px_size = shape.bpp // 8
+    max_value = shape.palette_size if shape.color_mode == "indexed" else 256
+
+    rows = []
+    for y in range(shape.height):
+        run = bytes((y // 8 + frame + layer + x // 16) % max_value for x in range(shape.width))
+        row = bytearray(shape.width * px_size)
+        for channel in range(px_size):
+            row[channel::px_size] = run
+        for _ in range(shape.width // 16):
+            row[rnd.randrange(len(row))] = rnd.randrange(max_value)
+        rows.append(bytes(row))
+    return b"".join(rows)
+
+def make_ase_bytes(shape: SyntheticShape) -> bytes:
+    """Build a complete aseprite file with the given shape"""
+    rnd = random.Random(shape.seed)
+
+    colors = [(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255) for _ in range(shape.palette_size)]
+
+    frames = []
+    for frame in range(shape.frames):
+        chunks = []
+        if frame == 0:
+            chunks.append(_palette_chunk(colors))
+            for i in range(shape.layers):
+                chunks.append(_layer_chunk(f"Layer {i}", 0b11))
+                if shape.user_data:
+                    chunks.append(_user_data_chunk(f"layer {i}"))
+        for layer in range(shape.layers):
+            pixels = _cel_pixels(shape, rnd, frame, layer)
+            chunks.append(_cel_chunk(layer, shape.width, shape.height, pixels, shape.compressed))
+            if shape.user_data:
+                chunks.append(_user_data_chunk(f"cel {frame} {layer}"))
+        frames.append(_frame(chunks, 100))
+
+    body = b"".join(frames)
+    header = struct.pack(
+        "<IHHHHHIH8xB3xHBBhhHH84x",
+        128 + len(body), 0xA5E0, shape.frames, shape.width, shape.height, shape.bpp,
+        0b11, 100, 0, shape.palette_size % 256, 1, 1, 0, 0, 16, 16
+    )
+    return header + body
+
+def make_ase_file(filename: str, shape: SyntheticShape) -> int:
+    """Write a synthetic aseprite file, returning its size in bytes"""
+    data = make_ase_bytes(shape)
+    with open(filename, "wb") as f:
+        f.write(data)
+    return len(data)
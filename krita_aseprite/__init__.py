@@ -1 +1,8 @@
-from .krita_aseprite import *
\ No newline at end of file
+try:
+    import krita
+except ImportError:
+    # not running inside of Krita, only the modules that don't need it
+    # (`ase_file`, `ase_render`, `ase_convert`) can be used
+    pass
+else:
+    from .krita_aseprite import *
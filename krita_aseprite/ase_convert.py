@@ -0,0 +1,214 @@
+"""Convert aseprite files to PNG frames, without Krita.
+
+    python -m krita_aseprite.ase_convert sprites/ -o build/sprites
+    python -m krita_aseprite.ase_convert a.aseprite b.ase -o out --jobs 4 --check hash
+    python -m krita_aseprite.ase_convert sprites/ -o build/atlases --sheet
+
+Directories are searched recursively, and the outputs keep the directory
+structure of the sources: `<name>.png` for single frame files, and
+`<name>_<frame>.png` otherwise. With `--sheet`, all frames of a file are
+packed into one sprite sheet instead, `<name>.png` with `<name>.json` (see
+`ase_sheet`). Files whose outputs are up to date are skipped, either by
+modification time or by a hash of the source (kept in a manifest in the
+output directory).
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+from .ase_file import read_ase_file, read_ase_header
+from .ase_render import render_frame, save_png
+from .ase_sheet import make_sheet, save_sheet
+
+
+logger = logging.getLogger(__name__)
+
+ASE_EXTENSIONS = (".ase", ".aseprite")
+MANIFEST_NAME = ".ase_convert.json"
+
+
+@dataclass
+class ConvertTask:
+    source: str
+    output_dir: str
+    name: str   # output file name without extension
+    compression_level: int
+    sheet: bool = False
+    padding: int = 1    # between images in sheets
+
+@dataclass
+class ConvertResult:
+    source: str
+    outputs: list[str]
+    error: str | None = None
+
+
+def find_sources(paths: list[str]) -> list[tuple[str, str]]:
+    """Find aseprite files in `paths`, as (path, path relative to the directory it was found in)"""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(ASE_EXTENSIONS):
+                        full = os.path.join(root, name)
+                        sources.append((full, os.path.relpath(full, path)))
+        else:
+            sources.append((path, os.path.basename(path)))
+    return sources
+
+def output_names(name: str, num_frames: int, sheet: bool = False) -> list[str]:
+    if sheet:
+        return [f"{name}.png", f"{name}.json"]
+    if num_frames == 1:
+        return [f"{name}.png"]
+    digits = len(str(num_frames - 1))
+    return [f"{name}_{i:0{digits}}.png" for i in range(num_frames)]
+
+def file_hash(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+def is_up_to_date(task: ConvertTask) -> bool:
+    """Check if all outputs of `task` exist and are newer than its source.
+
+    Only the header of the source is read, for the number of frames.
+    """
+    with open(task.source, "rb") as f:
+        header = read_ase_header(f)
+    if header is None:
+        return False
+
+    source_mtime = os.stat(task.source).st_mtime_ns
+    try:
+        return all(
+            os.stat(os.path.join(task.output_dir, name)).st_mtime_ns >= source_mtime
+            for name in output_names(task.name, header.num_frames, task.sheet)
+        )
+    except FileNotFoundError:
+        return False
+
+def convert_file(task: ConvertTask) -> ConvertResult:
+    """Render all frames of an aseprite file to PNGs, or a sheet (run in a worker process)"""
+    try:
+        ase = read_ase_file(task.source)
+        if ase is None:
+            return ConvertResult(task.source, [], "not a valid aseprite file")
+
+        os.makedirs(task.output_dir, exist_ok=True)
+        if task.sheet:
+            outputs = [os.path.join(task.output_dir, name) for name in output_names(task.name, len(ase.frames), True)]
+            save_sheet(make_sheet(ase, task.name, task.padding), *outputs, task.compression_level)
+            return ConvertResult(task.source, outputs)
+
+        w, h = ase.header.bounds
+        luts: dict[tuple[int, bool], bytes] = {}
+        variants: dict[tuple[int, int, int], bytes] = {}
+
+        outputs = []
+        for i, name in enumerate(output_names(task.name, len(ase.frames))):
+            output = os.path.join(task.output_dir, name)
+            save_png(output, w, h, render_frame(ase, i, luts, variants), task.compression_level)
+            outputs.append(output)
+        return ConvertResult(task.source, outputs)
+    except Exception as e:
+        logger.debug("Failed to convert %s", task.source, exc_info=True)
+        return ConvertResult(task.source, [], f"{type(e).__name__}: {e}")
+
+def load_manifest(output_dir: str) -> dict[str, dict]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(output_dir: str, manifest: dict[str, dict]) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def jobs_arg(value: str) -> int:
+    """Number of worker processes, 0 for one per CPU"""
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value!r}")
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {jobs}")
+    return jobs or os.cpu_count() or 1
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="aseprite files, or directories to search for them")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-j", "--jobs", type=jobs_arg, default="0", help="worker processes (default: 0, one per CPU)")
+    parser.add_argument("--check", choices=("mtime", "hash"), default="mtime",
+                        help="how to tell if outputs are up to date")
+    parser.add_argument("--force", action="store_true", help="convert all files, even if up to date")
+    parser.add_argument("--compression-level", type=int, default=6, help="zlib level for the PNGs")
+    parser.add_argument("--sheet", action="store_true", help="pack the frames of each file into a sprite sheet")
+    parser.add_argument("--padding", type=int, default=1, help="pixels between the images in sheets")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s")
+
+    manifest = load_manifest(args.output) if args.check == "hash" else {}
+    hashes: dict[str, str] = {}
+
+    tasks = []
+    for source, rel in find_sources(args.paths):
+        rel_dir, name = os.path.split(rel)
+        task = ConvertTask(source, os.path.join(args.output, rel_dir), os.path.splitext(name)[0], args.compression_level,
+                           args.sheet, args.padding)
+
+        if not args.force:
+            if args.check == "hash":
+                hashes[source] = file_hash(source)
+                entry = manifest.get(rel)
+                up_to_date = (entry is not None and entry["hash"] == hashes[source]
+                              and entry.get("sheet", False) == args.sheet
+                              and all(os.path.exists(os.path.join(args.output, output)) for output in entry["outputs"]))
+            else:
+                up_to_date = is_up_to_date(task)
+            if up_to_date:
+                logger.info("Up to date: %s", source)
+                continue
+        tasks.append((rel, task))
+
+    failed = 0
+    if tasks:
+        with multiprocessing.Pool(min(args.jobs, len(tasks))) as pool:
+            rels = {task.source: rel for rel, task in tasks}
+            for result in pool.imap_unordered(convert_file, [task for _, task in tasks]):
+                if result.error is not None:
+                    logger.error("%s: %s", result.source, result.error)
+                    failed += 1
+                    continue
+
+                logger.info("%s -> %d file(s)", result.source, len(result.outputs))
+                if args.check == "hash":
+                    source_hash = hashes.get(result.source) or file_hash(result.source)
+                    # relative to the output directory, so it doesn't matter where this is run from
+                    outputs = [os.path.relpath(output, args.output) for output in result.outputs]
+                    manifest[rels[result.source]] = {"hash": source_hash, "outputs": outputs, "sheet": args.sheet}
+
+    if args.check == "hash":
+        save_manifest(args.output, manifest)
+
+    print(f"{len(tasks) - failed} converted, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
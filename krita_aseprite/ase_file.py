@@ -1,21 +1,62 @@
-from dataclasses import dataclass
+"""Reading and writing of aseprite files.
+
+Only needs the standard library (and optionally numpy), documents are
+created from the parsed files in `krita_document`.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field, replace
+import hashlib
+import logging
+import math
+import mmap
+import os
 import struct
+import threading
+import time
+import traceback
 import zlib
 
 from enum import IntEnum, IntFlag
-from typing import Any, NamedTuple as T, TypeAlias
-from io import BufferedReader
-
-from krita import *
+from typing import Any, Iterator, NamedTuple as T, TypeAlias
+from io import BufferedReader, BufferedWriter, BytesIO
 
 try:
-    from PyQt6.QtWidgets import QDialog, QFileDialog
-    from PyQt6.QtCore import QByteArray
-    from PyQt6.QtGui import QImage
-except:
-    from PyQt5.QtWidgets import QDialog, QFileDialog
-    from PyQt5.QtCore import QByteArray
-    from PyQt5.QtGui import QImage
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+# Opt-in per chunk tracing, see `enable_trace`
+trace_logger = logger.getChild("trace")
+_trace = False
+
+class ChunkTrace(T):
+    chunk_type: int
+    offset: int         # of the chunk header, from the start of the file
+    size: int
+    decode_time: float  # seconds
+
+def enable_trace(enabled: bool = True) -> None:
+    """Log a record for every chunk that is read on `trace_logger`.
+
+    The `ChunkTrace` of each chunk is available as `record.chunk` for
+    handlers. Tracing times every chunk, so it is off by default.
+    """
+    global _trace
+    _trace = enabled
+    if enabled and trace_logger.level == logging.NOTSET:
+        trace_logger.setLevel(logging.DEBUG)
+
+def _log_chunk_trace(chunk_type: int, offset: int, size: int, start_time: float) -> None:
+    chunk = ChunkTrace(chunk_type, offset, size, time.perf_counter() - start_time)
+    trace_logger.debug("%s at %d: %d bytes in %.3f ms",
+                       ASE_CHUNK_TYPE_NAMES.get(chunk_type, f"Unknown chunk 0x{chunk_type:04x}"),
+                       offset, size, chunk.decode_time * 1000, extra={"chunk": chunk})
 
 
 class Point(T):
@@ -66,6 +107,73 @@ def read_ignore(f: BufferedReader, size: int) -> None:
     _ = f.seek(size, 1)
 
 
+# unsigned int
+def write_uint(f: BufferedWriter, value: int, size: int) -> None:
+    f.write(value.to_bytes(size, byteorder="little", signed=False))
+
+def write_bytes(f: BufferedWriter, data) -> None:
+    f.write(data)
+
+# signed int
+def write_sint(f: BufferedWriter, value: int, size: int) -> None:
+    f.write(value.to_bytes(size, byteorder="little", signed=True))
+
+# fixed point
+def write_fixed(f: BufferedWriter, value: Fixed) -> None:
+    write_uint(f, value.lhs, 2)
+    write_uint(f, value.rhs, 2)
+
+# str
+def write_string(f: BufferedWriter, s: str) -> None:
+    data = s.encode("utf-8")
+    write_uint(f, len(data), 2)
+    f.write(data)
+
+def write_ignore(f: BufferedWriter, size: int) -> None:
+    f.write(bytes(size))
+
+
+# Precompiled layouts for the buffer backend (`read_ase_buffer`), which decodes
+# the fixed size parts of the file straight out of memory at known offsets.
+_HEADER       = struct.Struct("<IHHHHHIH8xB3xHBBhhHH84x")
+_FRAME_HEADER = struct.Struct("<IHHH2xI")
+_CHUNK_HEADER = struct.Struct("<IH")
+_CEL_HEADER   = struct.Struct("<HhhBHh5x")
+_CEL_SIZE     = struct.Struct("<HH")
+_U16          = struct.Struct("<H")
+_TILEMAP_HEADER = struct.Struct("<HHHIIII10x")
+
+class BufferReader:
+    """Minimal file-like reader over a bytes-like buffer.
+
+    Lets the `read_*` chunk functions run on data that is already in memory
+    (e.g. a mmap), without going through a `BufferedReader`.
+    """
+    def __init__(self, buf, pos: int = 0) -> None:
+        self.buf = memoryview(buf)
+        self.pos = pos
+
+    def read(self, size: int) -> bytes:
+        start = self.pos
+        self.pos += size
+        return self.buf[start:self.pos].tobytes()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = len(self.buf) + offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def close(self) -> None:
+        self.buf.release()
+
+
 class ChunkType(IntEnum):
     PALETTE_OLD0   = 0x0004
     PALETTE_OLD1   = 0x0011
@@ -126,6 +234,27 @@ class LayerType(IntEnum):
     GROUP   = 1
     TILEMAP = 2
 
+class BlendMode(IntEnum):
+    NORMAL      = 0
+    MULTIPLY    = 1
+    SCREEN      = 2
+    OVERLAY     = 3
+    DARKEN      = 4
+    LIGHTEN     = 5
+    COLOR_DODGE = 6
+    COLOR_BURN  = 7
+    HARD_LIGHT  = 8
+    SOFT_LIGHT  = 9
+    DIFFERENCE  = 10
+    EXCLUSION   = 11
+    HUE         = 12
+    SATURATION  = 13
+    COLOR       = 14
+    LUMINOSITY  = 15
+    ADDITION    = 16
+    SUBTRACT    = 17
+    DIVIDE      = 18
+
 def read_chunk_layer(f: BufferedReader, use_uuid: bool):
     layer_flags = read_uint(f, 2)
     layer_type  = read_uint(f, 2)
@@ -137,12 +266,8 @@ def read_chunk_layer(f: BufferedReader, use_uuid: bool):
     _reserved = read_ignore(f, 3)
     name = read_string(f)
 
-    print("      type: ", layer_type)
-    print("      flags:", layer_flags)
-    print("      child level:", child_level)
-    print("      blend mode: ", blend_mode)
-    print("      opacity:    ", opacity)
-    print("      name:       ", name)
+    logger.debug("Layer %r: type %d, flags %d, child level %d, blend mode %d, opacity %d",
+                 name, layer_type, layer_flags, child_level, blend_mode, opacity)
 
     tileset_idx = read_uint(f, 4) if layer_type == LayerType.TILEMAP else None
     uuid = read_bytes(f, 16) if use_uuid else None
@@ -158,6 +283,157 @@ def read_chunk_layer(f: BufferedReader, use_uuid: bool):
         uuid
     )
 
+def write_chunk_layer(f: BufferedWriter, layer: Layer, use_uuid: bool) -> None:
+    write_uint(f, layer.layer_flags, 2)
+    write_uint(f, layer.layer_type, 2)
+    write_uint(f, layer.child_level, 2)
+    write_ignore(f, 2)  # default layer width
+    write_ignore(f, 2)  # default layer height
+    write_uint(f, layer.blend_mode, 2)
+    write_uint(f, layer.opacity, 1)
+    write_ignore(f, 3)
+    write_string(f, layer.name)
+
+    if layer.layer_type == LayerType.TILEMAP:
+        write_uint(f, layer.tileset_idx or 0, 4)
+    if use_uuid:
+        write_bytes(f, layer.uuid or bytes(16))
+
+
+class PixelCache:
+    """Bounded LRU of decompressed cel pixels, shared by `LazyPixelData` handles"""
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Any, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> bytes | None:
+        with self._lock:
+            pixels = self._entries.get(key)
+            if pixels is not None:
+                self._entries.move_to_end(key)
+            return pixels
+
+    def put(self, key, pixels: bytes) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = pixels
+            self.size += len(pixels)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+class LazyPixelData:
+    """Compressed cel pixels, which are only decompressed on first access.
+
+    `source` is either the name of the file the cel was read from, or the
+    buffer it was read from. Unpacks just like `RawPixelData`:
+    `w, h, pixels = cel.data`.
+
+    Decompressed pixels are kept by the handle itself, or in `cache` (if
+    given), in which case they may be evicted and decompressed again later.
+    """
+    def __init__(self, source, offset: int, length: int, width: int, height: int, cache: PixelCache | None = None) -> None:
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.width  = width
+        self.height = height
+        self.cache  = cache
+        self._pixels: bytes | None = None
+
+    @property
+    def pixels(self) -> bytes:
+        return self.load()
+
+    def is_loaded(self) -> bool:
+        if self.cache is not None:
+            return self in self.cache
+        return self._pixels is not None
+
+    def load(self) -> bytes:
+        if self._pixels is not None:
+            return self._pixels
+
+        if self.cache is not None:
+            pixels = self.cache.get(self)
+            if pixels is not None:
+                return pixels
+
+        if isinstance(self.source, str):
+            with open(self.source, "rb") as f:
+                f.seek(self.offset)
+                pixels = zlib.decompress(f.read(self.length))
+        else:
+            with memoryview(self.source) as view:
+                pixels = zlib.decompress(view[self.offset:self.offset+self.length])
+
+        if self.cache is not None:
+            self.cache.put(self, pixels)
+        else:
+            self._pixels = pixels
+        return pixels
+
+    def read_compressed(self) -> bytes:
+        """Read the compressed pixels, without decompressing them"""
+        if isinstance(self.source, str):
+            with open(self.source, "rb") as f:
+                f.seek(self.offset)
+                return f.read(self.length)
+        with memoryview(self.source) as view:
+            return view[self.offset:self.offset+self.length].tobytes()
+
+    def __iter__(self):
+        yield self.width
+        yield self.height
+        yield self.load()
+
+    def with_pixels(self, pixels: bytes) -> RawPixelData:
+        """The same data, with `pixels` decompressed already"""
+        return (self.width, self.height, pixels)
+
+    def decompressed_size(self, px_size: int) -> int:
+        """Size of the pixels once decompressed, in bytes, without decompressing them"""
+        return self.width * self.height * px_size
+
+    def __repr__(self) -> str:
+        return f"LazyPixelData({self.width}x{self.height}, {self.length} bytes at {self.offset})"
+
+class LazyTilesData(LazyPixelData):
+    """Compressed tiles of a tilemap cel, which are only decompressed on
+    first access. Unpacks just like `TilesData`, with `tilemap_header`
+    being everything but the tiles themselves.
+    """
+    def __init__(self, source, offset: int, length: int, tilemap_header: tuple[int, ...], cache: PixelCache | None = None) -> None:
+        super().__init__(source, offset, length, tilemap_header[0], tilemap_header[1], cache)
+        self.tilemap_header = tilemap_header
+
+    def __iter__(self):
+        yield from self.tilemap_header
+        yield self.load()
+
+    def with_pixels(self, pixels: bytes) -> TilesData:
+        return (*self.tilemap_header, pixels)
+
+    def decompressed_size(self, px_size: int) -> int:
+        # tiles have a size of their own, whatever the pixels are
+        return self.width * self.height * self.tilemap_header[2] // 8
+
+    def __repr__(self) -> str:
+        return f"LazyTilesData({self.width}x{self.height} tiles, {self.length} bytes at {self.offset})"
+
 
 RawPixelData: TypeAlias = tuple[int, int, bytes]
 TilesData: TypeAlias = tuple[int, int, int, int, int, int, int, bytes]
@@ -169,7 +445,7 @@ class Cel:
     opacity: int
     cel_type: int
     z_index: int
-    data: int | RawPixelData | TilesData
+    data: int | RawPixelData | LazyPixelData | TilesData | LazyTilesData
 
     flags:  int|None = None
     width:  Fixed|None = None
@@ -184,7 +460,13 @@ class CelType(IntEnum):
 
 
 
-def read_chunk_cel(f: BufferedReader, size: int) -> Cel:
+def read_chunk_cel(f: BufferedReader, size: int, source=None, cache: PixelCache | None = None) -> Cel:
+    """Read a cel chunk of `size` bytes.
+
+    If a `source` is given, compressed images and tilemaps are not
+    decompressed, and instead returned as `LazyPixelData` (or
+    `LazyTilesData`) pointing into `source`.
+    """
     layer_idx = read_uint(f, 2)
     x_pos     = read_sint(f, 2)
     y_pos     = read_sint(f, 2)
@@ -192,48 +474,46 @@ def read_chunk_cel(f: BufferedReader, size: int) -> Cel:
     cel_type  = read_uint(f, 2)
     z_index   = read_sint(f, 2)
     _reserved = read_ignore(f,5)
-    print("      layer_idx:", layer_idx)
-    print("      x_pos:    ", x_pos)
-    print("      y_pos:    ", y_pos)
-    print("      opacity:  ", opacity)
-    print("      cel_type: ", cel_type)
-    print("      z_index:  ", z_index)
+
+    # read for every cel, so only formatted when it's logged
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Cel: layer %d, pos (%d, %d), opacity %d, type %d, z-index %d",
+                     layer_idx, x_pos, y_pos, opacity, cel_type, z_index)
 
     size -= 16  # preceding read bytes
 
     match cel_type:
         case CelType.IMG_RAW:
-            print("!!cel type is 0 (IMG_RAW)!")
             cel_w = read_uint(f, 2)
             cel_h = read_uint(f, 2)
 
             size -= 4
 
-            print("        cel_w:", cel_w)
-            print("        cel_h:", cel_h)
+            if debug:
+                logger.debug("Cel size: %dx%d", cel_w, cel_h)
 
             pixels = read_pixels(f, size)
-            print(f"        pixels len: {len(pixels)}")
             data = (cel_w, cel_h, pixels)
         case CelType.LINKED:
-            print("        !!cel type is 1 (LINKED!")
             data = read_uint(f, 2)
         case CelType.IMG_COMP:
-            print("        !!cel type is 2 (IMG_COMP)!")
             cel_w = read_uint(f, 2)
             cel_h = read_uint(f, 2)
 
             size -= 4
 
-            print("        cel_w:", cel_w)
-            print("        cel_h:", cel_h)
+            if debug:
+                logger.debug("Cel size: %dx%d", cel_w, cel_h)
 
-            pixels_compressed = read_pixels(f, size)
-            pixels = zlib.decompress(pixels_compressed)
-            print(f"        pixels len: {len(pixels)}")
-            data = (cel_w, cel_h, pixels)
+            if source is not None:
+                data = LazyPixelData(source, f.tell(), size, cel_w, cel_h, cache)
+                read_ignore(f, size)
+            else:
+                pixels_compressed = read_pixels(f, size)
+                pixels = zlib.decompress(pixels_compressed)
+                data = (cel_w, cel_h, pixels)
         case CelType.TILEMAP_COMP:
-            print("          !!cel type is 3 (TILEMAP_COMP!")
             tiles_w   = read_uint(f, 2)
             tiles_h   = read_uint(f, 2)
             tiles_bpp = read_uint(f, 2)
@@ -245,9 +525,7 @@ def read_chunk_cel(f: BufferedReader, size: int) -> Cel:
 
             size -= 32
 
-            tiles_compressed = read_bytes(f, size)
-            tiles = zlib.decompress(tiles_compressed)
-            data = (
+            tilemap_header = (
                 tiles_w,
                 tiles_h,
                 tiles_bpp,
@@ -255,13 +533,95 @@ def read_chunk_cel(f: BufferedReader, size: int) -> Cel:
                 bitmask_x_flip,
                 bitmask_y_flip,
                 bitmask_diag_flip,
-                tiles
             )
-            raise NotImplementedError(f"Compressed tilemap is not yet supported.")
+            if source is not None:
+                data = LazyTilesData(source, f.tell(), size, tilemap_header, cache)
+                read_ignore(f, size)
+            else:
+                tiles_compressed = read_bytes(f, size)
+                tiles = zlib.decompress(tiles_compressed)
+                data = (*tilemap_header, tiles)
+        case _: # invalid
+            raise Exception(f"Invalid cel type `{cel_type}`")
+    return Cel(layer_idx, Point(x_pos,y_pos), opacity, cel_type, z_index, data)
+
+def read_chunk_cel_buffer(buf: memoryview, offset: int, size: int, source=None, cache: PixelCache | None = None) -> Cel:
+    """Same as `read_chunk_cel`, but decodes the cel at `offset` in `buf`.
+
+    Compressed pixels are handed to zlib as a slice of `buf`, so the
+    compressed data is never copied. With a `source`, they are left
+    compressed (see `LazyPixelData`), and offsets are relative to `buf`.
+    """
+    layer_idx, x_pos, y_pos, opacity, cel_type, z_index = _CEL_HEADER.unpack_from(buf, offset)
+    start = offset + _CEL_HEADER.size
+    end = offset + size
+
+    match cel_type:
+        case CelType.IMG_RAW:
+            cel_w, cel_h = _CEL_SIZE.unpack_from(buf, start)
+            data = (cel_w, cel_h, buf[start+_CEL_SIZE.size:end].tobytes())
+        case CelType.LINKED:
+            data = _U16.unpack_from(buf, start)[0]
+        case CelType.IMG_COMP:
+            cel_w, cel_h = _CEL_SIZE.unpack_from(buf, start)
+            pixels_start = start + _CEL_SIZE.size
+            if source is not None:
+                data = LazyPixelData(source, pixels_start, end - pixels_start, cel_w, cel_h, cache)
+            else:
+                data = (cel_w, cel_h, zlib.decompress(buf[pixels_start:end]))
+        case CelType.TILEMAP_COMP:
+            tilemap_header = _TILEMAP_HEADER.unpack_from(buf, start)
+            tiles_start = start + _TILEMAP_HEADER.size
+            if source is not None:
+                data = LazyTilesData(source, tiles_start, end - tiles_start, tilemap_header, cache)
+            else:
+                data = (*tilemap_header, zlib.decompress(buf[tiles_start:end]))
         case _: # invalid
             raise Exception(f"Invalid cel type `{cel_type}`")
     return Cel(layer_idx, Point(x_pos,y_pos), opacity, cel_type, z_index, data)
 
+def write_chunk_cel(f: BufferedWriter, cel: Cel, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Write a cel chunk. Compressed images that were loaded lazily (and are
+    not decompressed yet) are copied as-is, without compressing them again.
+    """
+    write_uint(f, cel.layer_idx, 2)
+    write_sint(f, cel.pos.x, 2)
+    write_sint(f, cel.pos.y, 2)
+    write_uint(f, cel.opacity, 1)
+    write_uint(f, cel.cel_type, 2)
+    write_sint(f, cel.z_index, 2)
+    write_ignore(f, 5)
+
+    match cel.cel_type:
+        case CelType.IMG_RAW:
+            cel_w, cel_h, pixels = cel.data
+            write_uint(f, cel_w, 2)
+            write_uint(f, cel_h, 2)
+            write_bytes(f, pixels)
+        case CelType.LINKED:
+            write_uint(f, cel.data, 2)
+        case CelType.IMG_COMP:
+            if isinstance(cel.data, LazyPixelData) and not cel.data.is_loaded():
+                cel_w, cel_h = cel.data.width, cel.data.height
+                pixels_compressed = cel.data.read_compressed()
+            else:
+                cel_w, cel_h, pixels = cel.data
+                pixels_compressed = zlib.compress(pixels, compression_level)
+            write_uint(f, cel_w, 2)
+            write_uint(f, cel_h, 2)
+            write_bytes(f, pixels_compressed)
+        case CelType.TILEMAP_COMP:
+            if isinstance(cel.data, LazyTilesData) and not cel.data.is_loaded():
+                tilemap_header = cel.data.tilemap_header
+                tiles_compressed = cel.data.read_compressed()
+            else:
+                *tilemap_header, tiles = cel.data
+                tiles_compressed = zlib.compress(tiles, compression_level)
+            write_bytes(f, _TILEMAP_HEADER.pack(*tilemap_header))
+            write_bytes(f, tiles_compressed)
+        case _: # invalid
+            raise Exception(f"Invalid cel type `{cel.cel_type}`")
+
 def read_chunk_cel_extra(f: BufferedReader, cel: Cel) -> None:
     flags = read_uint(f, 4)
     precise_x = read_fixed(f)
@@ -275,12 +635,29 @@ def read_chunk_cel_extra(f: BufferedReader, cel: Cel) -> None:
     cel.width = width
     cel.height = height
 
+def write_chunk_cel_extra(f: BufferedWriter, cel: Cel) -> None:
+    assert cel.flags is not None and cel.precise_pos is not None
+    assert cel.width is not None and cel.height is not None
+    write_uint(f, cel.flags, 4)
+    write_fixed(f, cel.precise_pos[0])
+    write_fixed(f, cel.precise_pos[1])
+    write_fixed(f, cel.width)
+    write_fixed(f, cel.height)
+    write_ignore(f, 16)
+
 
 
 # TODO? replace with just `list[Cel]`?
 @dataclass
 class Frame:
     cels: list[Cel]
+    duration: int = 100 # ms
+
+class FrameInfo(T):
+    offset: int     # of the frame header, from the start of the file
+    size: int       # including the frame header
+    duration: int
+    num_chunks: int
 
 
 @dataclass
@@ -301,23 +678,63 @@ def read_chunk_color_profile(f: BufferedReader) -> ColorProfile:
     gamma = read_fixed(f)
     _reserved = read_ignore(f,8)
 
-    print("      type: ", profile_type)
-    print("      flags:", profile_flags)
-    print("      gamma:", gamma)
+    logger.debug("Color profile: type %d, flags %d, gamma %s", profile_type, profile_flags, gamma)
 
     icc_data = None
 
     if profile_type == ColorProfileType.PROFILE_ICC:
-        print("       ICC profile!")
         icc_len = read_uint(f, 4)
-        print("       icc data len:", icc_len)
         icc_data = f.read(icc_len)
-        print("       icc data:", f"({len(icc_data)} bytes...)")
+        logger.debug("ICC profile: %d bytes", len(icc_data))
     return ColorProfile(profile_type, bool(profile_flags), gamma, icc_data)
 
+def write_chunk_color_profile(f: BufferedWriter, profile: ColorProfile) -> None:
+    write_uint(f, profile.profile_type, 2)
+    write_uint(f, int(profile.flags), 2)
+    write_fixed(f, profile.gamma)
+    write_ignore(f, 8)
+
+    if profile.profile_type == ColorProfileType.PROFILE_ICC:
+        icc_data = profile.data or b""
+        write_uint(f, len(icc_data), 4)
+        write_bytes(f, icc_data)
+
 
 
-# TODO: external files chunk
+class ExternalFile(T):
+    entry_id: int
+    file_type: int
+    filename: str   # or extension id
+
+class ExternalFileType(IntEnum):
+    PALETTE        = 0
+    TILESET        = 1
+    PROPERTIES     = 2  # extension name
+    TILE_MANAGEMENT = 3 # extension name
+
+def read_external_files_chunk(f: BufferedReader) -> list[ExternalFile]:
+    num_entries = read_uint(f, 4)
+    logger.debug("External files: %d", num_entries)
+    _reserved = read_ignore(f, 8)
+
+    entries = []
+    for _ in range(num_entries):
+        entry_id  = read_uint(f, 4)
+        file_type = read_uint(f, 1)
+        _reserved = read_ignore(f, 7)
+        filename  = read_string(f)
+        logger.debug("External file %d: type %d, %r", entry_id, file_type, filename)
+        entries.append(ExternalFile(entry_id, file_type, filename))
+    return entries
+
+def write_external_files_chunk(f: BufferedWriter, entries: list[ExternalFile]) -> None:
+    write_uint(f, len(entries), 4)
+    write_ignore(f, 8)
+    for entry_id, file_type, filename in entries:
+        write_uint(f, entry_id, 4)
+        write_uint(f, file_type, 1)
+        write_ignore(f, 7)
+        write_string(f, filename)
 
 
 @dataclass
@@ -331,7 +748,7 @@ class Tag:
 
 def read_tags_chunk(f: BufferedReader) -> list[Tag]:
     num_tags = read_uint(f, 2)
-    print("      num tags:", num_tags)
+    logger.debug("Tags: %d", num_tags)
     _reserved0 = read_ignore(f, 8)
 
     tags: list[Tag] = []
@@ -348,14 +765,26 @@ def read_tags_chunk(f: BufferedReader) -> list[Tag]:
 
         name = read_string(f)
 
-        print("      tag between:", f"{from_frame}-{to_frame}")
-        print("      loop dir:", loop_direction)
-        print("      repeat:", repeat_times)
-        print("      tag name:", name)
+        logger.debug("Tag %r: frames %d-%d, loop direction %d, repeat %d",
+                     name, from_frame, to_frame, loop_direction, repeat_times)
 
         tags.append(Tag(from_frame, to_frame, loop_direction, repeat_times, name))
     return tags
 
+def write_tags_chunk(f: BufferedWriter, tags: list[Tag]) -> None:
+    write_uint(f, len(tags), 2)
+    write_ignore(f, 8)
+
+    for tag in tags:
+        write_uint(f, tag.from_frame, 2)
+        write_uint(f, tag.to_frame, 2)
+        write_uint(f, tag.loop_direction, 1)
+        write_uint(f, tag.repeat_times, 2)
+        write_ignore(f, 6)
+        write_ignore(f, 3)  # deprecated tag color
+        write_ignore(f, 1)
+        write_string(f, tag.name)
+
 
 class Color(T):
     r: int
@@ -375,9 +804,7 @@ def read_palette_chunk(f: BufferedReader):
     last_idx  = read_uint(f, 4)
     _reserved = read_ignore(f, 8)
 
-    print("      pal size:", pal_size)
-    print("      first idx:", first_idx)
-    print("      last idx: ", last_idx)
+    logger.debug("Palette: size %d, entries %d-%d", pal_size, first_idx, last_idx)
 
     colors: list[Color] = []
     for _ in range(first_idx, last_idx+1):
@@ -390,11 +817,26 @@ def read_palette_chunk(f: BufferedReader):
         colors.append(Color(r, g, b, a, name))
     return Palette(pal_size, colors)
 
+def write_palette_chunk(f: BufferedWriter, pal: Palette) -> None:
+    write_uint(f, len(pal.colors), 4)
+    write_uint(f, 0, 4)
+    write_uint(f, len(pal.colors) - 1, 4)
+    write_ignore(f, 8)
+
+    for r, g, b, a, name in pal.colors:
+        write_uint(f, 0b1 if name is not None else 0, 2)
+        write_uint(f, r, 1)
+        write_uint(f, g, 1)
+        write_uint(f, b, 1)
+        write_uint(f, a, 1)
+        if name is not None:
+            write_string(f, name)
+
 def read_palette_chunk_old(f: BufferedReader):
     # TODO? does this work correctly for both old chunk ver.0 and ver.1?
     packets  = read_uint(f, 2)
 
-    print("      pal packets:", packets)
+    logger.debug("Old palette: %d packets", packets)
     colors: list[Color] = []
     pal_size = 0
 
@@ -422,7 +864,6 @@ class UserData:
 
 def read_user_data_chunk(f: BufferedReader):
     flags = read_uint(f, 4)
-    print("      user data flags:", bin(flags))
 
     text = read_string(f) if (flags & 0b1) != 0 else None
 
@@ -438,14 +879,163 @@ def read_user_data_chunk(f: BufferedReader):
     if (flags & 0b100) != 0:
         raise NotImplementedError("Properties maps not handled yet")
 
-    print("      text: ", text)
-    print("      color:", color)
-    print("      properties:", properties)
+    logger.debug("User data: flags 0x%x, text %r, color %s", flags, text, color)
 
     return UserData(text, color, properties)
 
 
 
+@dataclass
+class Tileset:
+    tileset_id: int
+    flags: int
+    num_tiles: int
+    tile_size: Point
+    base_index: int
+    name: str
+    # the pixels of all tiles, stacked vertically (so tile `i` starts at
+    # `tile_offset(i)`), or None if they are not in this file
+    pixels: bytes | None
+
+    # entry in the external files chunk, and the tileset id in that file
+    external_file_id: int | None = None
+    external_tileset_id: int | None = None
+
+    @property
+    def tile_pixels(self) -> int:
+        """Number of pixels in a single tile"""
+        return self.tile_size.x * self.tile_size.y
+
+    def tile_offset(self, tile_id: int, px_size: int) -> int:
+        """Offset of tile `tile_id` in `pixels`, in bytes"""
+        return tile_id * self.tile_pixels * px_size
+
+    def tile(self, tile_id: int, px_size: int) -> bytes:
+        """Get the pixels of tile `tile_id` (empty for missing tiles)"""
+        size = self.tile_pixels * px_size
+        if self.pixels is None or not 0 <= tile_id < self.num_tiles:
+            return bytes(size)
+        offset = self.tile_offset(tile_id, px_size)
+        return self.pixels[offset:offset+size]
+
+class TilesetFlags(IntFlag):
+    EXTERNAL_FILE = 1
+    TILES         = 2
+    EMPTY_TILE_0  = 4
+
+def read_tileset_chunk(f: BufferedReader) -> Tileset:
+    """Read a tileset chunk. The tiles are decompressed right away, into a
+    single buffer shared by all of them (see `Tileset.tile`).
+    """
+    tileset_id = read_uint(f, 4)
+    flags      = read_uint(f, 4)
+    num_tiles  = read_uint(f, 4)
+    tile_w     = read_uint(f, 2)
+    tile_h     = read_uint(f, 2)
+    base_index = read_sint(f, 2)
+    _reserved  = read_ignore(f, 14)
+    name       = read_string(f)
+
+    external_file_id = external_tileset_id = None
+    if flags & TilesetFlags.EXTERNAL_FILE:
+        external_file_id    = read_uint(f, 4)
+        external_tileset_id = read_uint(f, 4)
+
+    pixels = None
+    if flags & TilesetFlags.TILES:
+        size = read_uint(f, 4)
+        pixels = zlib.decompress(read_bytes(f, size))
+
+    logger.debug("Tileset %d %r: flags 0x%x, %d tiles of %dx%d, base index %d",
+                 tileset_id, name, flags, num_tiles, tile_w, tile_h, base_index)
+
+    return Tileset(tileset_id, flags, num_tiles, Point(tile_w, tile_h), base_index, name, pixels,
+                   external_file_id, external_tileset_id)
+
+def write_tileset_chunk(f: BufferedWriter, tileset: Tileset, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    write_uint(f, tileset.tileset_id, 4)
+    write_uint(f, tileset.flags, 4)
+    write_uint(f, tileset.num_tiles, 4)
+    write_uint(f, tileset.tile_size.x, 2)
+    write_uint(f, tileset.tile_size.y, 2)
+    write_sint(f, tileset.base_index, 2)
+    write_ignore(f, 14)
+    write_string(f, tileset.name)
+
+    if tileset.flags & TilesetFlags.EXTERNAL_FILE:
+        write_uint(f, tileset.external_file_id or 0, 4)
+        write_uint(f, tileset.external_tileset_id or 0, 4)
+
+    if tileset.flags & TilesetFlags.TILES:
+        pixels_compressed = zlib.compress(tileset.pixels or b"", compression_level)
+        write_uint(f, len(pixels_compressed), 4)
+        write_bytes(f, pixels_compressed)
+
+class TilesetCache:
+    """Tilesets read from external files, by path.
+
+    An entry is read again once the modification time of its file changes,
+    so documents sharing a tileset file only decode it once per session.
+    """
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[int, dict[int, Tileset]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> dict[int, Tileset]:
+        """Get the tilesets of the aseprite file at `path`, by tileset id"""
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        tilesets = {
+            chunk.data.tileset_id: chunk.data
+            for _, chunks in _iter_ase_frames(path, True, None, {ChunkType.TILESET})
+            for chunk in chunks
+        }
+        logger.debug("Read %d tileset(s) from %s", len(tilesets), path)
+
+        with self._lock:
+            self._entries[path] = (mtime, tilesets)
+        return tilesets
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+tileset_cache = TilesetCache()
+
+def resolve_external_tilesets(ase: AsepriteFile, directory: str, cache: TilesetCache = tileset_cache) -> None:
+    """Get the tiles of the tilesets in `ase` that are stored in external
+    files, relative to `directory`. Missing files are only logged.
+    """
+    for tileset_id, tileset in ase.tilesets.items():
+        if tileset.pixels is not None or tileset.external_file_id is None:
+            continue
+
+        entry = ase.external_files.get(tileset.external_file_id)
+        if entry is None:
+            logger.warning("Tileset %d: no external file with id %d", tileset_id, tileset.external_file_id)
+            continue
+
+        path = os.path.join(directory, entry.filename)
+        try:
+            external = cache.get(path).get(tileset.external_tileset_id)
+        except OSError as e:
+            logger.warning("Tileset %d: can't read external file: %s", tileset_id, e)
+            continue
+
+        if external is None or external.pixels is None:
+            logger.warning("Tileset %d: no tileset %d in %s", tileset_id, tileset.external_tileset_id, path)
+            continue
+
+        ase.tilesets[tileset_id] = replace(tileset, num_tiles=external.num_tiles, tile_size=external.tile_size, pixels=external.pixels)
+
+
+
 @dataclass
 class AsepriteFileHeader:
     num_frames: int
@@ -467,11 +1057,8 @@ def read_ase_header(f: BufferedReader):
     file_size = read_uint(f, 4)
     magic = read_uint(f, 2)
 
-    print("File size:", file_size)
-    print(f"Magic number: 0x{magic:04X} (valid? {magic == 0xA5E0})")
-
     if magic != 0xA5E0:
-        print("Invalid aseprite file! returning...")
+        logger.warning("Invalid aseprite file (magic number 0x%04X)", magic)
         f.close()
         return
 
@@ -504,19 +1091,10 @@ def read_ase_header(f: BufferedReader):
     # 84 zero bytes...
     read_ignore(f, 84)
 
-    print("Frames:", num_frames)
-    print("Width: ", width)
-    print("Height:", height)
-    print("bpp:   ", 8)
-    print("flags: ", flags)
-    print("trans pal idx:", trans_idx)
-    print("colors:", num_colors)
-    print("px_w:  ", px_w)
-    print("px_h:  ", px_h)
-    print("grid_x:", grid_x)
-    print("grid_y:", grid_y)
-    print("grid_w:", grid_w)
-    print("grid_h:", grid_h)
+    logger.debug("Header: %d bytes, %d frame(s), %dx%d, %d bpp, flags %d, transparent index %d, %d colors, "
+                 "pixel size %dx%d, grid (%d, %d, %d, %d)",
+                 file_size, num_frames, width, height, bpp, flags, trans_idx, num_colors,
+                 px_w, px_h, grid_x, grid_y, grid_w, grid_h)
 
     return AsepriteFileHeader(
         num_frames,
@@ -530,6 +1108,50 @@ def read_ase_header(f: BufferedReader):
         Rect(grid_x, grid_y, grid_w, grid_h)
     )
 
+def read_ase_header_buffer(buf: memoryview) -> AsepriteFileHeader | None:
+    (
+        file_size, magic, num_frames, width, height, bpp, flags, speed,
+        trans_idx, num_colors, px_w, px_h, grid_x, grid_y, grid_w, grid_h
+    ) = _HEADER.unpack_from(buf, 0)
+
+    if magic != 0xA5E0:
+        logger.warning("Invalid aseprite file (magic number 0x%04X)", magic)
+        return
+
+    logger.debug("Header: %d bytes, %d frame(s), %dx%d, %d bpp", file_size, num_frames, width, height, bpp)
+
+    return AsepriteFileHeader(
+        num_frames,
+        Point(width, height),
+        bpp,
+        flags,
+        speed,
+        trans_idx,
+        num_colors,
+        Point(px_w, px_h),
+        Rect(grid_x, grid_y, grid_w, grid_h)
+    )
+
+def write_ase_header(f: BufferedWriter, header: AsepriteFileHeader, file_size: int) -> None:
+    f.write(_HEADER.pack(
+        file_size,
+        0xA5E0,
+        header.num_frames,
+        header.bounds.x,
+        header.bounds.y,
+        header.bpp,
+        header.flags,
+        header.speed,
+        header.trans_idx,
+        header.num_colors,
+        header.px_size.x,
+        header.px_size.y,
+        header.grid.x,
+        header.grid.y,
+        header.grid.w,
+        header.grid.h,
+    ))
+
 
 
 @dataclass
@@ -539,484 +1161,1327 @@ class AsepriteFile:
     layers:  list[Layer]
     frames:  list[Frame]
     color_profile: ColorProfile | None
-    # external_files # TODO
     tags:      list[Tag] | None
     user_data: list[UserData] | None  #TODO!!!
     # slice     # TODO
-    # tileset   # TODO
 
-def read_ase_file(filename: str):
+    # where the file was read from, used to parse frames on demand
+    filename:    str | None = None
+    frame_index: list[FrameInfo] | None = None
+
+    # by tileset id, and by entry id
+    tilesets: dict[int, Tileset] = field(default_factory=dict)
+    external_files: dict[int, ExternalFile] = field(default_factory=dict)
+
+    _frame_cache: dict[int, Frame] = field(default_factory=dict, repr=False, compare=False)
+
+    def frame(self, n: int) -> Frame:
+        """Get frame `n`, parsing it from `filename` if it's not loaded yet (see `read_ase_index`)"""
+        if len(self.frames) == self.header.num_frames:
+            return self.frames[n]
+
+        frame = self._frame_cache.get(n)
+        if frame is None:
+            frame = read_ase_frame(self, n)
+            self._frame_cache[n] = frame
+        return frame
+
+_CEL_CHUNK_TYPES = frozenset({ChunkType.CEL, ChunkType.CEL_EXTRA})
+_METADATA_CHUNK_TYPES = frozenset(ChunkType) - _CEL_CHUNK_TYPES
+_PROBE_CHUNK_TYPES = frozenset({ChunkType.LAYER, ChunkType.TAGS})
+
+class Chunk(T):
+    frame: int
+    chunk_type: int
+    offset: int     # of the chunk header, from the start of the file
+    data: Any       # Layer, Cel, Palette, list[Tag], ColorProfile, UserData, Tileset, list[ExternalFile]
+
+def read_chunk_data(f: BufferedReader, chunk_type: int, chunk_size: int, use_uuid: bool, source=None, cache: PixelCache | None = None):
+    """Read and return the data of a single chunk (except cel extra chunks, see `read_chunk_cel_extra`)
+
+    See `read_chunk_cel` for `source` and `cache`.
+    """
+    match chunk_type:
+        case ChunkType.PALETTE_OLD0:
+            return read_palette_chunk_old(f)
+        case ChunkType.PALETTE_OLD1:
+            # TODO: does this one work correctly? (is this chunk ever used anyway...?)
+            return read_palette_chunk_old(f)
+        case ChunkType.LAYER:
+            return read_chunk_layer(f, use_uuid)
+        case ChunkType.CEL:
+            return read_chunk_cel(f, chunk_size, source, cache)
+        case ChunkType.COLOR_PROFILE:
+            return read_chunk_color_profile(f)
+        case ChunkType.TAGS:
+            return read_tags_chunk(f)
+        case ChunkType.PALETTE:
+            return read_palette_chunk(f)
+        case ChunkType.USER_DATA:
+            return read_user_data_chunk(f)
+        case ChunkType.TILESET:
+            return read_tileset_chunk(f)
+        case ChunkType.EXTERNAL_FILES:
+            return read_external_files_chunk(f)
+        case _:
+            read_ignore(f, chunk_size)
+            raise NotImplementedError(f"Currently not implemented for type: {chunk_type}")
+
+def add_chunk(ase: AsepriteFile, cels: list[Cel], chunk_type: int, data) -> None:
+    """Add the `data` of a chunk to `ase` (or `cels`, for the current frame)"""
+    match chunk_type:
+        case ChunkType.PALETTE_OLD0 | ChunkType.PALETTE_OLD1:
+            if ase.palette is None:
+                ase.palette = data
+        case ChunkType.LAYER:
+            ase.layers.append(data)
+        case ChunkType.CEL:
+            cels.append(data)
+        case ChunkType.COLOR_PROFILE:
+            ase.color_profile = data
+        case ChunkType.TAGS:
+            ase.tags = data
+        case ChunkType.PALETTE:
+            ase.palette = data
+        case ChunkType.USER_DATA:
+            assert ase.user_data is not None
+            ase.user_data.append(data)
+        case ChunkType.TILESET:
+            ase.tilesets[data.tileset_id] = data
+        case ChunkType.EXTERNAL_FILES:
+            ase.external_files.update((entry.entry_id, entry) for entry in data)
+
+def read_chunk(f: BufferedReader, ase: AsepriteFile, cels: list[Cel], chunk_type: int, chunk_size: int, source=None, cache: PixelCache | None = None) -> None:
+    """Read the data of a single chunk from `f` into `ase` (or `cels`, for the current frame)
+
+    See `read_chunk_cel` for `source` and `cache`.
+    """
+    if chunk_type == ChunkType.CEL_EXTRA:
+        # TODO: check if this one works too?
+        read_chunk_cel_extra(f, cels[-1])
+    else:
+        use_uuid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
+        add_chunk(ase, cels, chunk_type, read_chunk_data(f, chunk_type, chunk_size, use_uuid, source, cache))
+
+def read_ase_file(filename: str, use_mmap: bool = True, lazy: bool = False, cache: PixelCache | None = None, executor: Executor | None = None):
+    """Read an aseprite file.
+
+    By default the file is memory mapped and parsed with `read_ase_buffer`,
+    `read_ase_stream` is used as a fallback when the file can't be mapped.
+
+    With `lazy`, compressed cels are only decompressed (from the file) when
+    their pixels are first accessed, optionally keeping them in `cache`.
+    Otherwise, if an `executor` (e.g. a `ThreadPoolExecutor`) is given, the
+    cels are decompressed concurrently once the whole file has been parsed.
+    """
+    source = filename if lazy or executor is not None else None
+
     with open(filename, "rb") as f:
-        header = read_ase_header(f)
+        mm = None
+        if use_mmap:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # e.g. empty files, or files that don't support mapping
+                pass
+
+        if mm is not None:
+            with mm:
+                if not lazy and executor is not None:
+                    # decompress straight from the mapping, while it's still open
+                    ase = _read_ase_buffer(mm, mm, cache)
+                    if ase is not None:
+                        decompress_cels(ase, executor)
+                else:
+                    ase = _read_ase_buffer(mm, source, cache)
+        else:
+            ase = _read_ase_stream(f, source, cache)
+            if ase is not None and not lazy and executor is not None:
+                decompress_cels(ase, executor)
+
+    if ase is not None:
+        ase.filename = filename
+        resolve_external_tilesets(ase, os.path.dirname(filename))
+    return ase
+
+def decoded_size(ase: AsepriteFile) -> int:
+    """Bytes of decoded pixel data held by `ase` (cels and tilesets).
+
+    Lazily loaded cels count with their decompressed size, whether they are
+    decompressed yet or not, unless they are kept in a `PixelCache` (which
+    has a budget of its own).
+    """
+    px_size = ase.header.bpp // 8
+    size = sum(len(tileset.pixels) for tileset in ase.tilesets.values() if tileset.pixels is not None)
+    for frame in ase.frames:
+        for cel in frame.cels:
+            match cel.data:
+                case LazyPixelData() as lazy:
+                    if lazy.cache is None:
+                        size += lazy.decompressed_size(px_size)
+                case (_, _, bytes() | bytearray() as pixels):
+                    size += len(pixels)
+                case (*_, bytes() as tiles):
+                    size += len(tiles)
+    return size
+
+class CacheStats(T):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int       # bytes
+
+class AsepriteFileCache:
+    """Bounded LRU of parsed aseprite files, by path, size, mtime and whether
+    they were read lazily.
+
+    Entries are weighed by their decoded pixel data (see `decoded_size`),
+    and the least recently used ones are dropped once the total goes over
+    `max_bytes`. Files are shared between callers, so they must not be
+    modified.
+    """
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple[str, int, int, bool], tuple[AsepriteFile, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, filename: str, **kwargs) -> AsepriteFile | None:
+        """Get the aseprite file at `filename`, reading it with `read_ase_file`
+        (and `kwargs`) if it isn't cached, or has changed since it was.
+
+        Lazily and eagerly read files are cached separately, the other
+        `kwargs` only change how the same file is read.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns, bool(kwargs.get("lazy")))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        ase = read_ase_file(filename, **kwargs)
+        if ase is not None:
+            self.put(key, ase)
+        return ase
+
+    def put(self, key: tuple[str, int, int, bool], ase: AsepriteFile) -> None:
+        size = decoded_size(ase)
+        with self._lock:
+            # older versions of the same file are never used again
+            for old_key in [k for k in self._entries if k[0] == key[0] and (k[1:3] != key[1:3] or k == key)]:
+                self.size -= self._entries.pop(old_key)[1]
+
+            self._entries[key] = (ase, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+        logger.debug("Cached %s (%d bytes), %d bytes in cache", key[0], size, self.size)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._entries), self.size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+def read_ase_buffer(buf, lazy: bool = False, cache: PixelCache | None = None, executor: Executor | None = None) -> AsepriteFile | None:
+    """Read an aseprite file from a bytes-like object (`bytes`, `mmap`, ...).
+
+    Headers are decoded in place with precompiled structs, and chunks are
+    located by their size, so only the chunk data itself is ever read.
+
+    With `lazy`, compressed cels keep a reference to `buf`, which must then
+    stay valid (e.g. the mmap not closed) until their pixels are used.
+    See `read_ase_file` for `executor`.
+    """
+    if lazy or executor is None:
+        return _read_ase_buffer(buf, buf if lazy else None, cache)
+
+    ase = _read_ase_buffer(buf, buf, cache)
+    if ase is not None:
+        decompress_cels(ase, executor)
+    return ase
+
+def decompress_cels(ase: AsepriteFile, executor: Executor) -> None:
+    """Decompress all lazily loaded cels (images and tilemaps) in `ase`,
+    spread over `executor`.
+
+    zlib releases the GIL while decompressing, so a `ThreadPoolExecutor` is
+    enough to decompress cels in parallel.
+    """
+    cels = [cel for frame in ase.frames for cel in frame.cels if isinstance(cel.data, LazyPixelData)]
+
+    # biggest cels first, so no worker is left with a big one at the end
+    cels.sort(key=lambda cel: cel.data.length, reverse=True)
+
+    for cel, pixels in zip(cels, executor.map(_load_cel_pixels, cels)):
+        cel.data = cel.data.with_pixels(pixels)
+
+def _load_cel_pixels(cel: Cel) -> bytes:
+    assert isinstance(cel.data, LazyPixelData)
+    return cel.data.load()
+
+def _read_ase_buffer(buf, source, cache: PixelCache | None) -> AsepriteFile | None:
+    f = BufferReader(buf)
+    try:
+        view = f.buf
+        if len(view) < _HEADER.size:
+            logger.warning("Invalid aseprite file (too small)")
+            return
+
+        header = read_ase_header_buffer(view)
 
         if header is None:
             return
 
-        print()
-        print("Individual frames:")
-
-        frames: list[Frame] = []
-        layers: list[Layer] = []
-        color_profile = None
-        palette = None
-        tags = None
-        user_data: list[UserData] = []
+        ase = AsepriteFile(header, None, [], [], None, None, [], frame_index=[])
+        assert ase.frame_index is not None
 
-        for frame in range(header.num_frames):
-            print(" Frame", frame)
-            frame_bytes = read_uint(f, 4)
-            frame_magic = read_uint(f, 2)
+        frame_offset = _HEADER.size
+        for _ in range(header.num_frames):
+            info = read_frame_header_buffer(view, frame_offset)
 
-            if frame_magic != 0xF1FA:
-                print("Invalid frame magic number! returning...")
+            if info is None:
+                logger.warning("Invalid frame magic number at offset %d", frame_offset)
                 return
 
-            frame_chunks_old = read_uint(f, 2)
-            frame_duration   = read_uint(f, 2)
-            _frame_reserved  = read_ignore(f, 2)
-            frame_chunks_new = read_uint(f, 4)
-
-            print("  Bytes:", frame_bytes)
-            # print("  Valid:", frame_magic == 0xF1FA)
-            print("  Duration:", frame_duration)
-            print("  Chunks (old):", frame_chunks_old)
-            print("  Chunks (new):", frame_chunks_new)
-
-            frame_chunks = frame_chunks_old if frame_chunks_new == 0 else frame_chunks_new
-
-            chunk_types: list[ChunkType] = []
-            # TODO: handle for tags etc...
-
-            cels: list[Cel] = []
-
-            for chunk in range(frame_chunks):
-                print()
-                print("  Chunk", chunk)
-                chunk_size = read_uint(f, 4)
-                print("    Chunk size:", chunk_size)
-                chunk_type = read_uint(f, 2)
-                print("    Chunk type:", f"0x{chunk_type:04x} ({ASE_CHUNK_TYPE_NAMES[chunk_type]})")
-
-                chunk_size = chunk_size - 4 - 2
-
-                match chunk_type:
-                    case ChunkType.PALETTE_OLD0:
-                        palette_ = read_palette_chunk_old(f)
-                        if palette is None:
-                            palette = palette_
-                    case ChunkType.PALETTE_OLD1:
-                        # TODO: does this one work correctly? (is this chunk ever used anyway...?)
-                        palette_ = read_palette_chunk_old(f)
-                        if palette is None:
-                            palette = palette_
-                    case ChunkType.LAYER:
-                        layers.append(read_chunk_layer(f, header.flags & 0b100 != 0))
-                    case ChunkType.CEL:
-                        cels.append(read_chunk_cel(f, chunk_size))
-                    case ChunkType.CEL_EXTRA:
-                        # TODO: check if this one works too?
-                        read_chunk_cel_extra(f, cels[-1])
-                    case ChunkType.COLOR_PROFILE:
-                        color_profile = read_chunk_color_profile(f)
-                    case ChunkType.TAGS:
-                        tags = read_tags_chunk(f)
-                    case ChunkType.PALETTE:
-                        palette = read_palette_chunk(f)
-                    case ChunkType.USER_DATA:
-                        user_data.append(read_user_data_chunk(f))
-                    case _:
-                        chunk_data = read_bytes(f, chunk_size)
-                        print("    Chunk data:", f"({len(chunk_data)} bytes...)")
-                        raise NotImplementedError(f"Currently not implemented for type: {chunk_type}")
-
-                chunk_types.append(chunk_type)
-            frames.append(Frame(cels))
-            print("  Final chunk types:")
-            [print(f"    {ASE_CHUNK_TYPE_NAMES[x]} ({hex(x)})") for x in chunk_types]
-
-        print()
-        print("got to the end!")
-
-        return AsepriteFile(
-            header,
-            palette,
-            layers,
-            frames,
-            color_profile,
-            # external_files # TODO
-            tags,
-            user_data,  #TODO!!!
-            # slice     # TODO
-            # tileset   # TODO
-        )
-
-
-
-def indexed_to_rgba(data: bytes, pal: Palette, bg_idx: int):
-    for x in data:
-        r,g,b,a,_ = pal.colors[x] if x != bg_idx else (0, 0, 0, 0, None)
-        yield r
-        yield g
-        yield b
-        yield a
-
-BLEND_MODES = [
-    "normal",
-    "multiply",
-    "screen",
-    "overlay",
-    "darken",
-    "lighten",
-    "dodge",
-    "burn",
-    "hard_light",
-    "soft_light_svg",
-    "subtract", # TODO: is `difference` actually different from subtract?
-    "exclusion",
-    "hue",
-    "saturation",
-    "color",
-    "luminosity_sai", #?
-    "addition",
-    "subtract",
-    "divide",
-]
-
-def load_document_from_ase(ase: AsepriteFile, name: str):
-    app = Krita.instance()
-
-    if ase.header.bpp == 16:
-        color_mode = "GRAYA"
-    else:
-        color_mode = "RGBA"
+            ase.frame_index.append(info)
+            ase.frames.append(read_frame_buffer(f, ase, info, source, cache))
+            frame_offset += info.size
 
-    d = app.createDocument(
-        ase.header.bounds.x,
-        ase.header.bounds.y,
-        name,
-        color_mode,
-        "U8",
-        "",
-        300.0
-    )
+        return ase
+    finally:
+        # the view must be released before e.g. a mmap can be closed
+        f.close()
+
+def read_frame_header_buffer(buf: memoryview, offset: int) -> FrameInfo | None:
+    (
+        frame_bytes, frame_magic, frame_chunks_old, frame_duration, frame_chunks_new
+    ) = _FRAME_HEADER.unpack_from(buf, offset)
+
+    if frame_magic != 0xF1FA:
+        return None
 
-    print("created document!")
+    frame_chunks = frame_chunks_old if frame_chunks_new == 0 else frame_chunks_new
+    return FrameInfo(offset, frame_bytes, frame_duration, frame_chunks)
 
-    # TODO: is this always created?
-    tmp_bg = d.nodeByName("Background")
+def iter_frame_chunks(f: BufferReader, info: FrameInfo, use_uuid: bool, frame: int = 0, source=None, cache: PixelCache | None = None, chunk_types=None) -> Iterator[Chunk]:
+    """Read the chunks of the frame at `info.offset` in `f.buf`, one at a time.
 
-    root = d.rootNode()
+    Only chunks with a type in `chunk_types` are read (all of them if `None`),
+    the others are skipped. Cel extra chunks are applied to the cel before
+    them, so each chunk is only yielded once the next one has been read.
+    """
+    view = f.buf
 
-    parent_node_stack = [root]
-    last_node = None
-    last_child_level = 0
+    trace = _trace
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Frame %d at %d: %d bytes, %d chunks, %d ms", frame, info.offset, info.size, info.num_chunks, info.duration)
 
-    nodes = []
-    groups_to_collapse = []
+    pending: Chunk | None = None
 
-    for layer in ase.layers:
-        print("Layer name:", layer.name)
-        print("child level:", layer.child_level)
+    chunk_offset = info.offset + _FRAME_HEADER.size
+    for _ in range(info.num_chunks):
+        chunk_size, chunk_type = _CHUNK_HEADER.unpack_from(view, chunk_offset)
 
-        if last_node is not None and layer.child_level != last_child_level:
-            if layer.child_level < last_child_level:
-                i = last_child_level
-                while layer.child_level < i:
-                    parent_node_stack.pop()
-                    i -= 1
+        if chunk_types is None or chunk_type in chunk_types:
+            if trace:
+                start_time = time.perf_counter()
+            if debug:
+                logger.debug("Chunk 0x%04x (%s): %d bytes", chunk_type, ASE_CHUNK_TYPE_NAMES.get(chunk_type), chunk_size)
+
+            data_offset = chunk_offset + _CHUNK_HEADER.size
+            data_size = chunk_size - _CHUNK_HEADER.size
+
+            if chunk_type == ChunkType.CEL_EXTRA:
+                if pending is not None and pending.chunk_type == ChunkType.CEL:
+                    f.seek(data_offset)
+                    read_chunk_cel_extra(f, pending.data)
             else:
-                parent_node_stack.append(last_node)
+                if chunk_type == ChunkType.CEL:
+                    data = read_chunk_cel_buffer(view, data_offset, data_size, source, cache)
+                else:
+                    f.seek(data_offset)
+                    data = read_chunk_data(f, chunk_type, data_size, use_uuid)
 
-        if layer.layer_type == 2:
-            raise NotImplementedError("Tilemap layer is not implemented")
+                if pending is not None:
+                    yield pending
+                pending = Chunk(frame, chunk_type, chunk_offset, data)
 
-        node = d.createNode(
-            layer.name,
-            "paintLayer" if layer.layer_type == 0 else "groupLayer"
-        )
+            if trace:
+                _log_chunk_trace(chunk_type, chunk_offset, chunk_size, start_time)
 
-        node.setVisible((layer.layer_flags & LayerFlags.VISIBLE) != 0)
-        node.setLocked(not (layer.layer_flags & LayerFlags.EDITABLE) != 0)
+        chunk_offset += chunk_size
 
-        if layer.layer_type == LayerType.GROUP and (layer.layer_flags & LayerFlags.GROUP_COLLAPSED) != 0:
-            groups_to_collapse.append(node)
+    if pending is not None:
+        yield pending
 
-        node.setOpacity(255 if layer.layer_type == 1 else layer.opacity)
+def read_frame_buffer(f: BufferReader, ase: AsepriteFile, info: FrameInfo, source=None, cache: PixelCache | None = None, chunk_types=None) -> Frame:
+    """Read the chunks of the frame at `info.offset` in `f.buf` into `ase` (see `iter_frame_chunks`)"""
+    use_uuid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
+    cels: list[Cel] = []
 
-        node.setBlendingMode(BLEND_MODES[layer.blend_mode])
+    for chunk in iter_frame_chunks(f, info, use_uuid, len(ase.frames), source, cache, chunk_types):
+        add_chunk(ase, cels, chunk.chunk_type, chunk.data)
 
-        # TODO: check layers to see if this is actually required?
-        if len(ase.frames) > 1:
-            node.enableAnimation()
+    return Frame(cels, info.duration)
 
-        parent_node_stack[-1].addChildNode(node, None)
-        nodes.append(node)
+def iter_chunks(filename: str, lazy: bool = False, cache: PixelCache | None = None) -> Iterator[Chunk]:
+    """Read the chunks of an aseprite file one at a time.
 
-        last_node = node
-        last_child_level = layer.child_level
+    Nothing is kept around once yielded, so this works with constant memory
+    for files of any size. See `read_ase_file` for `lazy` and `cache`, and
+    `read_ase_index` to get the header.
+    """
+    for _, chunks in _iter_ase_frames(filename, lazy, cache):
+        yield from chunks
 
-    if len(ase.frames) > 1:
-        d.setPlayBackRange(0,len(ase.frames))
+def iter_frames(filename: str, lazy: bool = False, cache: PixelCache | None = None) -> Iterator[Frame]:
+    """Read the frames of an aseprite file one at a time (see `iter_chunks`)
 
-    for i,frame in enumerate(ase.frames):
-        print(f"  frame: {i}")
-        d.setCurrentTime(i)
-        print("   current time:", d.currentTime())
-        for cel in frame.cels:
-            match cel.cel_type:
-                case CelType.IMG_RAW | CelType.IMG_COMP:
-                    print("   img cel type!")
-                    node = nodes[cel.layer_idx]
+    Only cels are read, use `read_ase_index` to get the header and metadata.
+    """
+    for info, chunks in _iter_ase_frames(filename, lazy, cache, _CEL_CHUNK_TYPES):
+        yield Frame([chunk.data for chunk in chunks], info.duration)
 
-                    x, y = cel.pos
-                    w, h, data = cel.data
-
-                    if ase.header.bpp == 32:    # RGBA
-                        img_data = QImage(data, w, h, QImage.Format.Format_RGBA8888).rgbSwapped()
-                    elif ase.header.bpp == 16:  # Grayscale
-                        img_data = QImage(data, w, h, QImage.Format.Format_Grayscale16)
-                    else:                       # Indexed
-                        bg_idx = ase.header.trans_idx if (ase.layers[cel.layer_idx].layer_flags & LayerFlags.BACKGROUND) == 0 else -1
-                        assert ase.palette is not None
-                        img_data = QImage(bytes(indexed_to_rgba(data, ase.palette, bg_idx)), w, h, QImage.Format.Format_RGBA8888).rgbSwapped()
-
-                    ptr = img_data.bits()
-                    ptr.setsize(img_data.sizeInBytes())
-                    node.setPixelData(QByteArray(ptr.asstring()), x, y, w, h)
-
-                    if len(ase.frames) > 1:
-                        d.setActiveNode(node)
-                        app.action("add_blank_frame").trigger()
-
-                case CelType.LINKED:
-                    print("   linked cel type!")
-                    raise NotImplementedError("Linked cels not implemented... yet")
-                case CelType.TILEMAP_COMP:
-                    print("   tilemap cel!")
-                    raise NotImplementedError("Tilemaps not implemented")
-
-    # TODO: for some reason, attempting to set the group nodes to collapsed
-    # like this does not seem to work, but running it in the plugin dev tools
-    # console, it suddenly works perfectly...
-    for node in groups_to_collapse:
-        node.setCollapsed(True)
-
-    # TODO: is it necessary to do it this way?
-    tmp_bg.remove()
-
-    # TODO: `AttributeError: 'Document' object has no attribute 'gridConfig'`
-    # grid_config = d.gridConfig()
-    # grid_config.setOffset((ase.header.grid.x,  ase.header.grid.y))
-    # grid_config.setSpacing((
-    #     16 if ase.header.grid.w == 0 else ase.header.grid.w,
-    #     16 if ase.header.grid.h == 0 else ase.header.grid.h
-    # ))
-    # d.setGridConfig(grid_config)
-
-    d.refreshProjection()
-    app.activeWindow().addView(d)
-
-def update_ase_file():
-    # TODO: update the current
-    ...
-
-def create_ase_from_document() -> AsepriteFile | None:
-    # TODO: create a new aseprite file from the document
-    app = Krita.instance()
-    d = app.activeDocument()
-
-    if d is None:
-        print("No active document to save!")
-        return None
+def _iter_ase_frames(filename: str, lazy: bool, cache: PixelCache | None, chunk_types=None) -> Iterator[tuple[FrameInfo, Iterator[Chunk]]]:
+    source = filename if lazy else None
 
-    # header
-    num_frames = 1 #d.animationLength() # TODO
-    bounds = Point(d.width(), d.height())
+    with open(filename, "rb") as file:
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            logger.warning("Invalid aseprite file (can't be mapped)")
+            return
 
-    if d.colorModel() != "RGBA" and d.colorModel() != "GRAYA":
-        raise Exception(f"Unsupported color mode: {d.colorModel()}")
+        with mm:
+            f = BufferReader(mm)
+            try:
+                if len(f.buf) < _HEADER.size:
+                    logger.warning("Invalid aseprite file (too small)")
+                    return
+
+                header = read_ase_header_buffer(f.buf)
+                if header is None:
+                    return
+
+                use_uuid = header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
+
+                frame_offset = _HEADER.size
+                for frame in range(header.num_frames):
+                    info = read_frame_header_buffer(f.buf, frame_offset)
+                    if info is None:
+                        logger.warning("Invalid frame magic number at offset %d", frame_offset)
+                        return
+
+                    yield info, iter_frame_chunks(f, info, use_uuid, frame, source, cache, chunk_types)
+                    frame_offset += info.size
+            finally:
+                # the view must be released before the mmap can be closed
+                f.close()
+
+def read_frame_index(f: BufferedReader, header: AsepriteFileHeader) -> list[FrameInfo] | None:
+    """Find all frames in `f` by skipping over them, only reading their headers"""
+    frame_index: list[FrameInfo] = []
+
+    offset = _HEADER.size
+    for _ in range(header.num_frames):
+        f.seek(offset)
+        frame_header = f.read(_FRAME_HEADER.size)
+        if len(frame_header) < _FRAME_HEADER.size:
+            return None
+
+        info = read_frame_header_buffer(memoryview(frame_header), 0)
+        if info is None:
+            return None
+
+        frame_index.append(info._replace(offset=offset))
+        offset += info.size
+
+    return frame_index
+
+def read_ase_index(filename: str) -> AsepriteFile | None:
+    """Read the header, frame index and metadata of an aseprite file, but no cels.
+
+    The metadata (layers, palette, tags, ...) is taken from the first frame.
+    Frames are then parsed one at a time with `AsepriteFile.frame`.
+    """
+    # unbuffered, so skipping over frames doesn't read any of their data
+    with open(filename, "rb", buffering=0) as f:
+        header = _read_header_only(f)
+        if header is None:
+            return
 
-    bpp = 16 if d.colorModel() == "GRAYA" else 32 # TODO: indexed (8 bpp)
-    header_flags = 0b011    #? TODO: check?
-    speed = 0
-    trans_idx = 0
-    num_colors = 1  # TODO
-    px_size = Point(1,1)    # TODO?
-    grid = Rect(0,0,16,16)  # TODO?
+        frame_index = read_frame_index(f, header)
+        if frame_index is None:
+            logger.warning("Invalid frame magic number")
+            return
 
-    header = AsepriteFileHeader(
-        num_frames,
-        bounds,
-        bpp,
-        header_flags,
-        speed,
-        trans_idx,
-        num_colors,
-        px_size,
-        grid,
-    )
+        ase = AsepriteFile(header, None, [], [], None, None, [], filename, frame_index)
 
-    # palette
-    # TODO
-    palette = Palette(num_colors, [Color(0,0,0,0,None)])
+        if frame_index:
+            read_frame_metadata(f, ase, frame_index[0])
 
-    # layers 
-    root = d.rootNode()
-    print("document nodes:")
-    _print_node_tree(root)
+    return ase
 
-    nodes = get_nodes(root)
-    layers = get_layers_from_nodes(nodes)
+def probe_ase_file(filename: str, metadata: bool = False) -> AsepriteFile | None:
+    """Read only the header of an aseprite file, for quickly cataloguing files.
 
-    # frames
-    frames: list[Frame] = []
-    for frame_num in range(header.num_frames):
-        cels = get_cels(nodes, frame_num)
-        frames.append(Frame(cels))
+    With `metadata`, the layers and tags are also read from the first frame.
+    Other chunks (including all cels) are skipped by their size without
+    being read. The returned file has no frames.
+    """
+    with open(filename, "rb", buffering=0) as f:
+        header = _read_header_only(f)
+        if header is None:
+            return
 
-    # color profile
-    profile_type = ColorProfileType.PROFILE_SRGB    #?
-    flags = False #?
-    gamma = Fixed(0,0) #?
-    icc_data = None
-    color_profile = ColorProfile(profile_type, flags, gamma, icc_data)
-
-    # tags
-    tags = None
-
-    # user data
-    user_data = None
-
-    return AsepriteFile(
-        header,
-        palette,
-        layers,
-        frames,
-        color_profile,
-        tags,
-        user_data
-    )
+        ase = AsepriteFile(header, None, [], [], None, None, None, filename)
 
-def get_nodes(node, child_level=0) -> list[Node]:
-    nodes = []
+        if metadata and header.num_frames > 0:
+            frame_header = f.read(_FRAME_HEADER.size)
+            if len(frame_header) < _FRAME_HEADER.size:
+                logger.warning("Invalid aseprite file (too small)")
+                return
 
-    for child in node.childNodes():
-        nodes.append((child, child_level))
-        if type(child) is GroupLayer:
-            child_children = get_nodes(child, child_level + 1)
-            nodes += [*child_children]
+            info = read_frame_header_buffer(memoryview(frame_header), 0)
+            if info is None:
+                logger.warning("Invalid frame magic number")
+                return
 
-    return nodes
+            read_frame_metadata(f, ase, info._replace(offset=_HEADER.size), _PROBE_CHUNK_TYPES)
 
-def get_layers_from_nodes(nodes) -> list[Layer]:
-    # TODO: multiple frames...
-    layers = []
+    return ase
 
-    print("nodes i got from the thing:")
-    for node, child_level in nodes:
-        print("   ", child_level, node.name(), node.type())
+def _read_header_only(f: BufferedReader) -> AsepriteFileHeader | None:
+    header_data = f.read(_HEADER.size)
+    if len(header_data) < _HEADER.size:
+        logger.warning("Invalid aseprite file (too small)")
+        return
 
-        visible = int(node.visible())
-        editable = int(node.locked()) << 1
-        lock_movement = 0 << 2 # ?
-        background = 0 << 3 # ?
-        prefer_linked_cels = 0 << 4 # ?
-        display_collapsed = int(node.collapsed()) << 5
-        reference_layer = 0 << 6 # ?
+    return read_ase_header_buffer(memoryview(header_data))
 
-        flags = reference_layer | display_collapsed | prefer_linked_cels | background | lock_movement | editable | visible
+def read_frame_metadata(f: BufferedReader, ase: AsepriteFile, info: FrameInfo, chunk_types=_METADATA_CHUNK_TYPES) -> None:
+    """Read the chunks in `chunk_types` of the frame at `info.offset` into `ase`.
 
-        # todo: tilemap (layer_type == 2)
-        layer_type = 0 if node.type() == "paintLayer" else 1
+    Only chunk headers are read for other chunks, which are then skipped.
+    """
+    use_uuid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
 
-        blend_mode = BLEND_MODES.index(node.blendingMode())
+    chunk_offset = info.offset + _FRAME_HEADER.size
+    for _ in range(info.num_chunks):
+        f.seek(chunk_offset)
+        chunk_header = f.read(_CHUNK_HEADER.size)
+        if len(chunk_header) < _CHUNK_HEADER.size:
+            logger.warning("Unexpected end of file at offset %d", chunk_offset)
+            return
 
-        opacity = 255 if layer_type == 1 else node.opacity()
+        chunk_size, chunk_type = _CHUNK_HEADER.unpack(chunk_header)
+
+        if chunk_type in chunk_types:
+            data = f.read(chunk_size - _CHUNK_HEADER.size)
+            add_chunk(ase, [], chunk_type, read_chunk_data(BufferReader(data), chunk_type, len(data), use_uuid))
+
+        chunk_offset += chunk_size
+
+def read_ase_frame(ase: AsepriteFile, n: int) -> Frame:
+    """Read the cels of frame `n` from `ase.filename`, using `ase.frame_index`"""
+    assert ase.filename is not None and ase.frame_index is not None
+
+    info = ase.frame_index[n]
+    with open(ase.filename, "rb") as f:
+        f.seek(info.offset)
+        data = f.read(info.size)
+
+    return read_frame_buffer(BufferReader(data), ase, info._replace(offset=0), chunk_types=_CEL_CHUNK_TYPES)
+
+class FileSnapshot(T):
+    """Where each frame and cel of a file is, and checksums of their bytes.
+
+    Used to find what changed in a file since it was last read, see
+    `snapshot_ase_file` and `changed_cels`.
+    """
+    metadata: bytes     # checksum of the header (except its size) and all non-cel chunks
+    frames: list[FrameInfo]
+    frame_digests: list[bytes]
+    cel_digests: dict[tuple[int, int], bytes]   # by (frame, layer), including cel extra chunks
+
+def _digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def snapshot_ase_buffer(buf) -> FileSnapshot | None:
+    """Take a `FileSnapshot` of the aseprite file in `buf`, without decoding any chunks.
+
+    Returns None if `buf` is not a complete aseprite file (e.g. one that is
+    only partially written), where any frame or chunk runs past its end.
+    """
+    with memoryview(buf) as view:
+        if len(view) < _HEADER.size or read_ase_header_buffer(view) is None:
+            return None
+
+        metadata = hashlib.blake2b(view[4:_HEADER.size], digest_size=16)
+        frames: list[FrameInfo] = []
+        frame_digests: list[bytes] = []
+        cel_digests: dict[tuple[int, int], bytes] = {}
+
+        offset = _HEADER.size
+        num_frames = _U16.unpack_from(view, 6)[0]
+        for frame in range(num_frames):
+            # files that are still being written end early
+            if offset + _FRAME_HEADER.size > len(view):
+                return None
+            info = read_frame_header_buffer(view, offset)
+            if info is None or info.size < _FRAME_HEADER.size or offset + info.size > len(view):
+                return None
+            frames.append(info)
+            frame_digests.append(_digest(view[offset:offset+info.size]))
+
+            # (layer, start) of the cel whose chunks are being read
+            cel: tuple[int, int] | None = None
+            chunk_offset = offset + _FRAME_HEADER.size
+            frame_end = offset + info.size
+            for _ in range(info.num_chunks):
+                if chunk_offset + _CHUNK_HEADER.size > frame_end:
+                    return None
+                chunk_size, chunk_type = _CHUNK_HEADER.unpack_from(view, chunk_offset)
+                if chunk_size < _CHUNK_HEADER.size or chunk_offset + chunk_size > frame_end:
+                    return None
+                if chunk_type == ChunkType.CEL and chunk_size < _CHUNK_HEADER.size + _U16.size:
+                    return None
+                if cel is not None and chunk_type != ChunkType.CEL_EXTRA:
+                    cel_digests[frame, cel[0]] = _digest(view[cel[1]:chunk_offset])
+                    cel = None
+
+                if chunk_type == ChunkType.CEL:
+                    cel = (_U16.unpack_from(view, chunk_offset + _CHUNK_HEADER.size)[0], chunk_offset)
+                elif chunk_type != ChunkType.CEL_EXTRA:
+                    metadata.update(view[chunk_offset:chunk_offset+chunk_size])
+                chunk_offset += chunk_size
+
+            if cel is not None:
+                cel_digests[frame, cel[0]] = _digest(view[cel[1]:chunk_offset])
+            metadata.update(_U16.pack(info.duration))
+            offset += info.size
+
+    return FileSnapshot(metadata.digest(), frames, frame_digests, cel_digests)
+
+def snapshot_ase_file(filename: str) -> FileSnapshot | None:
+    """Take a `FileSnapshot` of an aseprite file (see `snapshot_ase_buffer`)"""
+    with open(filename, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return snapshot_ase_buffer(f.read())
+        with mm:
+            return snapshot_ase_buffer(mm)
+
+def changed_cels(old: FileSnapshot, new: FileSnapshot) -> set[tuple[int, int]] | None:
+    """Get the (frame, layer) of all cels that were changed, added or removed
+    between two snapshots of a file.
+
+    Returns None if anything other than cels changed (layers, palette, the
+    number of frames or their durations, ...), which needs a full reload.
+    """
+    if old.metadata != new.metadata:
+        return None
 
-        name = node.name()
+    changed = set()
+    for frame, (old_digest, new_digest) in enumerate(zip(old.frame_digests, new.frame_digests)):
+        if old_digest == new_digest:
+            continue
+        for key in {k for k in old.cel_digests if k[0] == frame} | {k for k in new.cel_digests if k[0] == frame}:
+            if old.cel_digests.get(key) != new.cel_digests.get(key):
+                changed.add(key)
+    return changed
+
+def reload_ase_frames(ase: AsepriteFile, filename: str, frames: set[int], snapshot: FileSnapshot) -> None:
+    """Read the cels of `frames` from `filename` again, replacing them in `ase`.
+
+    `snapshot` must be of the current file. Other frames are kept as they
+    are, so this only works if nothing but cels changed (see `changed_cels`).
+    """
+    with open(filename, "rb") as f:
+        for n in sorted(frames):
+            info = snapshot.frames[n]
+            f.seek(info.offset)
+            data = f.read(info.size)
+            ase.frames[n] = read_frame_buffer(BufferReader(data), ase, info._replace(offset=0), chunk_types=_CEL_CHUNK_TYPES)
+    ase.frame_index = list(snapshot.frames)
 
-        tileset_idx = None
-        uuid = None
+def read_ase_stream(f: BufferedReader, lazy: bool = False, cache: PixelCache | None = None):
+    """Read an aseprite file field by field from an open file
 
-        layers.append(Layer(flags, layer_type, child_level, blend_mode, opacity, name, tileset_idx, uuid))
-        # print(f"  added layer: {layers[-1]}")
+    With `lazy`, compressed cels are read back from `f.name` when used.
+    """
+    return _read_ase_stream(f, f.name if lazy else None, cache)
 
-    return layers
+def _read_ase_stream(f: BufferedReader, source, cache: PixelCache | None):
+    header = read_ase_header(f)
 
-def get_cels(nodes: list[tuple[Node, int]], frame_num: int) -> list[Cel]:
-    cels: list[Cel] = []
+    if header is None:
+        return
 
-    for i, (node, child_level) in enumerate(nodes):
-        rect = node.bounds()
-        x = rect.x()
-        y = rect.y()
-        w = rect.width()
-        h = rect.height()
-        print(f"  node {node.name()} bounds?:", x,y,w,h)
+    ase = AsepriteFile(header, None, [], [], None, None, [], frame_index=[])
+    assert ase.frame_index is not None
 
-        opacity = 255 # node.opacity()  #??
+    trace = _trace
+    debug = logger.isEnabledFor(logging.DEBUG)
 
-        z_index = 0 # ?
+    for frame in range(header.num_frames):
+        frame_offset = f.tell()
+        frame_bytes = read_uint(f, 4)
+        frame_magic = read_uint(f, 2)
 
-        cel_type = 2
-        pixeldata = node.pixelData(x,y,w,h)
+        if frame_magic != 0xF1FA:
+            logger.warning("Invalid frame magic number at offset %d", frame_offset)
+            return
 
-        assert type(pixeldata) == QByteArray
+        frame_chunks_old = read_uint(f, 2)
+        frame_duration   = read_uint(f, 2)
+        _frame_reserved  = read_ignore(f, 2)
+        frame_chunks_new = read_uint(f, 4)
 
-        pixels = zlib.compress(pixeldata)
-        data = (w, h, pixels)
+        frame_chunks = frame_chunks_old if frame_chunks_new == 0 else frame_chunks_new
+        ase.frame_index.append(FrameInfo(frame_offset, frame_bytes, frame_duration, frame_chunks))
 
-        # todo: anything other than non-indexed rgba images...
-        cels.append(Cel(i, Point(x,y), opacity, cel_type, z_index, data))
-        print(f"   appended cel with layer_idx:{i} at {x,y,w,h}, opacity {opacity}, celtype: {cel_type} z_index {z_index} and {len(pixels)} bytes (pre comp: {len(pixeldata)})")
+        if debug:
+            logger.debug("Frame %d at %d: %d bytes, %d chunks (old: %d), %d ms",
+                         frame, frame_offset, frame_bytes, frame_chunks, frame_chunks_old, frame_duration)
 
-    return cels
+        # TODO: handle for tags etc...
 
-def _print_node_tree(node, level=0):
-    for child in node.childNodes():
-        print("  "*level, child.name(), child.type())
-        if type(child) is GroupLayer:
-            _print_node_tree(child, level+1)
+        cels: list[Cel] = []
+
+        for _ in range(frame_chunks):
+            chunk_offset = f.tell()
+            if trace:
+                start_time = time.perf_counter()
+
+            chunk_size = read_uint(f, 4)
+            chunk_type = read_uint(f, 2)
+
+            if debug:
+                logger.debug("Chunk 0x%04x (%s): %d bytes", chunk_type, ASE_CHUNK_TYPE_NAMES.get(chunk_type), chunk_size)
+
+            read_chunk(f, ase, cels, chunk_type, chunk_size - 4 - 2, source, cache)
+
+            if trace:
+                _log_chunk_trace(chunk_type, chunk_offset, chunk_size, start_time)
+
+        ase.frames.append(Frame(cels, frame_duration))
+
+    return ase
+
+
+
+def palette_lut(pal: Palette, trans_idx: int, bgra: bool = False) -> bytes:
+    """Build a 256 entry RGBA (or BGRA) lookup table for `pal`.
+
+    `trans_idx` is the fully transparent index, or -1 for none.
+    """
+    lut = bytearray(256 * 4)
+    for i, (r, g, b, a, _) in enumerate(pal.colors[:256]):
+        lut[i*4:i*4+4] = (b, g, r, a) if bgra else (r, g, b, a)
+
+    if 0 <= trans_idx < 256:
+        lut[trans_idx*4:trans_idx*4+4] = bytes(4)
+    return bytes(lut)
+
+def layer_palette_lut(ase: AsepriteFile, layer_idx: int, luts: dict[tuple[int, bool], bytes], bgra: bool = False) -> bytes:
+    """Get the lookup table for cels in layer `layer_idx`, cached in `luts`
+    by transparent index and channel order.
+
+    Only non-background layers use the transparent index, so at most two
+    tables are ever built for the palette of `ase` (per channel order).
+    """
+    layer = ase.layers[layer_idx]
+    trans_idx = ase.header.trans_idx if (layer.layer_flags & LayerFlags.BACKGROUND) == 0 else -1
+
+    lut = luts.get((trans_idx, bgra))
+    if lut is None:
+        assert ase.palette is not None
+        lut = palette_lut(ase.palette, trans_idx, bgra)
+        luts[trans_idx, bgra] = lut
+    return lut
+
+def swap_red_blue(data: bytes) -> bytearray:
+    """Convert RGBA pixels to BGRA (or the other way around).
+
+    The result is written straight into a single new buffer, which can be
+    handed to Krita as is (so there's no other full copy of the pixels).
+    """
+    pixels = bytearray(data)
+
+    if np is not None:
+        # strided copies of the two channels, without any temporary arrays
+        src = np.frombuffer(data, dtype=np.uint8).reshape(-1, 4)
+        dst = np.frombuffer(pixels, dtype=np.uint8).reshape(-1, 4)
+        dst[:, 0] = src[:, 2]
+        dst[:, 2] = src[:, 0]
+        return pixels
+
+    pixels[0::4] = data[2::4]
+    pixels[2::4] = data[0::4]
+    return pixels
+
+def indexed_to_rgba(data: bytes, lut: bytes) -> bytes:
+    """Convert indexed pixels to 4 bytes per pixel using `lut` (see `palette_lut`)"""
+    if np is not None:
+        return np.frombuffer(lut, dtype=np.uint32)[np.frombuffer(data, dtype=np.uint8)].tobytes()
+
+    # one `translate` per channel, interleaved with strided slice assignment
+    pixels = bytearray(len(data) * 4)
+    for channel in range(4):
+        pixels[channel::4] = data.translate(lut[channel::4])
+    return bytes(pixels)
+
+def find_linked_sources(ase: AsepriteFile) -> set[tuple[int, int]]:
+    """Get the (frame, layer) of all cels that linked cels in `ase` point to"""
+    return {
+        (cel.data, cel.layer_idx)
+        for frame in ase.frames
+        for cel in frame.cels
+        if cel.cel_type == CelType.LINKED
+    }
+
+def link_source(cels: dict[int, Cel], frame: int) -> int:
+    """Follow links to linked cels, from the cel in `frame`, to the frame of
+    the image cel they end at. `cels` are the cels of a layer, by frame.
+    """
+    for _ in range(len(cels)):  # no endless loops for broken files
+        cel = cels.get(frame)
+        if cel is None or cel.cel_type != CelType.LINKED:
+            break
+        frame = cel.data
+    return frame
+
+def cel_to_krita_pixels(ase: AsepriteFile, cel: Cel, luts: dict[tuple[int, bool], bytes]) -> bytes | bytearray:
+    """Convert the pixels of an image cel to the format of Krita documents,
+    to be passed to `Node.setPixelData` directly.
+
+    `luts` caches palette lookup tables, see `layer_palette_lut`.
+    """
+    _, _, data = cel.data
+
+    if ase.header.bpp == 8:     # Indexed, straight to BGRA
+        lut = layer_palette_lut(ase, cel.layer_idx, luts, bgra=True)
+        return indexed_to_rgba(data, lut)
+    if ase.header.bpp == 32:    # RGBA, swapped in a single pass
+        return swap_red_blue(data)
+
+    # Grayscale: value and alpha bytes, same as in GRAYA/U8 documents
+    return data
+
+def flip_tile(tile: bytes, w: int, h: int, px_size: int, x_flip: bool, y_flip: bool, d_flip: bool) -> bytes:
+    """Flip a `w`x`h` tile. The diagonal flip (only for square tiles) comes first"""
+    stride = w * px_size
+    rows = [tile[r*stride:(r+1)*stride] for r in range(h)]
+
+    if d_flip:
+        rows = [b"".join(row[c*px_size:(c+1)*px_size] for row in rows) for c in range(w)]
+    if x_flip:
+        if px_size == 1:
+            rows = [row[::-1] for row in rows]
+        else:
+            rows = [b"".join(row[i:i+px_size] for i in range(stride - px_size, -1, -px_size)) for row in rows]
+    if y_flip:
+        rows.reverse()
+    return b"".join(rows)
+
+def render_tilemap(data: TilesData, tileset: Tileset, px_size: int, variants: dict[tuple[int, int, int], bytes]) -> RawPixelData:
+    """Render the tiles of a tilemap cel to an image with `px_size` bytes per pixel.
+
+    `variants` caches the (flipped) tiles by (tileset id, tile id, flip
+    flags), so each variant of a tile is only built once, however many
+    times it is used. The image is assembled one row of tiles at a time
+    (or all at once, with numpy), not per pixel.
+    """
+    tiles_w, tiles_h, tiles_bpp, mask_id, mask_x, mask_y, mask_d, tiles = data
+    tile_w, tile_h = tileset.tile_size
+    mask_flip = mask_x | mask_y | mask_d
+
+    code = {8: "B", 16: "H", 32: "I"}[tiles_bpp]
+    words = struct.unpack_from(f"<{tiles_w*tiles_h}{code}", tiles)
+
+    def variant(word: int) -> bytes:
+        key = (tileset.tileset_id, word & mask_id, word & mask_flip)
+        tile = variants.get(key)
+        if tile is None:
+            tile = tileset.tile(word & mask_id, px_size)
+            if word & mask_flip:
+                tile = flip_tile(tile, tile_w, tile_h, px_size, word & mask_x != 0, word & mask_y != 0, word & mask_d != 0)
+            variants[key] = tile
+        return tile
+
+    w = tiles_w * tile_w
+    h = tiles_h * tile_h
+
+    if np is not None:
+        # only what matters for the tile, so equal tiles get the same index
+        words = np.array(words, dtype=np.uint32) & np.uint32(mask_id | mask_flip)
+        unique, inverse = np.unique(words, return_inverse=True)
+        stack = np.stack([np.frombuffer(variant(int(word)), dtype=np.uint8) for word in unique])
+        pixels = (stack[inverse.reshape(-1)]
+                  .reshape(tiles_h, tiles_w, tile_h, tile_w * px_size)
+                  .transpose(0, 2, 1, 3)
+                  .tobytes())
+        return (w, h, pixels)
+
+    stride = tile_w * px_size
+    lines = []
+    for ty in range(tiles_h):
+        row = [variant(word) for word in words[ty*tiles_w:(ty+1)*tiles_w]]
+        for line in range(0, tile_h * stride, stride):
+            lines.append(b"".join(tile[line:line+stride] for tile in row))
+    return (w, h, b"".join(lines))
+
+# highest frame rate used for imported animations, see `frame_times`
+MAX_FPS = 60
+
+def frame_times(durations: list[int]) -> tuple[int, list[int], int]:
+    """Fit frames with the given durations (in ms) to a fixed frame rate.
+
+    Returns the frame rate, the time (in frames at that rate) each frame
+    starts at, and the time the last one ends. The rate is based on the
+    greatest common divisor of the durations, so that frames with different
+    durations keep them exactly where possible.
+    """
+    durations = [max(duration, 1) for duration in durations]
+    fps = max(1, min(round(1000 / math.gcd(*durations)), MAX_FPS))
+
+    times = []
+    start = 0
+    prev = -1
+    for duration in durations:
+        frame_time = max(round(start * fps / 1000), prev + 1)
+        times.append(frame_time)
+        prev = frame_time
+        start += duration
+
+    return fps, times, max(round(start * fps / 1000), prev + 1)
+
+class Keyframe(T):
+    frame: int
+    x: int
+    y: int
+    w: int
+    h: int
+    pixels: bytes | bytearray | None    # in the format of Krita documents, None for empty keyframes
 
+    def key(self) -> KeyframeKey:
+        return KeyframeKey(self.frame, self.x, self.y, self.w, self.h, None if self.pixels is None else _digest(self.pixels))
 
-def save_ase_file(ase: AsepriteFile, filename: str):
-    # TODO: save aseprite file where we already have one loaded
-    ...
-    QDialog()
-    "WARNING!\nThis plugin does not implement all features of aseprite files,"
-    "meaning you WILL MOST LIKELY LOSE DATA if you overwrite a file created with aseprite."
-    "Use at your own risk, you have been warned!"
+class KeyframeKey(T):
+    """A `Keyframe` without its pixels, only a digest of them, to compare
+    keyframes against later without holding on to their pixels.
+    """
+    frame: int
+    x: int
+    y: int
+    w: int
+    h: int
+    digest: bytes | None    # see `_digest`, None for empty keyframes
+
+def prepare_keyframes(ase: AsepriteFile, layers: set[int] | None = None, reuse: dict[tuple[int, int], Keyframe] | None = None) -> list[list[Keyframe]]:
+    """Get the keyframes of each layer in `ase`, with their pixels converted
+    for `Node.setPixelData` (see `cel_to_krita_pixels`).
+
+    This is all the work of loading a file that doesn't need Krita, so it
+    can be done on another thread. Linked cels share the converted pixels
+    of the cel they point to, and only get a keyframe of their own where
+    the layer changes. Frames where a layer has no cel get an empty
+    keyframe, as Krita would show the previous one otherwise.
+
+    Only the layers in `layers` are prepared, if given (the others get no
+    keyframes). Keyframes in `reuse`, by (frame, layer), are used as they
+    are for image cels instead of converting them again.
+
+    All layers are converted up front, see `iter_keyframes` to only hold the
+    pixels of a few layers at a time.
+    """
+    return list(iter_keyframes(ase, layers, reuse))
+
+def iter_keyframes(ase: AsepriteFile, layers: set[int] | None = None, reuse: dict[tuple[int, int], Keyframe] | None = None,
+                   executor: Executor | None = None, ahead: int = 2) -> Iterator[list[Keyframe]]:
+    """Get the keyframes of each layer in `ase`, like `prepare_keyframes`,
+    but one layer at a time, each only converted once it's needed.
+
+    With an `executor`, up to `ahead` layers past the one being used are
+    converted on it in the meantime, so the pixels of only a few layers are
+    held at once. Layers are independent of each other, apart from the
+    palette and tile caches they share (which only ever get the same
+    values, from any thread).
+    """
+    # palette lookup tables, for indexed images
+    luts: dict[tuple[int, bool], bytes] = {}
+
+    # flipped tiles, see `render_tilemap`
+    variants: dict[tuple[int, int, int], bytes] = {}
+
+    # the cels of each layer, with their frame
+    layer_cels: list[list[tuple[int, Cel]]] = [[] for _ in ase.layers]
+    for i, frame in enumerate(ase.frames):
+        for cel in frame.cels:
+            if layers is None or cel.layer_idx in layers:
+                layer_cels[cel.layer_idx].append((i, cel))
 
-    with open(filename, "wb") as f:
-        print("Todo: write some bytes")
-        f.close()
+    if executor is None:
+        for layer_idx, cels in enumerate(layer_cels):
+            yield _layer_keyframes(ase, layer_idx, cels, reuse, luts, variants)
+        return
 
-def load_main():
-    file = QFileDialog().getOpenFileName(caption="Open Aseprite file...", filter="Aseprite files (*.ase *.aseprite)")
+    pending: deque[Future] = deque()
+    try:
+        for layer_idx, cels in enumerate(layer_cels):
+            pending.append(executor.submit(_layer_keyframes, ase, layer_idx, cels, reuse, luts, variants))
+            if len(pending) > ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # e.g. the caller stopped early
+        for future in pending:
+            future.cancel()
+
+def _layer_keyframes(ase: AsepriteFile, layer_idx: int, cels: list[tuple[int, Cel]], reuse: dict[tuple[int, int], Keyframe] | None,
+                     luts: dict[tuple[int, bool], bytes], variants: dict[tuple[int, int, int], bytes]) -> list[Keyframe]:
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    keyframes: list[Keyframe] = []
+
+    # converted pixels of the cels that linked cels point to, by frame
+    linked_sources = {cel.data for _, cel in cels if cel.cel_type == CelType.LINKED}
+    shared: dict[int, Keyframe] = {}
+    layer_frames = dict(cels)
+
+    # (source frame, last frame) of the keyframe the layer currently shows
+    held: tuple[int, int] | None = None
+
+    for i, cel in cels:
+        if held is not None and held[1] < i - 1:
+            keyframes.append(Keyframe(held[1] + 1, 0, 0, 0, 0, None))
+            held = None
+
+        match cel.cel_type:
+            case CelType.IMG_RAW | CelType.IMG_COMP | CelType.TILEMAP_COMP:
+                source = i
+                keyframe = reuse.get((i, layer_idx)) if reuse else None
+
+                if keyframe is None:
+                    if cel.cel_type == CelType.TILEMAP_COMP:
+                        tileset = ase.tilesets[ase.layers[layer_idx].tileset_idx]
+                        cel = replace(cel, data=render_tilemap(cel.data, tileset, ase.header.bpp // 8, variants))
 
-    print(f"File: {file[0]}" if file[0] else "No file selected!")
-    ase_file_name = file[0]
+                    x, y = cel.pos
+                    w, h, _ = cel.data
+                    keyframe = Keyframe(i, x, y, w, h, cel_to_krita_pixels(ase, cel, luts))
 
-    if not ase_file_name:
-        print("No aseprite file! returning...")
-    else:
-        ase = read_ase_file(ase_file_name)
-        if ase is not None:
-            print(f"read aseprite file with size {ase.header.bounds} and {ase.header.num_frames} frame(s)")
-            load_document_from_ase(ase, "abcd")
+                if i in linked_sources:
+                    shared[i] = keyframe
 
-def save_main():
-    print("TEMP FILENAME!!!") 
-    filename = "/home/iskake/projects/krita_aseprite_plugin/test_save.ase"
-    print(f"Saving file: {filename}")
+            case CelType.LINKED:
+                source = link_source(layer_frames, cel.data)
+                if held == (source, i - 1):
+                    # same pixels as the previous frame, so the keyframe
+                    # there just holds, instead of uploading a copy
+                    held = (source, i)
+                    continue
 
-    ase = create_ase_from_document()
+                keyframe = shared[source]._replace(frame=i)
+                if debug:
+                    logger.debug("Linked cel: layer %d, frame %d -> %d", layer_idx, i, source)
 
-    if ase is None:
-        print("No file to save!")
-    else:
-        save_ase_file(ase, filename)
+        keyframes.append(keyframe)
+        held = (source, i)
+
+    if held is not None and held[1] < len(ase.frames) - 1:
+        keyframes.append(Keyframe(held[1] + 1, 0, 0, 0, 0, None))
 
-if __name__ == "__main__":
-    # load_main()
-    save_main()
\ No newline at end of file
+    return keyframes
+
+def save_ase_file(ase: AsepriteFile, filename: str, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Save `ase` as an aseprite file.
+
+    WARNING: This plugin does not implement all features of aseprite files,
+    meaning you WILL MOST LIKELY LOSE DATA if you overwrite a file created
+    with aseprite. Use at your own risk, you have been warned!
+
+    See `write_ase_file` for `compression_level`, and `update_ase_file` to
+    only encode what changed in a file that was read before.
+    """
+    with open(filename, "wb") as f:
+        write_ase_file(f, ase, compression_level)
+
+def update_ase_file(ase: AsepriteFile, filename: str, dirty: set[int], changed: set[tuple[int, int]] | None = None,
+                    compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Save `ase` over the existing aseprite file `filename`, only encoding
+    the frames in `dirty`.
+
+    All other frames are copied byte for byte from the existing file, found
+    through its frame index (nothing else is parsed), so they keep any
+    chunks this plugin doesn't read. The file header is kept as well (apart
+    from its size and number of frames).
+
+    In dirty frames, only the cels in `changed`, by (frame, layer), are
+    encoded again (all cels of the frame if it's None). Every other chunk is
+    copied from the existing file, including user data and anything else
+    this plugin doesn't understand, except for the layer chunks in frame 0
+    that differ from `ase.layers` (see `write_updated_frame`).
+
+    The new file is written next to the old one, and then moved over it.
+    """
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(filename, "rb") as src:
+            header = _read_header_only(src)
+            if header is None:
+                raise ValueError(f"Not an aseprite file: {filename}")
+            frame_index = read_frame_index(src, header)
+            if frame_index is None:
+                raise ValueError(f"Invalid frame in {filename}")
+
+            clean = [n for n in range(len(ase.frames)) if n not in dirty]
+            if clean and clean[-1] >= len(frame_index):
+                raise ValueError(f"Frame {clean[-1]} is not dirty, but {filename} only has {len(frame_index)} frame(s)")
+
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                try:
+                    with open(tmp_filename, "wb") as f:
+                        f.write(view[:_HEADER.size])
+
+                        # consecutive clean frames are copied in one go
+                        copy_start = copy_end = 0
+                        for n, frame in enumerate(ase.frames):
+                            if n in dirty:
+                                f.write(view[copy_start:copy_end])
+                                copy_start = copy_end = 0
+                                if n < len(frame_index):
+                                    layers = None if changed is None else {layer for frame_num, layer in changed if frame_num == n}
+                                    write_updated_frame(f, view, frame_index[n], ase, frame, n, layers, compression_level)
+                                else:
+                                    write_frame(f, ase, frame, n, compression_level)
+                                continue
+
+                            info = frame_index[n]
+                            if info.offset != copy_end:
+                                f.write(view[copy_start:copy_end])
+                                copy_start = info.offset
+                            copy_end = info.offset + info.size
+
+                            if frame.duration != info.duration:
+                                # the duration is the only field of the copy that changes
+                                f.write(view[copy_start:info.offset+8])
+                                f.write(_U16.pack(frame.duration))
+                                copy_start = info.offset + 10
+                        f.write(view[copy_start:copy_end])
+
+                        size = f.tell()
+                        f.seek(0)
+                        f.write(struct.pack("<I", size))
+                        f.seek(6)
+                        f.write(_U16.pack(len(ase.frames)))
+                except BaseException as e:
+                    # the traceback holds on to slices of `view`, which must
+                    # be released before the mapping can be closed
+                    traceback.clear_frames(e.__traceback__)
+                    raise
+
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        # no partly written file is left behind
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        raise
+    logger.debug("Updated %s: %d of %d frame(s) encoded", filename, len(ase.frames) - len(clean), len(ase.frames))
+
+def write_updated_frame(f: BufferedWriter, view: memoryview, info: FrameInfo, ase: AsepriteFile, frame: Frame, frame_num: int,
+                        layers: set[int] | None = None, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Write `frame` based on the frame at `info.offset` in `view` (the file
+    it was read from), only encoding the cels of `layers` (all if None).
+
+    Other chunks are copied as they are, and so are the cel extra and user
+    data chunks that follow the cels that are copied. Encoded cels keep the
+    user data of the cel they replace, and new cels are put in layer order.
+    In frame 0, layer chunks are encoded again where they differ from
+    `ase.layers`. Only the size, number of chunks and duration in the frame
+    header are updated.
+    """
+    use_uuid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
+
+    new_cels = {cel.layer_idx: cel for cel in frame.cels if layers is None or cel.layer_idx in layers}
+    pending = sorted(new_cels)  # layers of the new cels that aren't written yet
+
+    frame_start = f.tell()
+    f.write(view[info.offset:info.offset+_FRAME_HEADER.size])  # patched below
+
+    num_chunks = 0
+    chunk = BytesIO()
+
+    def write_chunk(chunk_type: ChunkType) -> None:
+        nonlocal num_chunks
+        _write_chunk(f, chunk, chunk_type)
+        num_chunks += 1
+
+    def copy_chunk(data: memoryview) -> None:
+        nonlocal num_chunks
+        f.write(data)
+        num_chunks += 1
+
+    def write_cels(until: int | None) -> None:
+        # the new cels of layers below `until`
+        while pending and (until is None or pending[0] < until):
+            cel = new_cels[pending.pop(0)]
+            write_chunk_cel(chunk, cel, compression_level)
+            write_chunk(ChunkType.CEL)
+            if cel.flags is not None:
+                write_chunk_cel_extra(chunk, cel)
+                write_chunk(ChunkType.CEL_EXTRA)
+
+    layer_idx = 0
+    # layer of the cel the chunks being read belong to, and whether it's being replaced
+    cel_layer: int | None = None
+    replaced = False
+
+    chunk_offset = info.offset + _FRAME_HEADER.size
+    for _ in range(info.num_chunks):
+        chunk_size, chunk_type = _CHUNK_HEADER.unpack_from(view, chunk_offset)
+        data = view[chunk_offset:chunk_offset+chunk_size]
+        chunk_offset += chunk_size
+
+        match chunk_type:
+            case ChunkType.CEL:
+                cel_layer = _U16.unpack_from(data, _CHUNK_HEADER.size)[0]
+                replaced = layers is None or cel_layer in layers
+                write_cels(cel_layer + 1 if replaced else cel_layer)
+                if not replaced:
+                    copy_chunk(data)
+            case ChunkType.CEL_EXTRA if cel_layer is not None:
+                # encoded cels get the cel extra chunk of their own
+                if not replaced:
+                    copy_chunk(data)
+            case ChunkType.USER_DATA if cel_layer is not None:
+                # only dropped along with a cel that was removed
+                if not replaced or cel_layer in new_cels:
+                    copy_chunk(data)
+            case ChunkType.LAYER if frame_num == 0:
+                cel_layer = None
+                layer = ase.layers[layer_idx] if layer_idx < len(ase.layers) else None
+                if layer is not None and layer != read_chunk_layer(BufferReader(data, _CHUNK_HEADER.size), use_uuid):
+                    write_chunk_layer(chunk, layer, use_uuid)
+                    write_chunk(ChunkType.LAYER)
+                else:
+                    copy_chunk(data)
+                layer_idx += 1
+            case _:
+                cel_layer = None
+                copy_chunk(data)
+    write_cels(None)
+
+    frame_end = f.tell()
+    frame_header = bytearray(view[info.offset:info.offset+_FRAME_HEADER.size])
+    struct.pack_into("<I", frame_header, 0, frame_end - frame_start)
+    _U16.pack_into(frame_header, 8, frame.duration)
+    if num_chunks != info.num_chunks:
+        _U16.pack_into(frame_header, 6, min(num_chunks, 0xFFFF))
+        struct.pack_into("<I", frame_header, 12, num_chunks)
+    f.seek(frame_start)
+    f.write(frame_header)
+    f.seek(frame_end)
+
+def write_ase_file(f: BufferedWriter, ase: AsepriteFile, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Write `ase` to the (seekable) file `f`.
+
+    Frames are written one at a time as `ase.frames` is iterated, so it can
+    also be a generator producing them. Only the frame headers and the file
+    header are written again afterwards, once their sizes are known.
+
+    `compression_level` is passed to zlib for compressed cels (0-9, or -1
+    for zlib's default), trading saving speed against file size.
+    """
+    start = f.tell()
+    write_ignore(f, _HEADER.size)   # written once the size is known
+
+    num_frames = 0
+    for frame in ase.frames:
+        write_frame(f, ase, frame, num_frames, compression_level)
+        num_frames += 1
+
+    end = f.tell()
+    f.seek(start)
+    write_ase_header(f, replace(ase.header, num_frames=num_frames), end - start)
+    f.seek(end)
+
+def write_frame(f: BufferedWriter, ase: AsepriteFile, frame: Frame, frame_num: int, compression_level: int = zlib.Z_DEFAULT_COMPRESSION) -> None:
+    """Write a frame, and the chunks of `ase` that are stored in the first frame if `frame_num` is 0"""
+    frame_start = f.tell()
+    write_ignore(f, _FRAME_HEADER.size)     # written once the size is known
+
+    num_chunks = 0
+    chunk = BytesIO()
+
+    def write_chunk(chunk_type: ChunkType) -> None:
+        nonlocal num_chunks
+        _write_chunk(f, chunk, chunk_type)
+        num_chunks += 1
+
+    if frame_num == 0:
+        use_uuid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_HAS_UUID != 0
+
+        if ase.color_profile is not None:
+            write_chunk_color_profile(chunk, ase.color_profile)
+            write_chunk(ChunkType.COLOR_PROFILE)
+        if ase.external_files:
+            write_external_files_chunk(chunk, list(ase.external_files.values()))
+            write_chunk(ChunkType.EXTERNAL_FILES)
+        if ase.palette is not None:
+            write_palette_chunk(chunk, ase.palette)
+            write_chunk(ChunkType.PALETTE)
+        for tileset in ase.tilesets.values():
+            write_tileset_chunk(chunk, tileset, compression_level)
+            write_chunk(ChunkType.TILESET)
+        for layer in ase.layers:
+            write_chunk_layer(chunk, layer, use_uuid)
+            write_chunk(ChunkType.LAYER)
+        if ase.tags:
+            write_tags_chunk(chunk, ase.tags)
+            write_chunk(ChunkType.TAGS)
+
+    for cel in frame.cels:
+        write_chunk_cel(chunk, cel, compression_level)
+        write_chunk(ChunkType.CEL)
+        if cel.flags is not None:
+            write_chunk_cel_extra(chunk, cel)
+            write_chunk(ChunkType.CEL_EXTRA)
+
+    frame_end = f.tell()
+    f.seek(frame_start)
+    f.write(_FRAME_HEADER.pack(frame_end - frame_start, 0xF1FA, min(num_chunks, 0xFFFF), frame.duration, num_chunks))
+    f.seek(frame_end)
+
+def _write_chunk(f: BufferedWriter, chunk: BytesIO, chunk_type: ChunkType) -> None:
+    """Write the data in `chunk` as a chunk of `chunk_type`, and empty `chunk`"""
+    data = chunk.getbuffer()
+    write_uint(f, len(data) + _CHUNK_HEADER.size, 4)
+    write_uint(f, chunk_type, 2)
+    write_bytes(f, data)
+    del data
+    chunk.seek(0)
+    chunk.truncate()
@@ -0,0 +1,531 @@
+"""Rendering of aseprite files without Krita: compositing frames, and writing PNGs."""
+from __future__ import annotations
+
+import logging
+import math
+import struct
+import zlib
+
+from io import BufferedWriter
+
+from .ase_file import (
+    AsepriteFile, AsepriteFileHeaderFlags, BlendMode, Cel, CelType, Layer, LayerFlags, LayerType, RawPixelData,
+    layer_palette_lut, indexed_to_rgba, render_tilemap,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def gray_to_rgba(data: bytes) -> bytes:
+    """Convert grayscale (value, alpha) pixels to RGBA"""
+    pixels = bytearray(len(data) * 2)
+    for channel in range(3):
+        pixels[channel::4] = data[0::2]
+    pixels[3::4] = data[1::2]
+    return bytes(pixels)
+
+def cel_rgba(ase: AsepriteFile, cel: Cel, luts: dict[tuple[int, bool], bytes], variants: dict[tuple[int, int, int], bytes]) -> RawPixelData:
+    """Get the pixels of an image or tilemap cel as RGBA.
+
+    `luts` and `variants` cache palette lookup tables and flipped tiles,
+    see `layer_palette_lut` and `render_tilemap`.
+    """
+    if cel.cel_type == CelType.TILEMAP_COMP:
+        tileset = ase.tilesets[ase.layers[cel.layer_idx].tileset_idx]
+        w, h, data = render_tilemap(cel.data, tileset, ase.header.bpp // 8, variants)
+    else:
+        w, h, data = cel.data
+
+    match ase.header.bpp:
+        case 8:
+            return (w, h, indexed_to_rgba(data, layer_palette_lut(ase, cel.layer_idx, luts)))
+        case 16:
+            return (w, h, gray_to_rgba(data))
+        case _:
+            return (w, h, data)
+
+def layer_tree(ase: AsepriteFile) -> dict[int, list[int]]:
+    """Get the direct children of each group layer by index, with -1 for the
+    top level, from the child levels of the layers.
+    """
+    children: dict[int, list[int]] = {-1: []}
+    parents = [-1]  # group at each child level
+    for i, layer in enumerate(ase.layers):
+        del parents[layer.child_level+1:]
+        children[parents[-1]].append(i)
+        if layer.layer_type == LayerType.GROUP:
+            children[i] = []
+            parents.append(i)
+    return children
+
+def frame_cels(ase: AsepriteFile, frame_num: int) -> list[Cel]:
+    """Get the cels of a frame in the order they are drawn in, with linked
+    cels replaced by the cel they point to.
+    """
+    cels = []
+    for cel in ase.frames[frame_num].cels:
+        # links to linked cels are followed to the image cel
+        for _ in range(len(ase.frames)):
+            if cel.cel_type != CelType.LINKED:
+                break
+            linked = next((c for c in ase.frames[cel.data].cels if c.layer_idx == cel.layer_idx), None)
+            if linked is None:
+                logger.warning("Linked cel in frame %d points to missing cel in frame %d", frame_num, cel.data)
+                break
+            cel = linked
+        if cel.cel_type != CelType.LINKED:
+            cels.append(cel)
+
+    # see "Note5" in aseprite's file format docs
+    cels.sort(key=lambda cel: (cel.layer_idx + cel.z_index, cel.z_index))
+    return cels
+
+def render_frame(ase: AsepriteFile, frame_num: int, luts: dict[tuple[int, bool], bytes] | None = None,
+                 variants: dict[tuple[int, int, int], bytes] | None = None, new_blend: bool = True) -> bytes:
+    """Composite all visible cels of a frame into an RGBA image of the canvas size.
+
+    Layers are blended with their blend mode and opacity (times the opacity
+    of the cel). Groups with a blend mode other than normal, or an opacity
+    below 255, are composited on their own first and then blended as one
+    image, otherwise their layers are drawn directly. See `cel_rgba` for
+    `luts` and `variants`, and `blend` for `new_blend`.
+    """
+    luts = {} if luts is None else luts
+    variants = {} if variants is None else variants
+    canvas_w, canvas_h = ase.header.bounds
+
+    layer_opacity_valid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_OPACITY_VALID != 0
+    group_opacity_valid = ase.header.flags & AsepriteFileHeaderFlags.LAYER_BLEND_OPACITY_VALID != 0
+
+    tree = layer_tree(ase)
+    cels = {cel.layer_idx: cel for cel in frame_cels(ase, frame_num)}
+
+    def is_visible(layer: Layer) -> bool:
+        return layer.layer_flags & LayerFlags.VISIBLE != 0 and layer.layer_flags & LayerFlags.REFERENCE_LAYER == 0
+
+    def is_composited(layer: Layer) -> bool:
+        return group_opacity_valid and (layer.opacity < 255 or layer.blend_mode != BlendMode.NORMAL)
+
+    def items(group: int) -> list[tuple[int, int, int]]:
+        # (order, z-index, layer) of everything drawn directly onto the
+        # canvas of `group`, including the contents of groups that aren't
+        # composited on their own
+        result = []
+        for i in tree[group]:
+            layer = ase.layers[i]
+            if not is_visible(layer):
+                continue
+            if layer.layer_type != LayerType.GROUP:
+                if i in cels:
+                    result.append((i + cels[i].z_index, cels[i].z_index, i))
+            elif is_composited(layer):
+                result.append((i, 0, i))
+            else:
+                result += items(i)
+        return result
+
+    def render(group: int) -> Canvas:
+        canvas = Canvas(canvas_w, canvas_h)
+        for _, _, i in sorted(items(group)):
+            layer = ase.layers[i]
+            if layer.layer_type == LayerType.GROUP:
+                pixels = render(i).tobytes()
+                canvas.draw(pixels, 0, 0, canvas_w, canvas_h, layer.opacity, layer.blend_mode, new_blend)
+            else:
+                cel = cels[i]
+                opacity = _mul_un8(layer.opacity if layer_opacity_valid else 255, cel.opacity)
+                w, h, pixels = cel_rgba(ase, cel, luts, variants)
+                canvas.draw(pixels, cel.pos.x, cel.pos.y, w, h, opacity, layer.blend_mode, new_blend)
+        return canvas
+
+    return render(-1).tobytes()
+
+
+def _mul_un8(a, b):
+    # a * b / 255, rounded the same way as aseprite
+    t = a * b + 0x80
+    return ((t >> 8) + t) >> 8
+
+def _div_un8(a, b):
+    # a * 255 / b, rounded the same way as aseprite
+    return (a * 0xFF + b // 2) // b
+
+class Canvas:
+    """RGBA image that cels are blended onto, with aseprite's blend modes"""
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        if np is not None:
+            self.pixels = np.zeros((height, width, 4), dtype=np.int32)
+        else:
+            self.pixels = bytearray(width * height * 4)
+
+    def draw(self, src: bytes, x: int, y: int, w: int, h: int, opacity: int,
+             blend_mode: int = BlendMode.NORMAL, new_blend: bool = True) -> None:
+        """Blend `w`x`h` RGBA pixels onto the canvas at (`x`, `y`), see `blend`"""
+        # the part of the cel that is inside of the canvas
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1 or opacity == 0:
+            return
+
+        if np is not None:
+            src_px = np.frombuffer(src, dtype=np.uint8).reshape(h, w, 4)[y0-y:y1-y, x0-x:x1-x].astype(np.int32)
+            dst = self.pixels[y0:y1, x0:x1]
+            dst[...] = blend(dst, src_px, opacity, blend_mode, new_blend)
+        else:
+            self._draw_rows(src, x, y, w, x0, y0, x1, y1, opacity, blend_mode, new_blend)
+
+    def _draw_rows(self, src: bytes, x: int, y: int, w: int, x0: int, y0: int, x1: int, y1: int,
+                   opacity: int, blend_mode: int, new_blend: bool) -> None:
+        dst = self.pixels
+        for row in range(y0, y1):
+            i = (row * self.width + x0) * 4
+            j = ((row - y) * w + x0 - x) * 4
+            for _ in range(x0, x1):
+                dst[i:i+4] = blend_pixel(dst[i:i+4], src[j:j+4], opacity, blend_mode, new_blend)
+                i += 4
+                j += 4
+
+    def tobytes(self) -> bytes:
+        if np is not None:
+            return self.pixels.astype(np.uint8).tobytes()
+        return bytes(self.pixels)
+
+def blend_normal_pixel(backdrop, src, opacity: int) -> bytes:
+    """Blend a single RGBA pixel `src` onto `backdrop`, like aseprite's `rgba_blender_normal`"""
+    br, bg, bb, ba = backdrop
+    sr, sg, sb, sa = src
+
+    if ba == 0:
+        return bytes((sr, sg, sb, _mul_un8(sa, opacity)))
+    if sa == 0:
+        return bytes(backdrop)
+
+    sa = _mul_un8(sa, opacity)
+    ra = sa + ba - _mul_un8(ba, sa)
+    return bytes((
+        br + int((sr - br) * sa / ra),
+        bg + int((sg - bg) * sa / ra),
+        bb + int((sb - bb) * sa / ra),
+        ra,
+    ))
+
+def _merge_pixel(backdrop, src, opacity: int) -> bytes:
+    # aseprite's `rgba_blender_merge`
+    br, bg, bb, ba = backdrop
+    sr, sg, sb, sa = src
+
+    if ba == 0:
+        rgb = (sr, sg, sb)
+    elif sa == 0:
+        rgb = (br, bg, bb)
+    else:
+        rgb = (br + _mul_un8(sr - br, opacity), bg + _mul_un8(sg - bg, opacity), bb + _mul_un8(sb - bb, opacity))
+    ra = ba + _mul_un8(sa - ba, opacity)
+    return bytes((*rgb, ra) if ra != 0 else (0, 0, 0, 0))
+
+def blend_pixel(backdrop, src, opacity: int, blend_mode: int = BlendMode.NORMAL, new_blend: bool = True) -> bytes:
+    """Blend a single RGBA pixel `src` onto `backdrop` with a blend mode,
+    like aseprite's `rgba_blender_<mode>`.
+
+    The color of `src` is blended with the backdrop, and then drawn onto it
+    like with the normal blend mode. With `new_blend` (aseprite's default
+    "new blending method", the `_n` variants), the blended color is only
+    used as much as the backdrop is opaque, so that blending onto
+    transparent pixels works like the normal blend mode.
+    """
+    normal = blend_normal_pixel(backdrop, src, opacity)
+    if blend_mode == BlendMode.NORMAL:
+        return normal
+
+    blended = blend_normal_pixel(backdrop, (*_blend_rgb_pixel(blend_mode, backdrop[:3], src[:3]), src[3]), opacity)
+    ba = backdrop[3]
+    if not new_blend:
+        return blended
+    if ba == 0:
+        return normal
+
+    composite_alpha = _mul_un8(ba, _mul_un8(src[3], opacity))
+    return _merge_pixel(_merge_pixel(normal, blended, ba), blended, composite_alpha)
+
+def _lum(r, g, b):
+    return 0.3*r + 0.59*g + 0.11*b
+
+def _sat(r, g, b):
+    return max(r, g, b) - min(r, g, b)
+
+def _clip_color(c: list[float]) -> None:
+    l = _lum(*c)
+    n = min(c)
+    x = max(c)
+    if n < 0:
+        c[:] = [l + (((v - l) * l) / (l - n)) for v in c]
+    if x > 1:
+        c[:] = [l + (((v - l) * (1 - l)) / (x - l)) for v in c]
+
+def _set_lum(c: list[float], l: float) -> None:
+    d = l - _lum(*c)
+    c[:] = [v + d for v in c]
+    _clip_color(c)
+
+def _sat_indices(r, g, b):
+    # which channels aseprite's `set_sat` takes as the minimum, middle and
+    # maximum. Its macros pick them the same way with ties, where the middle
+    # one can be the same channel as the minimum
+    imin = 0 if r < min(g, b) else (1 if g < b else 2)
+    imax = 0 if r > max(g, b) else (1 if g > b else 2)
+    if r > g:
+        imid = 1 if g > b else (2 if r > b else 0)
+    else:
+        imid = (2 if b > r else 0) if g > b else 1
+    return imin, imid, imax
+
+def _set_sat(c: list[float], s: float) -> None:
+    imin, imid, imax = _sat_indices(*c)
+    lo, mid, hi = c[imin], c[imid], c[imax]
+    if hi > lo:
+        c[imid] = ((mid - lo) * s) / (hi - lo)
+        c[imax] = s
+    else:
+        c[imid] = c[imax] = 0
+    c[imin] = 0
+
+def _blend_channel(blend_mode: int, b: int, s: int) -> int:
+    match blend_mode:
+        case BlendMode.MULTIPLY:
+            return _mul_un8(b, s)
+        case BlendMode.SCREEN:
+            return b + s - _mul_un8(b, s)
+        case BlendMode.OVERLAY:
+            return _blend_channel(BlendMode.HARD_LIGHT, s, b)
+        case BlendMode.DARKEN:
+            return min(b, s)
+        case BlendMode.LIGHTEN:
+            return max(b, s)
+        case BlendMode.COLOR_DODGE:
+            if b == 0:
+                return 0
+            s = 255 - s
+            return 255 if b >= s else _div_un8(b, s)
+        case BlendMode.COLOR_BURN:
+            if b == 255:
+                return 255
+            b = 255 - b
+            return 0 if b >= s else 255 - _div_un8(b, s)
+        case BlendMode.HARD_LIGHT:
+            if s < 128:
+                return _mul_un8(b, s << 1)
+            s = (s << 1) - 255
+            return b + s - _mul_un8(b, s)
+        case BlendMode.SOFT_LIGHT:
+            fb = b / 255.0
+            fs = s / 255.0
+            d = ((16*fb - 12)*fb + 4)*fb if fb <= 0.25 else math.sqrt(fb)
+            if fs <= 0.5:
+                r = fb - (1.0 - 2.0*fs) * fb * (1.0 - fb)
+            else:
+                r = fb + (2.0*fs - 1.0) * (d - fb)
+            return int(r * 255 + 0.5)
+        case BlendMode.DIFFERENCE:
+            return abs(b - s)
+        case BlendMode.EXCLUSION:
+            return b + s - 2*_mul_un8(b, s)
+        case BlendMode.ADDITION:
+            return min(b + s, 255)
+        case BlendMode.SUBTRACT:
+            return max(b - s, 0)
+        case BlendMode.DIVIDE:
+            if b == 0:
+                return 0
+            return 255 if b >= s else _div_un8(b, s)
+        case _:
+            return s
+
+def _blend_rgb_pixel(blend_mode: int, backdrop, src) -> tuple[int, int, int]:
+    if blend_mode < BlendMode.HUE or blend_mode > BlendMode.LUMINOSITY:
+        return tuple(_blend_channel(blend_mode, b, s) for b, s in zip(backdrop, src))
+
+    b = [v / 255.0 for v in backdrop]
+    s = [v / 255.0 for v in src]
+    match blend_mode:
+        case BlendMode.HUE:
+            c = s
+            _set_sat(c, _sat(*b))
+            _set_lum(c, _lum(*b))
+        case BlendMode.SATURATION:
+            l = _lum(*b)
+            c = b
+            _set_sat(c, _sat(*s))
+            _set_lum(c, l)
+        case BlendMode.COLOR:
+            c = s
+            _set_lum(c, _lum(*b))
+        case _:
+            c = b
+            _set_lum(c, _lum(*s))
+    return tuple(int(255.0 * v) for v in c)
+
+
+def blend_normal(backdrop, src, opacity):
+    """Same as `blend_normal_pixel`, for (..., 4) int32 numpy arrays.
+
+    `opacity` can also be an array, of shape (..., 1).
+    """
+    ba = backdrop[..., 3:]
+    sa = _mul_un8(src[..., 3:], opacity)
+    ra = sa + ba - _mul_un8(ba, sa)
+
+    # integer division rounding towards zero, like in C
+    diff = (src[..., :3] - backdrop[..., :3]) * sa
+    rgb = backdrop[..., :3] + np.sign(diff) * (np.abs(diff) // np.maximum(ra, 1))
+
+    result = np.concatenate((rgb, ra), axis=-1)
+    result = np.where(src[..., 3:] == 0, backdrop, result)
+    return np.where(ba == 0, np.concatenate((src[..., :3], sa), axis=-1), result)
+
+def _merge(backdrop, src, opacity):
+    # same as `_merge_pixel`, for numpy arrays
+    ba = backdrop[..., 3:]
+    sa = src[..., 3:]
+    rgb = backdrop[..., :3] + _mul_un8(src[..., :3] - backdrop[..., :3], opacity)
+    rgb = np.where(ba == 0, src[..., :3], np.where(sa == 0, backdrop[..., :3], rgb))
+    ra = ba + _mul_un8(sa - ba, opacity)
+    return np.where(ra == 0, 0, np.concatenate((rgb, ra), axis=-1))
+
+def blend(backdrop, src, opacity: int, blend_mode: int = BlendMode.NORMAL, new_blend: bool = True):
+    """Same as `blend_pixel`, for (..., 4) int32 numpy arrays"""
+    normal = blend_normal(backdrop, src, opacity)
+    if blend_mode == BlendMode.NORMAL:
+        return normal
+
+    rgb = _blend_rgb(blend_mode, backdrop[..., :3], src[..., :3])
+    blended = blend_normal(backdrop, np.concatenate((rgb, src[..., 3:]), axis=-1), opacity)
+
+    ba = backdrop[..., 3:]
+    if not new_blend:
+        return blended
+
+    composite_alpha = _mul_un8(ba, _mul_un8(src[..., 3:], opacity))
+    result = _merge(_merge(normal, blended, ba), blended, composite_alpha)
+    return np.where(ba == 0, normal, result)
+
+def _lum_np(c):
+    return 0.3*c[0] + 0.59*c[1] + 0.11*c[2]
+
+def _clip_color_np(c):
+    l = _lum_np(c)
+    n = c.min(axis=0)
+    x = c.max(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = np.where(n < 0, l + (((c - l) * l) / (l - n)), c)
+        c = np.where(x > 1, l + (((c - l) * (1 - l)) / (x - l)), c)
+    return c
+
+def _set_lum_np(c, l):
+    return _clip_color_np(c + (l - _lum_np(c)))
+
+def _set_sat_np(c, s):
+    r, g, b = c
+    imin = np.where(r < np.minimum(g, b), 0, np.where(g < b, 1, 2))
+    imax = np.where(r > np.maximum(g, b), 0, np.where(g > b, 1, 2))
+    imid = np.where(r > g,
+                    np.where(g > b, 1, np.where(r > b, 2, 0)),
+                    np.where(g > b, np.where(b > r, 2, 0), 1))
+
+    lo = np.take_along_axis(c, imin[None], axis=0)[0]
+    mid = np.take_along_axis(c, imid[None], axis=0)[0]
+    hi = np.take_along_axis(c, imax[None], axis=0)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        new_mid = np.where(hi > lo, ((mid - lo) * s) / (hi - lo), 0)
+    new_max = np.where(hi > lo, s, 0)
+
+    # in the same order as aseprite, for when channels are picked twice
+    c = c.copy()
+    np.put_along_axis(c, imid[None], new_mid[None], axis=0)
+    np.put_along_axis(c, imax[None], new_max[None], axis=0)
+    np.put_along_axis(c, imin[None], 0.0, axis=0)
+    return c
+
+def _blend_rgb(blend_mode: int, b, s):
+    # same as `_blend_rgb_pixel`, for (..., 3) int32 numpy arrays
+    match blend_mode:
+        case BlendMode.MULTIPLY:
+            return _mul_un8(b, s)
+        case BlendMode.SCREEN:
+            return b + s - _mul_un8(b, s)
+        case BlendMode.OVERLAY:
+            return _blend_rgb(BlendMode.HARD_LIGHT, s, b)
+        case BlendMode.DARKEN:
+            return np.minimum(b, s)
+        case BlendMode.LIGHTEN:
+            return np.maximum(b, s)
+        case BlendMode.COLOR_DODGE:
+            s = 255 - s
+            return np.where(b == 0, 0, np.where(b >= s, 255, _div_un8(b, np.maximum(s, 1))))
+        case BlendMode.COLOR_BURN:
+            inv = 255 - b
+            return np.where(b == 255, 255, np.where(inv >= s, 0, 255 - _div_un8(inv, np.maximum(s, 1))))
+        case BlendMode.HARD_LIGHT:
+            s2 = (s << 1) - 255
+            return np.where(s < 128, _mul_un8(b, s << 1), b + s2 - _mul_un8(b, s2))
+        case BlendMode.SOFT_LIGHT:
+            fb = b / 255.0
+            fs = s / 255.0
+            d = np.where(fb <= 0.25, ((16*fb - 12)*fb + 4)*fb, np.sqrt(fb))
+            r = np.where(fs <= 0.5, fb - (1.0 - 2.0*fs) * fb * (1.0 - fb), fb + (2.0*fs - 1.0) * (d - fb))
+            return (r * 255 + 0.5).astype(np.int32)
+        case BlendMode.DIFFERENCE:
+            return np.abs(b - s)
+        case BlendMode.EXCLUSION:
+            return b + s - 2*_mul_un8(b, s)
+        case BlendMode.ADDITION:
+            return np.minimum(b + s, 255)
+        case BlendMode.SUBTRACT:
+            return np.maximum(b - s, 0)
+        case BlendMode.DIVIDE:
+            return np.where(b == 0, 0, np.where(b >= s, 255, _div_un8(b, np.maximum(s, 1))))
+
+    # channels first, for the hue/saturation/color/luminosity helpers
+    fb = np.moveaxis(b, -1, 0) / 255.0
+    fs = np.moveaxis(s, -1, 0) / 255.0
+    match blend_mode:
+        case BlendMode.HUE:
+            c = _set_lum_np(_set_sat_np(fs, fb.max(axis=0) - fb.min(axis=0)), _lum_np(fb))
+        case BlendMode.SATURATION:
+            c = _set_lum_np(_set_sat_np(fb, fs.max(axis=0) - fs.min(axis=0)), _lum_np(fb))
+        case BlendMode.COLOR:
+            c = _set_lum_np(fs, _lum_np(fb))
+        case BlendMode.LUMINOSITY:
+            c = _set_lum_np(fb, _lum_np(fs))
+        case _:
+            return s
+    return np.moveaxis((255.0 * c).astype(np.int32), 0, -1)
+
+
+def write_png(f: BufferedWriter, width: int, height: int, pixels: bytes, compression_level: int = 6) -> None:
+    """Write RGBA pixels as an 8-bit PNG image"""
+    def write_chunk(chunk_type: bytes, data: bytes) -> None:
+        f.write(struct.pack(">I", len(data)))
+        f.write(chunk_type)
+        f.write(data)
+        f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    stride = width * 4
+    # filter type 0 (none) for each row
+    rows = b"".join(b"\0" + pixels[y*stride:(y+1)*stride] for y in range(height))
+
+    f.write(b"\x89PNG\r\n\x1a\n")
+    write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+    write_chunk(b"IDAT", zlib.compress(rows, compression_level))
+    write_chunk(b"IEND", b"")
+
+def save_png(filename: str, width: int, height: int, pixels: bytes, compression_level: int = 6) -> None:
+    with open(filename, "wb") as f:
+        write_png(f, width, height, pixels, compression_level)
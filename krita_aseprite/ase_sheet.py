@@ -0,0 +1,271 @@
+"""Packing the frames of aseprite files into sprite sheets, without Krita.
+
+Frames are rendered (see `render_frame`), trimmed to their opaque bounds,
+deduplicated, and packed with a MaxRects packer into a single image. The
+metadata is written as JSON in the layout of aseprite's own "Array" sheet
+export, so tools that read those can read these too.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import hashlib
+import json
+import logging
+import math
+import os
+
+from typing import NamedTuple as T
+
+from .ase_file import AsepriteFile
+from .ase_render import render_frame, save_png
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+LOOP_DIRECTIONS = ["forward", "reverse", "pingpong", "pingpong_reverse"]
+
+
+class Bounds(T):
+    x: int
+    y: int
+    w: int
+    h: int
+
+@dataclass
+class SheetFrame:
+    name: str
+    source: Bounds      # the trimmed part of the frame
+    image: int          # index of the (deduplicated) image
+    duration: int
+
+@dataclass
+class Sheet:
+    width: int
+    height: int
+    pixels: bytes       # RGBA
+    frames: list[SheetFrame]
+    placements: list[Bounds]    # of each image in the sheet
+    canvas: tuple[int, int]     # size of the untrimmed frames
+    tags: list[dict]
+
+
+def alpha_bounds(pixels: bytes, w: int, h: int) -> Bounds | None:
+    """Find the bounds of the pixels that aren't fully transparent in a `w`x`h`
+    RGBA image, or None if all of them are.
+    """
+    if np is not None:
+        alpha = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, 4)[..., 3]
+        rows = np.flatnonzero(alpha.any(axis=1))
+        if len(rows) == 0:
+            return None
+        cols = np.flatnonzero(alpha.any(axis=0))
+        return Bounds(int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+    # the alpha channel of each row, with transparent runs stripped by
+    # `bytes.lstrip`/`rstrip`, which work on whole rows at once
+    alpha = pixels[3::4]
+    x0, x1, y0, y1 = w, 0, None, 0
+    for y in range(h):
+        row = alpha[y*w:(y+1)*w]
+        left = w - len(row.lstrip(b"\0"))
+        if left == w:
+            continue
+        if y0 is None:
+            y0 = y
+        y1 = y + 1
+        x0 = min(x0, left)
+        x1 = max(x1, len(row.rstrip(b"\0")))
+    if y0 is None:
+        return None
+    return Bounds(x0, y0, x1 - x0, y1 - y0)
+
+def crop(pixels: bytes, w: int, bounds: Bounds) -> bytes:
+    """Get the part of a `w` pixel wide RGBA image inside of `bounds`"""
+    x, y, cw, ch = bounds
+    stride = w * 4
+    return b"".join(pixels[(y+row)*stride + x*4:(y+row)*stride + (x+cw)*4] for row in range(ch))
+
+
+class MaxRectsPacker:
+    """Packs rectangles into a bin of fixed width and unbounded height, with
+    the MaxRects algorithm (bottom-left rule, no rotation).
+
+    The free space is kept as a list of maximal free rectangles, which may
+    overlap. Each placed rectangle splits the free rectangles it overlaps,
+    and free rectangles contained in others are dropped.
+    """
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.height = 0     # used so far
+        self.free: list[Bounds] = [Bounds(0, 0, width, 1 << 30)]
+
+    def insert(self, w: int, h: int) -> Bounds:
+        best = None
+        for x, y, fw, fh in self.free:
+            if w <= fw and h <= fh:
+                score = (y + h, x)
+                if best is None or score < best[0]:
+                    best = (score, x, y)
+        if best is None:
+            raise ValueError(f"{w}x{h} doesn't fit in a bin of width {self.width}")
+
+        placed = Bounds(best[1], best[2], w, h)
+        self._split(placed)
+        self.height = max(self.height, placed.y + h)
+        return placed
+
+    def _split(self, placed: Bounds) -> None:
+        px, py, pw, ph = placed
+        kept: list[Bounds] = []
+        new: list[Bounds] = []
+        for free in self.free:
+            x, y, w, h = free
+            if px >= x + w or px + pw <= x or py >= y + h or py + ph <= y:
+                kept.append(free)
+                continue
+            # the (up to 4) parts of the free rectangle around the placed one
+            if px > x:
+                new.append(Bounds(x, y, px - x, h))
+            if px + pw < x + w:
+                new.append(Bounds(px + pw, y, x + w - px - pw, h))
+            if py > y:
+                new.append(Bounds(x, y, w, py - y))
+            if py + ph < y + h:
+                new.append(Bounds(x, py + ph, w, y + h - py - ph))
+
+        # only the new rectangles can be contained in others
+        pruned: list[Bounds] = []
+        for rect in new:
+            if any(_contains(other, rect) for other in kept) or any(_contains(other, rect) for other in pruned):
+                continue
+            pruned = [other for other in pruned if not _contains(rect, other)]
+            pruned.append(rect)
+        self.free = kept + pruned
+
+def _contains(outer: Bounds, inner: Bounds) -> bool:
+    return (outer.x <= inner.x and outer.y <= inner.y
+            and inner.x + inner.w <= outer.x + outer.w and inner.y + inner.h <= outer.y + outer.h)
+
+def pack(sizes: list[tuple[int, int]], padding: int = 0) -> tuple[int, int, list[Bounds]]:
+    """Pack rectangles of the given sizes, with `padding` pixels between them.
+
+    Returns the size of the bin, and the position of each rectangle. The
+    width of the bin is chosen so that it comes out roughly square.
+    """
+    if not sizes:
+        return 0, 0, []
+
+    padded = [(w + padding, h + padding) for w, h in sizes]
+    area = sum(w * h for w, h in padded)
+    width = max(max(w for w, _ in padded), math.ceil(math.sqrt(area)))
+
+    # largest first, which packs a lot tighter
+    order = sorted(range(len(sizes)), key=lambda i: (padded[i][1], padded[i][0]), reverse=True)
+
+    packer = MaxRectsPacker(width)
+    placements: list[Bounds] = [None] * len(sizes)
+    for i in order:
+        x, y, _, _ = packer.insert(*padded[i])
+        placements[i] = Bounds(x, y, *sizes[i])
+
+    used_width = max(x + w for x, _, w, _ in placements)
+    used_height = max(y + h for _, y, _, h in placements)
+    return used_width, used_height, placements
+
+def make_sheet(ase: AsepriteFile, name: str, padding: int = 1, trim: bool = True) -> Sheet:
+    """Render all frames of `ase` and pack them into a sprite sheet.
+
+    Frames are named `<name>_<frame>` (see `ase_convert.output_names`).
+    Identical images (after trimming) are only stored once.
+    """
+    w, h = ase.header.bounds
+    luts: dict[tuple[int, bool], bytes] = {}
+    variants: dict[tuple[int, int, int], bytes] = {}
+    digits = len(str(len(ase.frames) - 1))
+
+    frames: list[SheetFrame] = []
+    images: list[bytes] = []
+    sizes: list[tuple[int, int]] = []
+    seen: dict[tuple[int, int, bytes], int] = {}
+    for i, frame in enumerate(ase.frames):
+        pixels = render_frame(ase, i, luts, variants)
+        bounds = alpha_bounds(pixels, w, h) if trim else Bounds(0, 0, w, h)
+        if bounds is None:
+            # fully transparent frames still get a (1x1) image
+            bounds = Bounds(0, 0, 1, 1)
+        image = crop(pixels, w, bounds) if bounds != (0, 0, w, h) else pixels
+
+        key = (bounds.w, bounds.h, hashlib.blake2b(image, digest_size=16).digest())
+        index = seen.setdefault(key, len(images))
+        if index == len(images):
+            images.append(image)
+            sizes.append((bounds.w, bounds.h))
+
+        frame_name = name if len(ase.frames) == 1 else f"{name}_{i:0{digits}}"
+        frames.append(SheetFrame(frame_name, bounds, index, frame.duration))
+
+    sheet_w, sheet_h, placements = pack(sizes, padding)
+    logger.debug("%d frame(s), %d unique image(s), packed into %dx%d", len(frames), len(images), sheet_w, sheet_h)
+
+    tags = [
+        {
+            "name": tag.name,
+            "from": tag.from_frame,
+            "to": tag.to_frame,
+            "direction": LOOP_DIRECTIONS[tag.loop_direction] if tag.loop_direction < len(LOOP_DIRECTIONS) else "forward",
+            **({"repeat": str(tag.repeat_times)} if tag.repeat_times else {}),
+        }
+        for tag in ase.tags or []
+    ]
+
+    return Sheet(sheet_w, sheet_h, _blit(sheet_w, sheet_h, images, placements), frames, placements, (w, h), tags)
+
+def _blit(width: int, height: int, images: list[bytes], placements: list[Bounds]) -> bytes:
+    # copy each image into the sheet, a row at a time
+    sheet = bytearray(width * height * 4)
+    stride = width * 4
+    for image, (x, y, w, h) in zip(images, placements):
+        row_size = w * 4
+        for row in range(h):
+            start = (y + row) * stride + x * 4
+            sheet[start:start+row_size] = image[row*row_size:(row+1)*row_size]
+    return bytes(sheet)
+
+def sheet_metadata(sheet: Sheet, image_name: str) -> dict:
+    """The metadata of `sheet` in the layout of aseprite's JSON sheet export (as an array)"""
+    canvas_w, canvas_h = sheet.canvas
+    frames = []
+    for frame in sheet.frames:
+        x, y, w, h = sheet.placements[frame.image]
+        frames.append({
+            "filename": frame.name,
+            "frame": {"x": x, "y": y, "w": w, "h": h},
+            "rotated": False,
+            "trimmed": (w, h) != (canvas_w, canvas_h),
+            "spriteSourceSize": {"x": frame.source.x, "y": frame.source.y, "w": w, "h": h},
+            "sourceSize": {"w": canvas_w, "h": canvas_h},
+            "duration": frame.duration,
+        })
+
+    return {
+        "frames": frames,
+        "meta": {
+            "app": "krita_aseprite",
+            "image": image_name,
+            "format": "RGBA8888",
+            "size": {"w": sheet.width, "h": sheet.height},
+            "scale": "1",
+            "frameTags": sheet.tags,
+        },
+    }
+
+def save_sheet(sheet: Sheet, png_filename: str, json_filename: str, compression_level: int = 6) -> None:
+    """Write a sheet as a PNG image, and its metadata as JSON next to it"""
+    save_png(png_filename, sheet.width, sheet.height, sheet.pixels, compression_level)
+    with open(json_filename, "w") as f:
+        json.dump(sheet_metadata(sheet, os.path.basename(png_filename)), f, indent=1)
@@ -1,42 +1,322 @@
+"""The Krita extension. Everything beyond registering the actions is only
+imported once one of them is first used, so the plugin costs next to
+nothing at startup.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import os
 from pathlib import Path
+import struct
+from typing import TYPE_CHECKING
+import zlib
 
 try:
-    from PyQt6.QtWidgets import QFileDialog
+    from PyQt6.QtWidgets import QFileDialog, QProgressDialog
+    from PyQt6.QtCore import QFileSystemWatcher, QTimer
 except:
-    from PyQt5.QtWidgets import QFileDialog
+    from PyQt5.QtWidgets import QFileDialog, QProgressDialog
+    from PyQt5.QtCore import QFileSystemWatcher, QTimer
 
 from krita import *
 
-from .ase_file import AsepriteFile, read_ase_file, load_document_from_ase
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from .ase_file import AsepriteFile, AsepriteFileCache, FileSnapshot, PixelCache
+    from .krita_document import LoadedDocument
+
+logger = logging.getLogger(__name__)
+
+# memory budget of the cache of opened files, in MiB. Files are read lazily,
+# so this is mostly for their decompressed pixels (see `PixelCache`)
+CACHE_SIZE_SETTING = "cache_size_mb"
+DEFAULT_CACHE_SIZE = 512
+
+# how long to wait after a watched file changes before reloading it, in ms,
+# as aseprite may write a file in more than one go
+RELOAD_DELAY = 300
+
+# what reading a file that changes (again) while it's being read can raise
+_READ_ERRORS = (OSError, ValueError, struct.error, zlib.error)
+
+@dataclass
+class WatchedFile:
+    """A file opened with "watch for changes", and the document made from it"""
+    filename: str
+    snapshot: FileSnapshot
+    loaded: LoadedDocument
+
+class BackgroundLoad:
+    """Files being read on a worker pool, with a progress dialog.
+
+    The main thread polls for finished files, and only creates their
+    documents (see `load_document_from_ase`), in the order they finish.
+    Their pixels are converted on the pool too, a few layers ahead of the
+    one being loaded (see `iter_keyframes`).
+    """
+    def __init__(self, futures: dict[Future, str], executor: ThreadPoolExecutor, cache: PixelCache, on_finished, on_loaded) -> None:
+        self.futures = futures
+        self.executor = executor
+        self.cache = cache
+        self.on_finished = on_finished
+        self.on_loaded = on_loaded
+        self.num_done = 0
+
+        self.progress = QProgressDialog("Opening Aseprite files...", "Cancel", 0, len(futures), Krita.instance().activeWindow().qwindow())
+        self.progress.setMinimumDuration(500)
+        self.progress.setValue(0)
+        self.progress.canceled.connect(self.cancel)
+
+        self.timer = QTimer(self.progress)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(50)
+
+    def poll(self):
+        from .ase_file import iter_keyframes
+        from .krita_document import load_document_from_ase
+
+        for future in [future for future in self.futures if future.done()]:
+            filename = self.futures.pop(future)
+            self.num_done += 1
+            self.progress.setValue(self.num_done)
+            self.progress.setLabelText(f"Opening {Path(filename).name}...")
+
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception("Failed to read aseprite file %s", filename)
+                continue
+
+            if result is not None:
+                ase, snapshot = result
+                logger.info("Read aseprite file with size %s and %d frame(s)", ase.header.bounds, ase.header.num_frames)
+                loaded = load_document_from_ase(ase, Path(filename).name, iter_keyframes(ase, executor=self.executor), self.cache)
+                self.on_loaded(filename, snapshot, loaded)
+
+        if not self.futures:
+            self.finish()
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+        logger.info("Canceled opening %d file(s)", len(self.futures))
+        self.finish()
+
+    def finish(self):
+        self.timer.stop()
+        self.progress.reset()
+        self.on_finished(self)
 
 class KritaAsepriteExtension(Extension):
-    # TODO: keep track of currently loaded files?
-    curr_ase_files: list[AsepriteFile] = []
+    # parsed files, so opening the same file again doesn't read it again,
+    # and their decompressed pixels (created on first use, see `start_loading`)
+    ase_files: AsepriteFileCache | None = None
+    pixels: PixelCache | None = None
+
+    # reads and converts files off the main thread. Threads rather than
+    # processes, as inside Krita `sys.executable` is Krita itself, but both
+    # zlib and numpy release the GIL while working on pixels
+    executor: ThreadPoolExecutor | None = None
+
+    loads: list[BackgroundLoad] = []
+
+    # documents opened from files, by filename, so saving them back to the
+    # same file only writes what changed (see `update_ase_file`). Dropped
+    # once their document is closed, see `forget_closed_documents`
+    documents: dict[str, LoadedDocument] = {}
+
+    # files opened with "watch for changes", by filename
+    watched: dict[str, WatchedFile] = {}
+    watcher: QFileSystemWatcher | None = None
 
     def __init__(self, parent) -> None:
         super().__init__(parent)
+        self.cache_size = DEFAULT_CACHE_SIZE
 
     def setup(self):
-        pass
+        size = Krita.instance().readSetting("krita_aseprite", CACHE_SIZE_SETTING, str(DEFAULT_CACHE_SIZE))
+        try:
+            self.cache_size = int(size)
+        except ValueError:
+            logger.warning("Invalid %s setting: %r", CACHE_SIZE_SETTING, size)
+
+        notifier = Krita.instance().notifier()
+        notifier.setActive(True)
+        notifier.viewClosed.connect(self.view_closed)
+
+    def start_loading(self):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            from .ase_file import AsepriteFileCache, PixelCache
+
+            self.ase_files = AsepriteFileCache(self.cache_size * 1024 * 1024)
+            self.pixels = PixelCache(self.cache_size * 1024 * 1024)
+            self.executor = ThreadPoolExecutor(os.cpu_count(), thread_name_prefix="krita_aseprite")
 
     def createActions(self, window):
         action = window.createAction("openAse", "Open Aseprite file...", "tools/scripts")
         action.triggered.connect(self.open_ase_file)
 
-    def open_ase_file(self):
+        action = window.createAction("openAseWatch", "Open Aseprite file and watch for changes...", "tools/scripts")
+        action.triggered.connect(self.open_ase_file_watched)
+
+        action = window.createAction("saveAse", "Export as Aseprite file...", "tools/scripts")
+        action.triggered.connect(self.save_ase_file)
+
+    def open_ase_file(self, watch: bool = False):
         files,_ = QFileDialog().getOpenFileNames(caption="Open Aseprite file(s)...", filter="Aseprite files (*.ase *.aseprite)")
 
         if len(files) < 1:
             return
 
-        print(f"Got {len(files)} aseprite files: {files}")
-        for ase_file_name in files:
-            if not ase_file_name:
-                print("No aseprite file! returning...")
+        logger.info("Got %d aseprite files: %s", len(files), files)
+        self.start_loading()
+        futures = {self.executor.submit(self.decode_file, name, watch): name for name in files if name}
+        self.loads.append(BackgroundLoad(futures, self.executor, self.pixels, self.load_finished, self.document_loaded))
+
+    def open_ase_file_watched(self):
+        self.open_ase_file(watch=True)
+
+    def decode_file(self, filename: str, snapshot: bool = False) -> tuple[AsepriteFile, FileSnapshot | None] | None:
+        """Read a file, on a worker thread. Its pixels are only decompressed
+        and converted while its document is created, see `BackgroundLoad`.
+
+        With `snapshot`, a snapshot of the file to compare later versions
+        against is taken too (before reading, so no change is missed).
+        """
+        from .ase_file import snapshot_ase_file
+
+        file_snapshot = snapshot_ase_file(filename) if snapshot else None
+        ase = self.ase_files.read(filename, lazy=True, cache=self.pixels)
+        if ase is None:
+            return None
+        return ase, file_snapshot
+
+    def load_finished(self, load: BackgroundLoad):
+        self.loads.remove(load)
+        logger.debug("File cache: %s", self.ase_files.stats())
+
+    def document_loaded(self, filename: str, snapshot: FileSnapshot | None, loaded: LoadedDocument):
+        self.documents[_file_key(filename)] = loaded
+        if snapshot is not None:
+            self.watch_file(filename, snapshot, loaded)
+
+    def watch_file(self, filename: str, snapshot: FileSnapshot, loaded: LoadedDocument):
+        if self.watcher is None:
+            self.watcher = QFileSystemWatcher()
+            self.watcher.fileChanged.connect(self.file_changed)
+
+        self.watched[filename] = WatchedFile(filename, snapshot, loaded)
+        self.watcher.addPath(filename)
+        logger.info("Watching %s for changes", filename)
+
+    def file_changed(self, filename: str):
+        QTimer.singleShot(RELOAD_DELAY, lambda: self.reload_file(filename))
+
+    def reload_file(self, filename: str):
+        """Update the document of a watched file after the file changed.
+
+        Only the layers whose cels' bytes changed are updated, and only the
+        keyframes that differ written to. Any other change opens the file
+        as a new document.
+        """
+        from .ase_file import changed_cels, iter_keyframes, snapshot_ase_file
+        from .krita_document import load_document_from_ase, update_document_from_ase
+
+        watched = self.watched.get(filename)
+        if watched is None:
+            return
+
+        # files saved by writing a new file and renaming it stop being watched
+        if filename not in self.watcher.files():
+            if not os.path.exists(filename):
+                return
+            self.watcher.addPath(filename)
+
+        try:
+            snapshot = snapshot_ase_file(filename)
+        except OSError:
+            logger.warning("Failed to read changed file %s", filename, exc_info=True)
+            return
+        if snapshot is None:
+            logger.debug("%s is not a complete aseprite file, waiting for more changes", filename)
+            return
+
+        changed = changed_cels(watched.snapshot, snapshot)
+        if changed == set():
+            watched.snapshot = snapshot
+            return
+
+        # cels are only read (and decompressed) while the document is updated,
+        # which fails the same way if the file changes again meanwhile
+        try:
+            ase = self.ase_files.read(filename, lazy=True, cache=self.pixels)
+            if ase is None:
+                return
+            if changed is None:
+                logger.info("%s changed more than cels, opening it again", filename)
+                keyframes = iter_keyframes(ase, executor=self.executor)
+                watched.loaded = load_document_from_ase(ase, Path(filename).name, keyframes, self.pixels)
+                self.documents[_file_key(filename)] = watched.loaded
             else:
-                ase = read_ase_file(ase_file_name)
-                if ase is not None:
-                    print(f"read aseprite file with size {ase.header.bounds} and {ase.header.num_frames} frame(s)")
-                    load_document_from_ase(ase, Path(ase_file_name).name)
+                logger.info("%s changed, updating %d cel(s)", filename, len(changed))
+                update_document_from_ase(watched.loaded, ase, changed, self.executor)
+        except _READ_ERRORS:
+            logger.warning("Failed to read changed file %s", filename, exc_info=True)
+            return
+        watched.snapshot = snapshot
+
+    def view_closed(self, view):
+        # the document is only gone once the view is, after this signal
+        QTimer.singleShot(0, self.forget_closed_documents)
+
+    def forget_closed_documents(self):
+        """Drop the documents (and watched files) whose document was closed"""
+        if not self.documents and not self.watched:
+            return
+
+        open_documents = Krita.instance().documents()
+        for key, loaded in list(self.documents.items()):
+            if loaded.document not in open_documents:
+                logger.debug("Document of %s was closed", key)
+                del self.documents[key]
+
+        for filename, watched in list(self.watched.items()):
+            if watched.loaded.document not in open_documents:
+                logger.info("Stopped watching %s", filename)
+                del self.watched[filename]
+                self.watcher.removePath(filename)
+
+    def save_ase_file(self):
+        from .ase_file import save_ase_file, snapshot_ase_file
+        from .krita_document import create_ase_from_document, update_ase_file
+
+        filename,_ = QFileDialog().getSaveFileName(caption="Export as Aseprite file...", filter="Aseprite files (*.ase *.aseprite)")
+
+        if not filename:
+            return
+
+        # saving back to the file the document was opened from
+        loaded = self.documents.get(_file_key(filename))
+        if loaded is not None and loaded.document == Krita.instance().activeDocument() and os.path.exists(filename):
+            update_ase_file(loaded, filename)
+            logger.info("Updated aseprite file %s", filename)
+
+            # so the watcher doesn't load our own changes again
+            for watched in self.watched.values():
+                if watched.loaded is loaded:
+                    watched.snapshot = snapshot_ase_file(filename) or watched.snapshot
+            return
+
+        ase = create_ase_from_document()
+        if ase is not None:
+            save_ase_file(ase, filename)
+            logger.info("Saved aseprite file %s", filename)
+
+def _file_key(filename: str) -> str:
+    return os.path.normcase(os.path.abspath(filename))
 
-Krita.instance().addExtension(KritaAsepriteExtension(Krita.instance()))
\ No newline at end of file
+Krita.instance().addExtension(KritaAsepriteExtension(Krita.instance()))
@@ -0,0 +1,696 @@
+"""Creating Krita documents from aseprite files, and the other way around."""
+from __future__ import annotations
+
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+import hashlib
+import logging
+from typing import Iterable
+
+try:
+    from PyQt6.QtWidgets import QFileDialog
+    from PyQt6.QtCore import QByteArray
+except:
+    from PyQt5.QtWidgets import QFileDialog
+    from PyQt5.QtCore import QByteArray
+
+from krita import *
+
+from .ase_file import (
+    AsepriteFile, AsepriteFileHeader, BlendMode, Cel, CelType, Color, ColorProfile, ColorProfileType, Fixed, Frame,
+    Keyframe, KeyframeKey, Layer, LayerFlags, LayerType, Palette, PixelCache, Point, Rect, frame_times, iter_keyframes,
+    read_ase_file, save_ase_file, swap_red_blue, update_ase_file as update_ase_frames,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Krita composite op of each aseprite blend mode, and the other way around
+BLEND_MODES = {
+    BlendMode.NORMAL:      "normal",
+    BlendMode.MULTIPLY:    "multiply",
+    BlendMode.SCREEN:      "screen",
+    BlendMode.OVERLAY:     "overlay",
+    BlendMode.DARKEN:      "darken",
+    BlendMode.LIGHTEN:     "lighten",
+    BlendMode.COLOR_DODGE: "dodge",
+    BlendMode.COLOR_BURN:  "burn",
+    BlendMode.HARD_LIGHT:  "hard_light",
+    BlendMode.SOFT_LIGHT:  "soft_light_svg",
+    BlendMode.DIFFERENCE:  "diff",
+    BlendMode.EXCLUSION:   "exclusion",
+    BlendMode.HUE:         "hue",
+    BlendMode.SATURATION:  "saturation",
+    BlendMode.COLOR:       "color",
+    BlendMode.LUMINOSITY:  "luminize",
+    BlendMode.ADDITION:    "add",
+    BlendMode.SUBTRACT:    "subtract",
+    BlendMode.DIVIDE:      "divide",
+}
+KRITA_BLEND_MODES = {name: blend_mode for blend_mode, name in BLEND_MODES.items()}
+
+@dataclass
+class LoadedDocument:
+    """A document created by `load_document_from_ase`, with what is needed
+    to update it, or save it back to the file, later (see
+    `update_document_from_ase` and `update_ase_file`).
+
+    No pixels are kept: only the bounds and digests of the keyframes, and
+    `ase` as read lazily from the file (its pixels are only decompressed
+    again, into `cache`, when needed).
+    """
+    document: Document
+    ase: AsepriteFile
+    nodes: list[Node]
+    keyframes: list[list[KeyframeKey]]
+    times: list[int] | None     # document time of each frame, if animated
+    timing: tuple[int, int, int] | None = None  # frame rate and full clip range of the document, if animated
+    cache: PixelCache | None = None     # where the pixels of `ase` are decompressed to, see `read_ase_file`
+
+def _document_timing(d: Document) -> tuple[int, int, int]:
+    return (d.framesPerSecond(), d.fullClipRangeStartTime(), d.fullClipRangeEndTime())
+
+def load_document_from_ase(ase: AsepriteFile, name: str, keyframes: Iterable[list[Keyframe]] | None = None,
+                           cache: PixelCache | None = None) -> LoadedDocument:
+    """Create a new document from `ase`, with the keyframes of each layer
+    from `keyframes` (e.g. `iter_keyframes` converting them on other
+    threads), or converted here one layer at a time. Must be called from
+    the main thread.
+
+    `ase` is kept with the document, so it should be read lazily (with its
+    pixels in `cache`, if any), see `LoadedDocument`.
+    """
+    app = Krita.instance()
+
+    if ase.header.bpp == 16:
+        color_mode = "GRAYA"
+    else:
+        color_mode = "RGBA"
+
+    d = app.createDocument(
+        ase.header.bounds.x,
+        ase.header.bounds.y,
+        name,
+        color_mode,
+        "U8",
+        "",
+        300.0
+    )
+
+    logger.debug("Created %dx%d %s document %r", ase.header.bounds.x, ase.header.bounds.y, color_mode, name)
+
+    # TODO: is this always created?
+    tmp_bg = d.nodeByName("Background")
+
+    root = d.rootNode()
+
+    parent_node_stack = [root]
+    last_node = None
+    last_child_level = 0
+
+    nodes = []
+    groups_to_collapse = []
+
+    for layer in ase.layers:
+        logger.debug("Adding layer %r (child level %d)", layer.name, layer.child_level)
+
+        if last_node is not None and layer.child_level != last_child_level:
+            if layer.child_level < last_child_level:
+                i = last_child_level
+                while layer.child_level < i:
+                    parent_node_stack.pop()
+                    i -= 1
+            else:
+                parent_node_stack.append(last_node)
+
+        # Krita has no tilemap layers, so they are rendered to paint layers
+        node = d.createNode(
+            layer.name,
+            "groupLayer" if layer.layer_type == LayerType.GROUP else "paintLayer"
+        )
+
+        node.setVisible((layer.layer_flags & LayerFlags.VISIBLE) != 0)
+        node.setLocked(not (layer.layer_flags & LayerFlags.EDITABLE) != 0)
+
+        if layer.layer_type == LayerType.GROUP and (layer.layer_flags & LayerFlags.GROUP_COLLAPSED) != 0:
+            groups_to_collapse.append(node)
+
+        node.setOpacity(255 if layer.layer_type == 1 else layer.opacity)
+
+        node.setBlendingMode(BLEND_MODES.get(layer.blend_mode, "normal"))
+
+        # TODO: check layers to see if this is actually required?
+        if len(ase.frames) > 1:
+            node.enableAnimation()
+
+        parent_node_stack[-1].addChildNode(node, None)
+        nodes.append(node)
+
+        last_node = node
+        last_child_level = layer.child_level
+
+    animated = len(ase.frames) > 1
+    times = None
+    if animated:
+        fps, times, end_time = frame_times([frame.duration for frame in ase.frames])
+        d.setFramesPerSecond(fps)
+        d.setFullClipRangeStartTime(0)
+        d.setFullClipRangeEndTime(end_time - 1)
+        d.setPlayBackRange(0, end_time - 1)
+        logger.debug("%d frame(s) over %d frames at %d fps", len(ase.frames), end_time, fps)
+
+    if keyframes is None:
+        keyframes = iter_keyframes(ase)
+    loaded_keyframes: list[list[KeyframeKey]] = []
+
+    # no dialogs while importing (batch mode doesn't stop view updates, the
+    # document is only shown once everything is loaded), and the previous
+    # mode is restored even if loading fails part way
+    batchmode = d.batchmode()
+    d.setBatchmode(True)
+    try:
+        # one layer at a time, so the active node only changes once per layer
+        for layer_idx, layer_keyframes in enumerate(keyframes):
+            loaded_keyframes.append([keyframe.key() for keyframe in layer_keyframes])
+            if not layer_keyframes:
+                continue
+
+            logger.debug("Loading layer %d (%d keyframes)", layer_idx, len(layer_keyframes))
+            node = nodes[layer_idx]
+            if animated:
+                d.setActiveNode(node)
+
+            for frame, x, y, w, h, pixels in layer_keyframes:
+                if animated:
+                    d.setCurrentTime(times[frame])
+                    app.action("add_blank_frame").trigger()
+                    d.waitForDone()
+                if pixels is not None:
+                    node.setPixelData(pixels, x, y, w, h)
+    finally:
+        d.setBatchmode(batchmode)
+
+    # TODO: for some reason, attempting to set the group nodes to collapsed
+    # like this does not seem to work, but running it in the plugin dev tools
+    # console, it suddenly works perfectly...
+    for node in groups_to_collapse:
+        node.setCollapsed(True)
+
+    # TODO: is it necessary to do it this way?
+    tmp_bg.remove()
+
+    # TODO: `AttributeError: 'Document' object has no attribute 'gridConfig'`
+    # grid_config = d.gridConfig()
+    # grid_config.setOffset((ase.header.grid.x,  ase.header.grid.y))
+    # grid_config.setSpacing((
+    #     16 if ase.header.grid.w == 0 else ase.header.grid.w,
+    #     16 if ase.header.grid.h == 0 else ase.header.grid.h
+    # ))
+    # d.setGridConfig(grid_config)
+
+    d.refreshProjection()
+    app.activeWindow().addView(d)
+
+    return LoadedDocument(d, ase, nodes, loaded_keyframes, times, _document_timing(d) if animated else None, cache)
+
+def update_document_from_ase(loaded: LoadedDocument, ase: AsepriteFile, changed: set[tuple[int, int]],
+                             executor: Executor | None = None) -> None:
+    """Update a document loaded from an earlier version of `ase`, where only
+    the cels in `changed` (by frame and layer) are different.
+
+    Only the keyframes of those layers are prepared again, one layer at a
+    time (on `executor`, if given, see `iter_keyframes`), and only the
+    keyframes whose bounds or pixels differ from the ones the document was
+    loaded with are written to. Keyframes can't be removed through the
+    scripting API, so ones that are no longer needed get the pixels the
+    layer now shows there instead.
+    """
+    app = Krita.instance()
+    d = loaded.document
+    px_size = 2 if ase.header.bpp == 16 else 4
+
+    layers = {layer for _, layer in changed}
+    batchmode = d.batchmode()
+    d.setBatchmode(True)
+    try:
+        # one layer at a time, as they are converted
+        for layer_idx, layer_keyframes in enumerate(iter_keyframes(ase, layers, executor=executor)):
+            if layer_idx not in layers:
+                continue
+            node = loaded.nodes[layer_idx]
+            old = {key.frame: key for key in loaded.keyframes[layer_idx]}
+            new = {keyframe.frame: keyframe for keyframe in layer_keyframes}
+            new_keys = {keyframe.frame: keyframe.key() for keyframe in layer_keyframes}
+
+            if loaded.times is not None:
+                d.setActiveNode(node)
+
+            current = None
+            for frame in sorted(old.keys() | new.keys()):
+                old_key = old.get(frame)
+                if frame in new:
+                    current = new[frame]
+                if old_key == new_keys.get(frame):
+                    continue
+
+                logger.debug("Updating layer %d, frame %d", layer_idx, frame)
+                if loaded.times is not None:
+                    d.setCurrentTime(loaded.times[frame])
+                    if old_key is None:
+                        app.action("add_blank_frame").trigger()
+                        d.waitForDone()
+
+                if old_key is not None and old_key.digest is not None:
+                    _, x, y, w, h, _ = old_key
+                    node.setPixelData(bytes(w * h * px_size), x, y, w, h)
+                if current is not None and current.pixels is not None:
+                    _, x, y, w, h, pixels = current
+                    node.setPixelData(pixels, x, y, w, h)
+
+            loaded.keyframes[layer_idx] = list(new_keys.values())
+
+        loaded.ase = ase
+    finally:
+        d.setBatchmode(batchmode)
+
+    d.refreshProjection()
+
+# layer flags that can be changed in Krita, the others are kept when updating a file
+_DOCUMENT_LAYER_FLAGS = LayerFlags.VISIBLE | LayerFlags.EDITABLE | LayerFlags.GROUP_COLLAPSED
+
+def _keyframe_key(layer_idx: int, keyframe: KeyframeKey | None) -> tuple | None:
+    # the same as the keys of `get_cels`
+    if keyframe is None or keyframe.digest is None:
+        return None
+    _, x, y, w, h, digest = keyframe
+    return (layer_idx, x, y, w, h, digest)
+
+def _keys_from_frames(layer_idx: int, frame_keys: list[dict[int, tuple]]) -> list[KeyframeKey]:
+    """The keyframes of a layer, from the keys of the cels of each frame
+    (see `get_cels`), with a keyframe wherever the layer changes.
+    """
+    keyframes: list[KeyframeKey] = []
+    previous = None
+    for frame_num, keys in enumerate(frame_keys):
+        key = keys.get(layer_idx)
+        if key == previous:
+            continue
+        if key is None:
+            keyframes.append(KeyframeKey(frame_num, 0, 0, 0, 0, None))
+        else:
+            _, x, y, w, h, digest = key
+            keyframes.append(KeyframeKey(frame_num, x, y, w, h, digest))
+        previous = key
+    return keyframes
+
+def _read_saved(loaded: LoadedDocument, filename: str) -> None:
+    # the file that was just saved, lazily like the one the document was loaded
+    # from, as the pixels of the frames that were copied are no longer where
+    # the old one's cels point to
+    ase = read_ase_file(filename, lazy=True, cache=loaded.cache)
+    if ase is None:
+        raise ValueError(f"Failed to read {filename} after saving it")
+    loaded.ase = ase
+
+def update_ase_file(loaded: LoadedDocument, filename: str) -> None:
+    """Save a document over the file it was loaded from, only encoding the
+    frames that were changed in Krita (see `ase_file.update_ase_file`).
+
+    The document is read at the time of each frame, and compared with the
+    keyframes it was loaded with. Cels that didn't change are kept as they
+    are in the file, with everything Krita doesn't know about (cel opacity,
+    z-index, user data, ...), and so are the header, palette, tags and any
+    other chunks, also in the frames that are encoded again.
+    Documents whose layers were added, removed or reordered, whose frames
+    were added or retimed (frame rate or clip range), or that were loaded
+    from indexed or tilemap files, are saved in full instead.
+    """
+    d = loaded.document
+    ase = loaded.ase
+
+    nodes = get_nodes(d.rootNode())
+    layers = get_layers_from_nodes(nodes)
+    color_model = "GRAYA" if ase.header.bpp == 16 else "RGBA"
+
+    if loaded.times is None:
+        frames_changed = any(node.animated() for node, _ in nodes)
+    else:
+        frames_changed = _document_timing(d) != loaded.timing
+
+    if (ase.header.bpp == 8 or d.colorModel() != color_model or len(layers) != len(ase.layers) or frames_changed
+            or any(new.layer_type != old.layer_type for new, old in zip(layers, ase.layers))):
+        logger.info("Layers, frames or color mode of %s changed, saving all of it", filename)
+        new_ase = create_ase_from_document(d)
+        if new_ase is not None:
+            save_ase_file(new_ase, filename)
+            _saved_in_full(loaded, new_ase, filename)
+        return
+
+    layers = [
+        replace(
+            old,
+            layer_flags=(old.layer_flags & ~_DOCUMENT_LAYER_FLAGS) | (new.layer_flags & _DOCUMENT_LAYER_FLAGS),
+            child_level=new.child_level,
+            # modes Krita doesn't have are loaded as normal, and kept unless changed
+            blend_mode=old.blend_mode if BLEND_MODES.get(old.blend_mode, "normal") == BLEND_MODES[new.blend_mode] else new.blend_mode,
+            opacity=old.opacity if old.layer_type == LayerType.GROUP else new.opacity,
+            name=new.name,
+        )
+        for new, old in zip(layers, ase.layers)
+    ]
+
+    # the cels of each frame as they are in the document now, and their keys
+    exported: list[list[Cel]] = []
+    keys: list[dict[int, tuple]] = []
+    seen: dict[tuple, int] = {}
+    current_time = d.currentTime()
+    for frame_num in range(len(ase.frames)):
+        if loaded.times is not None:
+            d.setCurrentTime(loaded.times[frame_num])
+            d.waitForDone()
+        frame_keys: dict[int, tuple] = {}
+        exported.append(get_cels(nodes, frame_num, seen, frame_keys))
+        keys.append(frame_keys)
+    d.setCurrentTime(current_time)
+
+    # compare with the keyframes each layer was loaded with
+    changed: set[tuple[int, int]] = set()
+    for layer_idx, layer_keyframes in enumerate(loaded.keyframes):
+        keyframes = iter(layer_keyframes)
+        keyframe = next(keyframes, None)
+        key = None
+        for frame_num in range(len(ase.frames)):
+            while keyframe is not None and keyframe.frame <= frame_num:
+                key = _keyframe_key(layer_idx, keyframe)
+                keyframe = next(keyframes, None)
+            if keys[frame_num].get(layer_idx) != key:
+                changed.add((frame_num, layer_idx))
+
+    original_cels = [{cel.layer_idx: cel for cel in frame.cels} for frame in ase.frames]
+
+    # linked cels in the file whose source changed must be written again too
+    for frame_num, cels in enumerate(original_cels):
+        for layer_idx, cel in cels.items():
+            if cel.cel_type == CelType.LINKED and (cel.data, layer_idx) in changed:
+                changed.add((frame_num, layer_idx))
+
+    dirty = {frame_num for frame_num, _ in changed}
+    if layers != ase.layers:
+        dirty.add(0)
+
+    frames = list(ase.frames)
+    for frame_num in sorted(dirty):
+        cels = []
+        exported_cels = {cel.layer_idx: cel for cel in exported[frame_num]}
+        for layer_idx in sorted(original_cels[frame_num].keys() | exported_cels.keys()):
+            original = original_cels[frame_num].get(layer_idx)
+            if (frame_num, layer_idx) not in changed:
+                cels.append(original)
+                continue
+
+            cel = exported_cels.get(layer_idx)
+            if cel is None:
+                continue
+            if cel.cel_type == CelType.LINKED:
+                # the cel it points to may itself be a linked cel in the file
+                source = original_cels[cel.data].get(layer_idx)
+                if (cel.data, layer_idx) not in changed and source.cel_type == CelType.LINKED:
+                    cel = replace(cel, data=source.data)
+            if original is not None:
+                cel = replace(cel, opacity=original.opacity, z_index=original.z_index)
+            cels.append(cel)
+        frames[frame_num] = replace(frames[frame_num], cels=cels)
+
+    logger.debug("%d changed cel(s) in %d of %d frame(s)", len(changed), len(dirty), len(frames))
+    new_ase = replace(ase, layers=layers, frames=frames)
+    update_ase_frames(new_ase, filename, dirty, changed)
+
+    # what the file has now, for the next save to compare against, which is
+    # what the document showed at each frame
+    for layer_idx in {layer_idx for _, layer_idx in changed}:
+        loaded.keyframes[layer_idx] = _keys_from_frames(layer_idx, keys)
+    _read_saved(loaded, filename)
+
+def _saved_in_full(loaded: LoadedDocument, ase: AsepriteFile, filename: str) -> None:
+    """Make `loaded` match the file its document was just saved to in full,
+    from `ase` made by `create_ase_from_document`.
+    """
+    d = loaded.document
+    nodes = get_nodes(d.rootNode())
+
+    loaded.nodes = [node for node, _ in nodes]
+    loaded.keyframes = [[keyframe.key() for keyframe in layer_keyframes] for layer_keyframes in iter_keyframes(ase)]
+    _read_saved(loaded, filename)
+    if any(node.animated() for node, _ in nodes):
+        # one frame per document frame, see `create_ase_from_document`
+        start_time = d.fullClipRangeStartTime()
+        loaded.times = [start_time + frame_num for frame_num in range(len(ase.frames))]
+        loaded.timing = _document_timing(d)
+    else:
+        loaded.times = loaded.timing = None
+
+def create_ase_from_document(d: Document | None = None) -> AsepriteFile | None:
+    """Create a new aseprite file from a document (by default the active one)"""
+    app = Krita.instance()
+    if d is None:
+        d = app.activeDocument()
+
+    if d is None:
+        logger.warning("No active document to save!")
+        return None
+
+    # layers 
+    root = d.rootNode()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Document nodes:\n%s", "\n".join(_node_tree_lines(root)))
+
+    nodes = get_nodes(root)
+    layers = get_layers_from_nodes(nodes)
+
+    # header
+    if any(node.animated() for node, _ in nodes):
+        start_time = d.fullClipRangeStartTime()
+        num_frames = d.fullClipRangeEndTime() - start_time + 1
+    else:
+        start_time = d.currentTime()
+        num_frames = 1
+    duration = round(1000 / d.framesPerSecond())
+    bounds = Point(d.width(), d.height())
+
+    if d.colorModel() != "RGBA" and d.colorModel() != "GRAYA":
+        raise Exception(f"Unsupported color mode: {d.colorModel()}")
+
+    bpp = 16 if d.colorModel() == "GRAYA" else 32 # TODO: indexed (8 bpp)
+    header_flags = 0b011    #? TODO: check?
+    speed = duration
+    trans_idx = 0
+    num_colors = 1  # TODO
+    px_size = Point(1,1)    # TODO?
+    grid = Rect(0,0,16,16)  # TODO?
+
+    header = AsepriteFileHeader(
+        num_frames,
+        bounds,
+        bpp,
+        header_flags,
+        speed,
+        trans_idx,
+        num_colors,
+        px_size,
+        grid,
+    )
+
+    # palette
+    # TODO
+    palette = Palette(num_colors, [Color(0,0,0,0,None)])
+
+    # frames
+    frames: list[Frame] = []
+    seen: dict[tuple, int] = {}
+    current_time = d.currentTime()
+    for frame_num in range(header.num_frames):
+        d.setCurrentTime(start_time + frame_num)
+        d.waitForDone()
+        cels = get_cels(nodes, frame_num, seen)
+        frames.append(Frame(cels, duration))
+    d.setCurrentTime(current_time)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        linked = sum(cel.cel_type == CelType.LINKED for frame in frames for cel in frame.cels)
+        logger.debug("%d frame(s), %d linked cel(s)", len(frames), linked)
+
+    # color profile
+    profile_type = ColorProfileType.PROFILE_SRGB    #?
+    flags = False #?
+    gamma = Fixed(0,0) #?
+    icc_data = None
+    color_profile = ColorProfile(profile_type, flags, gamma, icc_data)
+
+    # tags
+    tags = None
+
+    # user data
+    user_data = None
+
+    return AsepriteFile(
+        header,
+        palette,
+        layers,
+        frames,
+        color_profile,
+        tags,
+        user_data
+    )
+
+def get_nodes(node, child_level=0) -> list[Node]:
+    nodes = []
+
+    for child in node.childNodes():
+        nodes.append((child, child_level))
+        if type(child) is GroupLayer:
+            child_children = get_nodes(child, child_level + 1)
+            nodes += [*child_children]
+
+    return nodes
+
+def get_layers_from_nodes(nodes) -> list[Layer]:
+    # TODO: multiple frames...
+    layers = []
+
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for node, child_level in nodes:
+        if debug:
+            logger.debug("Layer from node %r (%s, child level %d)", node.name(), node.type(), child_level)
+
+        visible = int(node.visible())
+        editable = int(not node.locked()) << 1
+        lock_movement = 0 << 2 # ?
+        background = 0 << 3 # ?
+        prefer_linked_cels = 0 << 4 # ?
+        display_collapsed = int(node.collapsed()) << 5
+        reference_layer = 0 << 6 # ?
+
+        flags = reference_layer | display_collapsed | prefer_linked_cels | background | lock_movement | editable | visible
+
+        # todo: tilemap (layer_type == 2)
+        layer_type = 0 if node.type() == "paintLayer" else 1
+
+        blend_mode = KRITA_BLEND_MODES.get(node.blendingMode())
+        if blend_mode is None:
+            logger.warning("Layer %r: blend mode %r not supported by aseprite, saved as normal", node.name(), node.blendingMode())
+            blend_mode = BlendMode.NORMAL
+
+        opacity = 255 if layer_type == 1 else node.opacity()
+
+        name = node.name()
+
+        tileset_idx = None
+        uuid = None
+
+        layers.append(Layer(flags, layer_type, child_level, blend_mode, opacity, name, tileset_idx, uuid))
+        # print(f"  added layer: {layers[-1]}")
+
+    return layers
+
+def get_cels(nodes: list[tuple[Node, int]], frame_num: int, seen: dict[tuple, int] | None = None,
+             keys: dict[int, tuple] | None = None) -> list[Cel]:
+    """Get the cels of `nodes` at the current time, as frame `frame_num`.
+
+    `seen` maps the content of the cels from earlier frames to the frame
+    they were first in. Cels with the same layer, bounds and pixels as one
+    of those are emitted as linked cels, instead of storing them again.
+    The content of each cel is also put in `keys`, by layer, if given.
+    """
+    cels: list[Cel] = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for i, (node, child_level) in enumerate(nodes):
+        if node.type() != "paintLayer":
+            continue
+
+        rect = node.bounds()
+        x = rect.x()
+        y = rect.y()
+        w = rect.width()
+        h = rect.height()
+
+        opacity = 255 # node.opacity()  #??
+
+        z_index = 0 # ?
+
+        if w <= 0 or h <= 0:
+            continue
+
+        pixeldata = node.pixelData(x,y,w,h)
+
+        assert type(pixeldata) == QByteArray
+
+        pixels = bytes(pixeldata)
+
+        linked_frame = frame_num
+        if seen is not None or keys is not None:
+            key = (i, x, y, w, h, hashlib.blake2b(pixels, digest_size=16).digest())
+            if seen is not None:
+                linked_frame = seen.setdefault(key, frame_num)
+            if keys is not None:
+                keys[i] = key
+
+        if linked_frame != frame_num:
+            cel_type = CelType.LINKED
+            data = linked_frame
+        else:
+            # compressed when saving, see `write_chunk_cel`
+            cel_type = CelType.IMG_COMP
+            if node.colorModel() == "RGBA":
+                pixels = swap_red_blue(pixels)    # krita uses BGRA
+            data = (w, h, pixels)
+
+        # todo: anything other than non-indexed rgba images...
+        cels.append(Cel(i, Point(x,y), opacity, cel_type, z_index, data))
+        if debug:
+            logger.debug("Cel for node %r: layer %d at %s, opacity %d, type %d, z-index %d, %d bytes",
+                         node.name(), i, (x, y, w, h), opacity, cel_type, z_index, len(pixeldata))
+
+    return cels
+
+def _node_tree_lines(node, level=0) -> list[str]:
+    lines = []
+    for child in node.childNodes():
+        lines.append(f"{'  '*level}{child.name()} {child.type()}")
+        if type(child) is GroupLayer:
+            lines += _node_tree_lines(child, level+1)
+    return lines
+
+
+def load_main():
+    file = QFileDialog().getOpenFileName(caption="Open Aseprite file...", filter="Aseprite files (*.ase *.aseprite)")
+
+    if file[0]:
+        logger.info("File: %s", file[0])
+    else:
+        logger.info("No file selected!")
+    ase_file_name = file[0]
+
+    if not ase_file_name:
+        logger.info("No aseprite file! returning...")
+    else:
+        ase = read_ase_file(ase_file_name)
+        if ase is not None:
+            logger.info("Read aseprite file with size %s and %d frame(s)", ase.header.bounds, ase.header.num_frames)
+            load_document_from_ase(ase, "abcd")
+
+def save_main():
+    logger.warning("TEMP FILENAME!!!")
+    filename = "/home/iskake/projects/krita_aseprite_plugin/test_save.ase"
+    logger.info("Saving file: %s", filename)
+
+    ase = create_ase_from_document()
+
+    if ase is None:
+        logger.info("No file to save!")
+    else:
+        save_ase_file(ase, filename)
+
+if __name__ == "__main__":
+    # load_main()
+    save_main()
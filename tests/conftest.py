@@ -0,0 +1,69 @@
+"""Shared setup of the tests: the plugin and the synthetic file generator
+(from `benchmarks/`) are imported from the repository, Krita is not needed.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from synthetic import COLOR_MODES, SyntheticShape, make_ase_file
+
+
+def small_shape(color_mode: str = "rgba", **kwargs) -> SyntheticShape:
+    return SyntheticShape(16, 12, 3, 2, color_mode, palette_size=16, **kwargs)
+
+@pytest.fixture(params=list(COLOR_MODES))
+def synthetic_file(request, tmp_path) -> str:
+    """A small synthetic file, in each color mode"""
+    filename = str(tmp_path / f"{request.param}.aseprite")
+    make_ase_file(filename, small_shape(request.param))
+    return filename
+
+def tilemap_ase(tiles: list[int], tiles_w: int = 2, tile_size: int = 2, external: bool = False):
+    """An RGBA file with a single tilemap cel of 32 bit `tiles` (tile ids
+    and flip flags), on a tileset of three tiles: empty, and two with a
+    different color per pixel. With `external`, the tileset refers to a
+    tile in an external file instead of having tiles of its own.
+    """
+    from krita_aseprite.ase_file import (
+        AsepriteFile, AsepriteFileHeader, Cel, CelType, Color, ExternalFile, Frame, Layer, LayerType,
+        Palette, Point, Rect, Tileset, TilesetFlags,
+    )
+    import struct
+
+    px = tile_size * tile_size
+    pixels = bytes(px * 4) + bytes(range(px * 4)) + bytes(range(128, 128 + px * 4))
+    if external:
+        tileset = Tileset(0, TilesetFlags.EXTERNAL_FILE, 3, Point(tile_size, tile_size), 1, "tiles", None, 1, 0)
+    else:
+        tileset = Tileset(0, TilesetFlags.TILES, 3, Point(tile_size, tile_size), 1, "tiles", pixels)
+
+    tiles_h = len(tiles) // tiles_w
+    header = AsepriteFileHeader(1, Point(tiles_w * tile_size, tiles_h * tile_size), 32, 0b11, 100, 0, 1, Point(1, 1), Rect(0, 0, 16, 16))
+    layer = Layer(0b11, LayerType.TILEMAP, 0, 0, 255, "Tilemap", 0, None)
+    data = (tiles_w, tiles_h, 32, 0x1FFFFFFF, 0x20000000, 0x40000000, 0x80000000, struct.pack(f"<{len(tiles)}I", *tiles))
+    cel = Cel(0, Point(0, 0), 255, CelType.TILEMAP_COMP, 0, data)
+
+    ase = AsepriteFile(header, Palette(1, [Color(0, 0, 0, 0, None)]), [layer], [Frame([cel])], None, None, [],
+                       tilesets={0: tileset})
+    if external:
+        ase.external_files[1] = ExternalFile(1, 1, "tileset.aseprite")
+    return ase
+
+@pytest.fixture(params=["python", "numpy"])
+def array_backend(request, monkeypatch) -> str:
+    """Run a test both with numpy (if installed) and with the pure Python fallbacks"""
+    from krita_aseprite import ase_file, ase_render, ase_sheet
+
+    if request.param == "numpy":
+        if ase_file.np is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(ase_file, "np", None)
+        monkeypatch.setattr(ase_render, "np", None)
+        monkeypatch.setattr(ase_sheet, "np", None)
+    return request.param
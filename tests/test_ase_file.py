@@ -0,0 +1,108 @@
+"""Write/read round trips of the aseprite writer, on synthetic files.
+
+Krita is not needed, run with e.g. `python -m pytest tests`.
+"""
+from dataclasses import replace
+import os
+
+import pytest
+
+from krita_aseprite import ase_file
+from krita_aseprite.ase_file import Cel, CelType, Point
+from synthetic import COLOR_MODES, make_ase_file
+from conftest import small_shape
+
+def _assert_same(a: ase_file.AsepriteFile, b: ase_file.AsepriteFile) -> None:
+    assert a.header == b.header
+    assert a.palette == b.palette
+    assert a.layers == b.layers
+    assert a.frames == b.frames
+
+@pytest.mark.parametrize("color_mode", COLOR_MODES)
+def test_write_read(tmp_path, color_mode):
+    original = str(tmp_path / "original.aseprite")
+    saved = str(tmp_path / "saved.aseprite")
+    make_ase_file(original, small_shape(color_mode))
+
+    ase = ase_file.read_ase_file(original)
+    ase_file.save_ase_file(ase, saved)
+
+    _assert_same(ase_file.read_ase_file(saved), ase)
+
+@pytest.mark.parametrize("color_mode", COLOR_MODES)
+def test_update_one_frame(tmp_path, color_mode):
+    filename = str(tmp_path / "file.aseprite")
+    shape = small_shape(color_mode)
+    make_ase_file(filename, shape)
+
+    ase = ase_file.read_ase_file(filename)
+    px_size = shape.bpp // 8
+    cel = Cel(1, Point(2, 3), 255, CelType.IMG_COMP, 0, (4, 5, bytes(range(4 * 5 * px_size))))
+    ase.frames[1].cels[1] = cel
+
+    with open(filename, "rb") as f:
+        before = f.read()
+    ase_file.update_ase_file(ase, filename, {1})
+
+    updated = ase_file.read_ase_file(filename)
+    _assert_same(updated, ase)
+    with open(filename, "rb") as f:
+        after = f.read()
+    # the frames around the dirty one are copied as they are
+    assert after[updated.frame_index[2].offset:] == before[ase.frame_index[2].offset:]
+
+@pytest.mark.parametrize("dirty", [set(), {0, 2}])
+def test_update_unchanged(tmp_path, dirty):
+    filename = str(tmp_path / "file.aseprite")
+    make_ase_file(filename, replace(small_shape("rgba"), user_data=True))
+    with open(filename, "rb") as f:
+        before = f.read()
+
+    ase_file.update_ase_file(ase_file.read_ase_file(filename), filename, dirty, set())
+
+    with open(filename, "rb") as f:
+        assert f.read() == before
+
+def test_update_keeps_user_data(tmp_path):
+    filename = str(tmp_path / "file.aseprite")
+    make_ase_file(filename, replace(small_shape("rgba"), user_data=True))
+
+    ase = ase_file.read_ase_file(filename)
+    ase.layers[1] = replace(ase.layers[1], name="Renamed")
+    cel = Cel(1, Point(2, 3), 255, CelType.IMG_COMP, 0, (4, 5, bytes(4 * 5 * 4)))
+    ase.frames[0].cels = [ase.frames[0].cels[0], cel]
+    ase.frames[2].cels = [ase.frames[2].cels[1]]    # removes the cel of layer 0
+    ase_file.update_ase_file(ase, filename, {0, 2}, {(0, 1), (2, 0)})
+
+    updated = ase_file.read_ase_file(filename)
+    _assert_same(updated, ase)
+    assert [user_data.text for user_data in updated.user_data] == [
+        "layer 0", "layer 1", "cel 0 0", "cel 0 1", "cel 1 0", "cel 1 1", "cel 2 1",
+    ]
+
+def test_snapshot_truncated(tmp_path):
+    filename = str(tmp_path / "file.aseprite")
+    make_ase_file(filename, small_shape("rgba"))
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    assert ase_file.snapshot_ase_buffer(data) is not None
+    # as if read while it's still being written
+    for size in range(0, len(data), 97):
+        assert ase_file.snapshot_ase_buffer(data[:size]) is None
+
+def test_update_failed(tmp_path):
+    filename = str(tmp_path / "file.aseprite")
+    make_ase_file(filename, small_shape("rgba"))
+    with open(filename, "rb") as f:
+        before = f.read()
+
+    ase = ase_file.read_ase_file(filename)
+    ase.frames[1].cels[0] = replace(ase.frames[1].cels[0], data=None)
+    with pytest.raises(TypeError):
+        ase_file.update_ase_file(ase, filename, {1})
+
+    # the file is left as it was, without the one being written
+    assert os.listdir(tmp_path) == ["file.aseprite"]
+    with open(filename, "rb") as f:
+        assert f.read() == before
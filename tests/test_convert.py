@@ -0,0 +1,95 @@
+"""The command line converter, `ase_convert`."""
+import argparse
+import os
+
+import pytest
+
+from krita_aseprite import ase_convert
+from synthetic import make_ase_file
+from conftest import small_shape
+
+
+def _touch(filename: str) -> None:
+    # a later modification time, however coarse the file system's clock is
+    mtime = os.stat(filename).st_mtime_ns + 1_000_000_000
+    os.utime(filename, ns=(mtime, mtime))
+
+def _convert(capsys, *args: str) -> str:
+    assert ase_convert.main([*args, "--jobs", "1"]) == 0
+    return capsys.readouterr().err.strip()
+
+
+def test_find_sources(tmp_path):
+    for name in ("b/c.ase", "b/a.aseprite", "a.ASE", "b/notes.txt", "z/d/e.aseprite"):
+        os.makedirs(tmp_path / os.path.dirname(name), exist_ok=True)
+        (tmp_path / name).touch()
+    single = str(tmp_path / "b" / "c.ase")
+
+    assert ase_convert.find_sources([str(tmp_path), single]) == [
+        (str(tmp_path / "a.ASE"), "a.ASE"),
+        (str(tmp_path / "b" / "a.aseprite"), os.path.join("b", "a.aseprite")),
+        (single, os.path.join("b", "c.ase")),
+        (str(tmp_path / "z" / "d" / "e.aseprite"), os.path.join("z", "d", "e.aseprite")),
+        # files are relative to the directory they're in
+        (single, "c.ase"),
+    ]
+
+@pytest.mark.parametrize("num_frames, sheet, expected", [
+    (1,  False, ["a.png"]),
+    (3,  False, ["a_0.png", "a_1.png", "a_2.png"]),
+    (11, False, [f"a_{i:02}.png" for i in range(11)]),
+    (3,  True,  ["a.png", "a.json"]),
+])
+def test_output_names(num_frames, sheet, expected):
+    assert ase_convert.output_names("a", num_frames, sheet) == expected
+
+@pytest.mark.parametrize("value, expected", [("3", 3), ("0", os.cpu_count() or 1)])
+def test_jobs(value, expected):
+    assert ase_convert.jobs_arg(value) == expected
+
+@pytest.mark.parametrize("value", ["-1", "many"])
+def test_invalid_jobs(value, capsys):
+    with pytest.raises(argparse.ArgumentTypeError):
+        ase_convert.jobs_arg(value)
+    with pytest.raises(SystemExit):
+        ase_convert.main(["a.aseprite", "-o", "out", "--jobs", value])
+    assert "--jobs" in capsys.readouterr().err
+
+def test_skip_by_mtime(tmp_path, capsys):
+    source = str(tmp_path / "src" / "a.aseprite")
+    os.makedirs(os.path.dirname(source))
+    make_ase_file(source, small_shape())
+    out = str(tmp_path / "out")
+
+    assert _convert(capsys, source, "-o", out) == "1 converted, 0 failed"
+    outputs = sorted(os.listdir(out))
+    assert outputs == ase_convert.output_names("a", small_shape().frames)
+    assert _convert(capsys, source, "-o", out) == "0 converted, 0 failed"
+
+    # converted again once the source is newer, or an output is missing
+    _touch(source)
+    assert _convert(capsys, source, "-o", out) == "1 converted, 0 failed"
+    os.remove(os.path.join(out, outputs[1]))
+    assert _convert(capsys, source, "-o", out) == "1 converted, 0 failed"
+    assert _convert(capsys, source, "-o", out, "--force") == "1 converted, 0 failed"
+
+def test_skip_by_hash(tmp_path, capsys, monkeypatch):
+    os.makedirs(tmp_path / "src" / "sub")
+    for name in ("a.aseprite", os.path.join("sub", "b.aseprite")):
+        make_ase_file(str(tmp_path / "src" / name), small_shape())
+
+    # relative paths, from another directory than the manifest's
+    monkeypatch.chdir(tmp_path)
+    args = ("src", "-o", "out", "--check", "hash")
+    assert _convert(capsys, *args) == "2 converted, 0 failed"
+    assert os.path.exists(os.path.join("out", ase_convert.MANIFEST_NAME))
+    assert _convert(capsys, *args) == "0 converted, 0 failed"
+
+    # a newer file with the same contents is still up to date
+    _touch(os.path.join("src", "a.aseprite"))
+    assert _convert(capsys, *args) == "0 converted, 0 failed"
+
+    make_ase_file(os.path.join("src", "sub", "b.aseprite"), small_shape(seed=1))
+    assert _convert(capsys, *args) == "1 converted, 0 failed"
+    assert _convert(capsys, *args, "--sheet") == "2 converted, 0 failed"
+    assert _convert(capsys, *args, "--sheet") == "0 converted, 0 failed"
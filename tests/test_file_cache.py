@@ -0,0 +1,83 @@
+"""Parsed files kept by `AsepriteFileCache`, within its budget."""
+from dataclasses import replace
+import os
+
+from krita_aseprite import ase_file
+from krita_aseprite.ase_file import AsepriteFileCache, CacheStats
+from synthetic import make_ase_file
+from conftest import small_shape
+
+
+def _make_files(tmp_path, names: str) -> dict[str, str]:
+    files = {}
+    for name in names:
+        files[name] = str(tmp_path / f"{name}.aseprite")
+        make_ase_file(files[name], small_shape())
+    return files
+
+def _touch(filename: str) -> None:
+    # a later modification time, however coarse the file system's clock is
+    mtime = os.stat(filename).st_mtime_ns + 1_000_000_000
+    os.utime(filename, ns=(mtime, mtime))
+
+
+def test_eviction(tmp_path):
+    files = _make_files(tmp_path, "abc")
+    size = ase_file.decoded_size(ase_file.read_ase_file(files["a"]))
+    cache = AsepriteFileCache(2 * size)
+
+    a = cache.read(files["a"])
+    cache.read(files["b"])
+    assert cache.read(files["a"]) is a
+    assert cache.stats() == CacheStats(hits=1, misses=2, evictions=0, entries=2, size=2 * size)
+
+    # b is the least recently used
+    cache.read(files["c"])
+    assert cache.stats() == CacheStats(hits=1, misses=3, evictions=1, entries=2, size=2 * size)
+    assert cache.read(files["a"]) is a
+    assert cache.read(files["c"]) is cache.read(files["c"])
+    assert cache.stats() == CacheStats(hits=4, misses=3, evictions=1, entries=2, size=2 * size)
+
+    # read again, now pushing out a
+    assert cache.read(files["b"]) is not None
+    assert cache.stats() == CacheStats(hits=4, misses=4, evictions=2, entries=2, size=2 * size)
+    assert cache.read(files["a"]) is not a
+
+def test_too_big(tmp_path):
+    files = _make_files(tmp_path, "ab")
+    cache = AsepriteFileCache(1)
+
+    # a file over the budget on its own is still kept, until the next one
+    a = cache.read(files["a"])
+    assert cache.read(files["a"]) is a
+    cache.read(files["b"])
+    assert cache.stats().entries == 1
+    assert cache.read(files["a"]) is not a
+
+def test_lazy_and_eager(tmp_path):
+    files = _make_files(tmp_path, "a")
+    cache = AsepriteFileCache()
+
+    eager = cache.read(files["a"])
+    lazy = cache.read(files["a"], lazy=True)
+    assert lazy is not eager
+    assert cache.read(files["a"], lazy=True) is lazy
+    assert cache.read(files["a"]) is eager
+
+    # lazily read cels count with their decompressed size, loaded or not
+    assert cache.stats().size == 2 * ase_file.decoded_size(eager)
+
+def test_changed_file(tmp_path):
+    files = _make_files(tmp_path, "a")
+    cache = AsepriteFileCache()
+    old = cache.read(files["a"])
+
+    make_ase_file(files["a"], replace(small_shape(), frames=5))
+    _touch(files["a"])
+
+    new = cache.read(files["a"])
+    assert new is not old
+    assert len(new.frames) == 5
+    # the old version is dropped
+    assert cache.stats() == CacheStats(hits=0, misses=2, evictions=0, entries=1, size=ase_file.decoded_size(new))
+    assert cache.read(files["a"]) is new
@@ -0,0 +1,131 @@
+"""Keyframes and timing of the documents made from files (see `prepare_keyframes`)."""
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+import pytest
+
+from krita_aseprite import ase_file
+from krita_aseprite.ase_file import (
+    AsepriteFile, AsepriteFileHeader, Cel, CelType, Frame, Keyframe, Layer, LayerType, Point, Rect,
+)
+
+
+def _ase(frames: list[list[Cel]], layers: int = 1, durations: list[int] | None = None) -> AsepriteFile:
+    header = AsepriteFileHeader(len(frames), Point(4, 4), 32, 0b11, 100, 0, 0, Point(1, 1), Rect(0, 0, 16, 16))
+    return AsepriteFile(
+        header, None,
+        [Layer(0b11, LayerType.NORMAL, 0, 0, 255, f"Layer {i}", None, None) for i in range(layers)],
+        [Frame(cels, durations[i] if durations else 100) for i, cels in enumerate(frames)],
+        None, None, [],
+    )
+
+def _image(layer_idx: int, value: int, x: int = 0, y: int = 0) -> Cel:
+    return Cel(layer_idx, Point(x, y), 255, CelType.IMG_COMP, 0, (2, 1, bytes([value, 1, 2, 3] * 2)))
+
+def _linked(layer_idx: int, frame: int) -> Cel:
+    return Cel(layer_idx, Point(0, 0), 255, CelType.LINKED, 0, frame)
+
+def _bgra(value: int) -> bytes:
+    return bytes([2, 1, value, 3] * 2)
+
+
+def test_linked_chain():
+    ase = _ase([
+        [_image(0, 10)],
+        [_linked(0, 0)],
+        [_linked(0, 1)],    # linked to a linked cel
+        [_image(0, 20, 1, 2)],
+        [_linked(0, 2)],    # not held, back to the pixels of frame 0
+        [],
+    ])
+    [keyframes] = ase_file.prepare_keyframes(ase)
+
+    assert keyframes == [
+        Keyframe(0, 0, 0, 2, 1, _bgra(10)),
+        Keyframe(3, 1, 2, 2, 1, _bgra(20)),
+        Keyframe(4, 0, 0, 2, 1, _bgra(10)),
+        Keyframe(5, 0, 0, 0, 0, None),
+    ]
+    # the linked cel shares the converted pixels of its source
+    assert keyframes[2].pixels is keyframes[0].pixels
+
+
+@pytest.mark.parametrize("durations, expected", [
+    ([100, 100, 100],   (10, [0, 1, 2], 3)),
+    ([100, 200, 100],   (10, [0, 1, 3], 4)),
+    ([33, 50],          (60, [0, 2], 5)),       # no common rate, capped at MAX_FPS
+    ([0, 0],            (60, [0, 1], 2)),       # every frame still gets its own time
+    ([2000, 1000],      (1, [0, 2], 3)),
+    ([3000],            (1, [0], 3)),
+])
+def test_frame_times(durations, expected):
+    assert ase_file.frame_times(durations) == expected
+
+def test_gaps():
+    ase = _ase([
+        [],
+        [_image(0, 10), _image(1, 30)],
+        [_image(1, 30)],
+        [],
+        [_image(0, 20)],
+    ], layers=2)
+
+    assert ase_file.prepare_keyframes(ase) == [
+        [Keyframe(1, 0, 0, 2, 1, _bgra(10)), Keyframe(2, 0, 0, 0, 0, None), Keyframe(4, 0, 0, 2, 1, _bgra(20))],
+        # equal pixels in unlinked cels are still keyframes of their own
+        [Keyframe(1, 0, 0, 2, 1, _bgra(30)), Keyframe(2, 0, 0, 2, 1, _bgra(30)), Keyframe(3, 0, 0, 0, 0, None)],
+    ]
+
+def test_layers_and_reuse():
+    ase = _ase([
+        [_image(0, 10), _image(1, 30), _image(2, 50)],
+        [_image(0, 20), _linked(1, 0)],
+    ], layers=3)
+    reused = Keyframe(0, 0, 0, 2, 1, b"reused")
+
+    keyframes = ase_file.prepare_keyframes(ase, {1, 2}, {(0, 1): reused})
+
+    assert keyframes == [
+        [],
+        [reused],   # held by the linked cel
+        [Keyframe(0, 0, 0, 2, 1, _bgra(50)), Keyframe(1, 0, 0, 0, 0, None)],
+    ]
+
+class _ImmediateExecutor(Executor):
+    """Runs each task as it's submitted, counting them"""
+    def __init__(self) -> None:
+        self.submitted = 0
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+def test_iter_keyframes():
+    ase = _ase([
+        [_image(layer, 10 * layer) for layer in range(5)],
+        [_linked(layer, 0) for layer in range(5)],
+        [_image(2, 99)],
+    ], layers=5)
+    expected = ase_file.prepare_keyframes(ase)
+
+    assert list(ase_file.iter_keyframes(ase)) == expected
+    with ThreadPoolExecutor(2) as executor:
+        assert list(ase_file.iter_keyframes(ase, executor=executor, ahead=1)) == expected
+
+    # only `ahead` layers are converted past the one being used
+    executor = _ImmediateExecutor()
+    keyframes = ase_file.iter_keyframes(ase, executor=executor, ahead=1)
+    assert next(keyframes) == expected[0]
+    assert executor.submitted == 2
+    assert next(keyframes) == expected[1]
+    assert executor.submitted == 3
+
+def test_keys():
+    ase = _ase([[_image(0, 10)], [_image(0, 10)], [_image(0, 20)], []])
+    keys = [keyframe.key() for keyframe in ase_file.prepare_keyframes(ase)[0]]
+
+    assert [key.frame for key in keys] == [0, 1, 2, 3]
+    assert keys[0]._replace(frame=1) == keys[1]
+    assert keys[1].digest != keys[2].digest
+    assert keys[3] == ase_file.KeyframeKey(3, 0, 0, 0, 0, None)
@@ -0,0 +1,20 @@
+"""Conversion of decoded pixels for Krita and rendering."""
+from krita_aseprite import ase_file
+from conftest import small_shape
+from synthetic import make_ase_file
+
+
+def test_layer_palette_lut_channel_order(tmp_path):
+    filename = str(tmp_path / "indexed.aseprite")
+    make_ase_file(filename, small_shape("indexed"))
+    ase = ase_file.read_ase_file(filename)
+
+    # one cache shared by both channel orders
+    luts: dict[tuple[int, bool], bytes] = {}
+    rgba = ase_file.layer_palette_lut(ase, 0, luts)
+    bgra = ase_file.layer_palette_lut(ase, 0, luts, bgra=True)
+
+    r, g, b, a, _ = ase.palette.colors[1]
+    assert rgba[4:8] == bytes((r, g, b, a))
+    assert bgra[4:8] == bytes((b, g, r, a))
+    assert ase_file.layer_palette_lut(ase, 1, luts) is rgba
@@ -0,0 +1,131 @@
+"""The other ways of reading a file give the same result as `read_ase_file`."""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import pytest
+
+from krita_aseprite import ase_file
+from krita_aseprite.ase_file import LazyPixelData, PixelCache
+from conftest import tilemap_ase
+
+
+def _cels(frames: list[ase_file.Frame]) -> list[list[ase_file.Cel]]:
+    # lazily loaded cels, decompressed, to compare with eagerly read ones
+    return [
+        [replace(cel, data=tuple(cel.data)) if isinstance(cel.data, LazyPixelData) else cel for cel in frame.cels]
+        for frame in frames
+    ]
+
+def _assert_same(ase: ase_file.AsepriteFile, expected: ase_file.AsepriteFile) -> None:
+    assert ase.header == expected.header
+    assert ase.layers == expected.layers
+    assert ase.palette == expected.palette
+    assert _cels(ase.frames) == _cels(expected.frames)
+    assert [frame.duration for frame in ase.frames] == [frame.duration for frame in expected.frames]
+
+
+def test_lazy(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+    ase = ase_file.read_ase_file(synthetic_file, lazy=True)
+
+    assert all(isinstance(cel.data, LazyPixelData) and not cel.data.is_loaded() for frame in ase.frames for cel in frame.cels)
+    _assert_same(ase, expected)
+
+def test_lazy_stream(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+    with open(synthetic_file, "rb") as f:
+        _assert_same(ase_file.read_ase_stream(f, lazy=True), expected)
+
+def test_pixel_cache_evicted(synthetic_file, tmp_path):
+    expected = ase_file.read_ase_file(synthetic_file)
+    cel_size = len(expected.frames[0].cels[0].data[2])
+
+    # room for a single cel, so loading one evicts the one before
+    cache = PixelCache(cel_size)
+    ase = ase_file.read_ase_file(synthetic_file, lazy=True, cache=cache)
+    first, second = ase.frames[0].cels
+    first.data.load()
+    second.data.load()
+    assert not first.data.is_loaded() and second.data.is_loaded()
+    assert cache.size == cel_size
+
+    # evicted cels are copied compressed, loaded ones compressed again
+    saved = str(tmp_path / "saved.aseprite")
+    ase_file.save_ase_file(ase, saved)
+    _assert_same(ase_file.read_ase_file(saved), expected)
+
+    # and evicted ones are decompressed again when used
+    assert tuple(first.data) == expected.frames[0].cels[0].data
+
+def test_index(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+    ase = ase_file.read_ase_index(synthetic_file)
+
+    assert ase.frames == []
+    assert ase.frame_index == expected.frame_index
+    frames = [ase.frame(n) for n in reversed(range(ase.header.num_frames))][::-1]
+    _assert_same(replace(ase, frames=frames), expected)
+    assert ase.frame(1) is frames[1]
+
+@pytest.fixture(scope="module")
+def executor():
+    with ThreadPoolExecutor(4) as executor:
+        yield executor
+
+def test_executor(synthetic_file, executor):
+    expected = ase_file.read_ase_file(synthetic_file)
+    ase = ase_file.read_ase_file(synthetic_file, executor=executor)
+
+    assert not any(isinstance(cel.data, LazyPixelData) for frame in ase.frames for cel in frame.cels)
+    _assert_same(ase, expected)
+
+    with open(synthetic_file, "rb") as f:
+        data = f.read()
+    _assert_same(ase_file.read_ase_buffer(data, executor=executor), expected)
+    _assert_same(ase_file.read_ase_file(synthetic_file, use_mmap=False, executor=executor), expected)
+
+def test_executor_tilemap(tmp_path, executor):
+    filename = str(tmp_path / "tilemap.aseprite")
+    ase_file.save_ase_file(tilemap_ase([0, 1, 2, 1 | 0x20000000]), filename)
+    expected = ase_file.read_ase_file(filename)
+
+    assert isinstance(ase_file.read_ase_file(filename, lazy=True).frames[0].cels[0].data, ase_file.LazyTilesData)
+    ase = ase_file.read_ase_file(filename, executor=executor)
+    assert type(ase.frames[0].cels[0].data) is tuple
+    _assert_same(ase, expected)
+
+def test_iter_frames(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+    ase = ase_file.read_ase_index(synthetic_file)
+
+    _assert_same(replace(ase, frames=list(ase_file.iter_frames(synthetic_file))), expected)
+    _assert_same(replace(ase, frames=list(ase_file.iter_frames(synthetic_file, lazy=True))), expected)
+
+def test_iter_chunks(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+
+    layers = []
+    palette = None
+    frames = [ase_file.Frame([], frame.duration) for frame in expected.frames]
+    for chunk in ase_file.iter_chunks(synthetic_file):
+        match chunk.chunk_type:
+            case ase_file.ChunkType.LAYER:
+                layers.append(chunk.data)
+            case ase_file.ChunkType.PALETTE:
+                palette = chunk.data
+            case ase_file.ChunkType.CEL:
+                frames[chunk.frame].cels.append(chunk.data)
+
+    _assert_same(replace(expected, layers=layers, palette=palette, frames=frames), expected)
+
+def test_probe(synthetic_file):
+    expected = ase_file.read_ase_file(synthetic_file)
+
+    ase = ase_file.probe_ase_file(synthetic_file)
+    assert ase.header == expected.header
+    assert ase.layers == [] and ase.frames == []
+
+    ase = ase_file.probe_ase_file(synthetic_file, metadata=True)
+    assert ase.header == expected.header
+    assert ase.layers == expected.layers
+    assert ase.frames == []
@@ -0,0 +1,169 @@
+"""Compositing of frames without Krita (see `ase_render`), with and without numpy."""
+import pytest
+
+from krita_aseprite import ase_render
+from krita_aseprite.ase_file import (
+    AsepriteFile, AsepriteFileHeader, BlendMode, Cel, CelType, Frame, Layer, LayerFlags, LayerType, Point, Rect,
+)
+from krita_aseprite.ase_render import Canvas
+
+
+# (backdrop, source, opacity, new blending method) of each case below
+CASES = [
+    ((200, 100, 50, 255), (100, 150, 250, 255), 255, True),
+    ((30, 200, 120, 255), (240, 60, 10, 255), 255, True),
+    ((200, 100, 50, 128), (100, 150, 250, 200), 128, True),
+    ((200, 100, 50, 128), (100, 150, 250, 200), 128, False),
+]
+
+# the pixel each blend mode gives in each case, as aseprite blends them
+BLENDED = {
+    BlendMode.NORMAL:      [(100, 150, 250, 255), (240, 60, 10, 255), (144, 128, 162, 178), (144, 128, 162, 178)],
+    BlendMode.MULTIPLY:    [(78, 59, 49, 255), (28, 47, 5, 255), (137, 97, 95, 178), (132, 77, 50, 178)],
+    BlendMode.SCREEN:      [(222, 191, 251, 255), (242, 213, 125, 255), (185, 142, 162, 178), (212, 151, 162, 178)],
+    BlendMode.OVERLAY:     [(188, 118, 98, 255), (56, 171, 9, 255), (174, 117, 111, 178), (194, 110, 76, 178)],
+    BlendMode.DARKEN:      [(100, 100, 50, 255), (30, 60, 10, 255), (144, 111, 95, 178), (144, 100, 50, 178)],
+    BlendMode.LIGHTEN:     [(200, 150, 250, 255), (240, 200, 120, 255), (177, 128, 162, 178), (200, 128, 162, 178)],
+    BlendMode.COLOR_DODGE: [(255, 243, 255, 255), (255, 255, 125, 255), (195, 159, 164, 178), (230, 180, 165, 178)],
+    BlendMode.COLOR_BURN:  [(115, 0, 46, 255), (16, 21, 0, 255), (150, 78, 94, 178), (153, 44, 48, 178)],
+    BlendMode.HARD_LIGHT:  [(157, 127, 247, 255), (229, 94, 9, 255), (163, 120, 161, 178), (176, 115, 160, 178)],
+    BlendMode.SOFT_LIGHT:  [(191, 111, 111, 255), (78, 177, 61, 255), (175, 115, 115, 178), (195, 106, 84, 178)],
+    BlendMode.DIFFERENCE:  [(100, 50, 200, 255), (210, 140, 110, 255), (144, 95, 145, 178), (144, 72, 134, 178)],
+    BlendMode.EXCLUSION:   [(144, 132, 202, 255), (214, 166, 120, 255), (159, 121, 145, 178), (169, 117, 135, 178)],
+    BlendMode.HUE:         [(78, 128, 228, 255), (237, 104, 67, 255), (137, 120, 155, 178), (132, 115, 150, 178)],
+    BlendMode.SATURATION:  [(199, 100, 50, 255), (0, 216, 114, 255), (177, 111, 95, 178), (200, 100, 50, 178)],
+    BlendMode.COLOR:       [(78, 128, 228, 255), (255, 97, 54, 255), (137, 120, 155, 178), (132, 115, 150, 178)],
+    BlendMode.LUMINOSITY:  [(221, 121, 71, 255), (0, 167, 88, 255), (184, 117, 101, 178), (211, 111, 61, 178)],
+    BlendMode.ADDITION:    [(255, 250, 255, 255), (255, 255, 130, 255), (195, 161, 164, 178), (230, 184, 165, 178)],
+    BlendMode.SUBTRACT:    [(100, 0, 0, 255), (0, 140, 110, 255), (144, 78, 78, 178), (144, 44, 22, 178)],
+    BlendMode.DIVIDE:      [(255, 170, 51, 255), (32, 255, 255, 255), (195, 135, 95, 178), (230, 139, 50, 178)],
+}
+
+def _draw(canvas: Canvas, color: tuple[int, ...], x: int = 0, y: int = 0, w: int = 1, h: int = 1, opacity: int = 255,
+          blend_mode: int = BlendMode.NORMAL, new_blend: bool = True) -> None:
+    canvas.draw(bytes(color) * (w * h), x, y, w, h, opacity, blend_mode, new_blend)
+
+
+def test_all_modes():
+    assert set(BLENDED) == set(BlendMode)
+
+@pytest.mark.parametrize("blend_mode", list(BlendMode), ids=lambda mode: mode.name)
+def test_blend(blend_mode, array_backend):
+    for (backdrop, src, opacity, new_blend), expected in zip(CASES, BLENDED[blend_mode]):
+        canvas = Canvas(1, 1)
+        _draw(canvas, backdrop)
+        _draw(canvas, src, opacity=opacity, blend_mode=blend_mode, new_blend=new_blend)
+        assert tuple(canvas.tobytes()) == expected
+
+@pytest.mark.parametrize("blend_mode", list(BlendMode), ids=lambda mode: mode.name)
+def test_blend_transparent(blend_mode, array_backend):
+    # onto nothing, everything draws like the normal mode
+    canvas = Canvas(1, 1)
+    _draw(canvas, (100, 150, 250, 200), blend_mode=blend_mode)
+    assert tuple(canvas.tobytes()) == (100, 150, 250, 200)
+
+    # and nothing changes nothing
+    _draw(canvas, (10, 20, 30, 0), blend_mode=blend_mode)
+    assert tuple(canvas.tobytes()) == (100, 150, 250, 200)
+
+def test_draw_clipped(array_backend):
+    canvas = Canvas(4, 3)
+    _draw(canvas, (200, 100, 50, 255), 0, 0, 4, 3)
+    image = bytes(range(3 * 2 * 4))
+    canvas.draw(image, -1, 2, 3, 2, 255, BlendMode.MULTIPLY)
+
+    pixels = canvas.tobytes()
+    backdrop = bytes((200, 100, 50, 255))
+    for y in range(3):
+        for x in range(4):
+            pixel = pixels[(y * 4 + x) * 4:][:4]
+            if y == 2 and x < 2:
+                # only the first row of the image is inside, without its first column
+                src = image[(x + 1) * 4:][:4]
+                assert pixel == ase_render.blend_pixel(backdrop, src, 255, BlendMode.MULTIPLY)
+            else:
+                assert pixel == backdrop
+
+
+RED = (255, 0, 0, 255)
+BLUE = (0, 0, 255, 255)
+
+def _layer(name: str, child_level: int = 0, layer_type: LayerType = LayerType.NORMAL, blend_mode: int = BlendMode.NORMAL,
+           opacity: int = 255, visible: bool = True) -> Layer:
+    flags = LayerFlags.EDITABLE | (LayerFlags.VISIBLE if visible else 0)
+    return Layer(flags, layer_type, child_level, blend_mode, opacity, name, None, None)
+
+def _cel(layer_idx: int, color: tuple[int, ...], z_index: int = 0, opacity: int = 255) -> Cel:
+    return Cel(layer_idx, Point(0, 0), opacity, CelType.IMG_COMP, z_index, (1, 1, bytes(color)))
+
+def _render(layers: list[Layer], cels: list[Cel], header_flags: int = 0b11) -> tuple[int, ...]:
+    header = AsepriteFileHeader(1, Point(1, 1), 32, header_flags, 100, 0, 0, Point(1, 1), Rect(0, 0, 16, 16))
+    ase = AsepriteFile(header, None, layers, [Frame(cels, 100)], None, None, [])
+    return tuple(ase_render.render_frame(ase, 0))
+
+@pytest.mark.parametrize("z_indices, expected", [
+    ((0, 0),  BLUE),
+    ((1, 0),  RED),     # moved up past the layer above
+    ((0, -1), RED),     # moved down past the layer below
+    ((1, -1), RED),
+    ((-1, 1), BLUE),
+])
+def test_z_index(z_indices, expected, array_backend):
+    layers = [_layer("red"), _layer("blue")]
+    cels = [_cel(0, RED, z_indices[0]), _cel(1, BLUE, z_indices[1])]
+    assert _render(layers, cels) == expected
+
+def test_z_index_order(array_backend):
+    # layer 0 moved up by 2 ends up between layer 2 and 3 (at the same
+    # order as layer 2, but with the higher z-index)
+    layers = [_layer(str(i)) for i in range(4)]
+    colors = [(255, 0, 0, 128), (0, 255, 0, 255), (0, 0, 255, 255), (255, 255, 255, 0)]
+    cels = [_cel(0, colors[0], 2)] + [_cel(i, colors[i]) for i in range(1, 4)]
+
+    canvas = Canvas(1, 1)
+    for color in (colors[1], colors[2], colors[0], colors[3]):
+        _draw(canvas, color)
+    assert _render(layers, cels) == tuple(canvas.tobytes())
+
+def test_hidden_and_opacity(array_backend):
+    layers = [_layer("red", opacity=128), _layer("blue", visible=False)]
+    cels = [_cel(0, RED, opacity=128), _cel(1, BLUE)]
+    # layer and cel opacity are multiplied
+    assert _render(layers, cels) == (255, 0, 0, 64)
+    # unless layer opacity isn't valid in the file
+    assert _render(layers, cels, header_flags=0) == (255, 0, 0, 128)
+
+@pytest.mark.parametrize("header_flags, expected", [
+    (0b11, (0, 0, 255, 128)),   # composited on its own, then drawn at half opacity
+    (0b01, BLUE),               # group opacity isn't valid, its layers are drawn directly
+])
+def test_group_opacity(header_flags, expected, array_backend):
+    layers = [_layer("group", layer_type=LayerType.GROUP, opacity=128), _layer("red", 1), _layer("blue", 1)]
+    cels = [_cel(1, RED), _cel(2, BLUE)]
+    assert _render(layers, cels, header_flags) == expected
+
+@pytest.mark.parametrize("group_mode, layer_mode, expected", [
+    (BlendMode.MULTIPLY, BlendMode.NORMAL,   BLENDED[BlendMode.MULTIPLY][0]),
+    (BlendMode.NORMAL,   BlendMode.MULTIPLY, BLENDED[BlendMode.MULTIPLY][0]),
+    # the layer is blended within the group first, onto nothing
+    (BlendMode.SCREEN,   BlendMode.MULTIPLY, BLENDED[BlendMode.SCREEN][0]),
+])
+def test_group_blend_mode(group_mode, layer_mode, expected, array_backend):
+    layers = [
+        _layer("backdrop"),
+        _layer("group", layer_type=LayerType.GROUP, blend_mode=group_mode),
+        _layer("layer", 1, blend_mode=layer_mode),
+    ]
+    cels = [_cel(0, CASES[0][0]), _cel(2, CASES[0][1])]
+    assert _render(layers, cels) == expected
+
+def test_nested_groups(array_backend):
+    layers = [
+        _layer("outer", layer_type=LayerType.GROUP, opacity=128),
+        _layer("inner", 1, layer_type=LayerType.GROUP, opacity=128),
+        _layer("red", 2),
+        _layer("blue", 1, visible=False),
+    ]
+    cels = [_cel(2, RED), _cel(3, BLUE)]
+    # both opacities apply, to the composited group
+    assert _render(layers, cels) == (255, 0, 0, 64)
@@ -0,0 +1,163 @@
+"""Sprite sheets of the frames of files (see `ase_sheet`)."""
+import json
+import random
+
+import pytest
+
+from krita_aseprite import ase_sheet
+from krita_aseprite.ase_file import (
+    AsepriteFile, AsepriteFileHeader, Cel, CelType, Frame, Layer, LayerType, Point, Rect, Tag,
+)
+from krita_aseprite.ase_sheet import Bounds, MaxRectsPacker
+
+
+def _overlap(a: Bounds, b: Bounds) -> bool:
+    return a.x < b.x + b.w and b.x < a.x + a.w and a.y < b.y + b.h and b.y < a.y + a.h
+
+def _image(w: int, h: int, opaque: set[tuple[int, int]]) -> bytes:
+    return b"".join(bytes((x, y, 7, 255 if (x, y) in opaque else 0)) for y in range(h) for x in range(w))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_packer(seed):
+    rng = random.Random(seed)
+    packer = MaxRectsPacker(64)
+    placed = []
+    for _ in range(60):
+        w, h = rng.randint(1, 24), rng.randint(1, 24)
+        rect = packer.insert(w, h)
+        assert (rect.w, rect.h) == (w, h)
+        placed.append(rect)
+
+    for i, rect in enumerate(placed):
+        assert rect.x >= 0 and rect.y >= 0 and rect.x + rect.w <= 64
+        assert not any(_overlap(rect, other) for other in placed[i+1:])
+    assert packer.height == max(rect.y + rect.h for rect in placed)
+
+def test_packer_too_wide():
+    with pytest.raises(ValueError):
+        MaxRectsPacker(8).insert(9, 1)
+
+@pytest.mark.parametrize("padding", [0, 1, 3])
+def test_pack(padding):
+    rng = random.Random(padding)
+    sizes = [(rng.randint(1, 20), rng.randint(1, 20)) for _ in range(40)]
+    width, height, placements = ase_sheet.pack(sizes, padding)
+
+    assert [(rect.w, rect.h) for rect in placements] == sizes
+    padded = [rect._replace(w=rect.w + padding, h=rect.h + padding) for rect in placements]
+    for i, rect in enumerate(placements):
+        assert rect.x + rect.w <= width and rect.y + rect.h <= height
+        # nothing within `padding` pixels to the right of or below another
+        assert not any(_overlap(rect, other) for other in padded[:i] + padded[i+1:])
+
+    # roughly square, and not much bigger than what is packed
+    area = sum((w + padding) * (h + padding) for w, h in sizes)
+    assert width * height < 2 * area
+    assert ase_sheet.pack([]) == (0, 0, [])
+
+@pytest.mark.parametrize("opaque, expected", [
+    (set(),                     None),
+    ({(0, 0)},                  Bounds(0, 0, 1, 1)),
+    ({(4, 2)},                  Bounds(4, 2, 1, 1)),
+    ({(1, 3), (3, 1)},          Bounds(1, 1, 3, 3)),
+    ({(0, 2), (4, 2), (2, 0)},  Bounds(0, 0, 5, 3)),
+    ({(x, y) for x in range(5) for y in range(4)}, Bounds(0, 0, 5, 4)),
+])
+def test_alpha_bounds(opaque, expected, array_backend):
+    assert ase_sheet.alpha_bounds(_image(5, 4, opaque), 5, 4) == expected
+
+def test_crop():
+    image = _image(5, 4, set())
+    cropped = ase_sheet.crop(image, 5, Bounds(1, 2, 3, 2))
+    assert cropped == b"".join(bytes((x, y, 7, 0)) for y in (2, 3) for x in (1, 2, 3))
+
+
+RED = bytes((255, 0, 0, 255))
+BLUE = bytes((0, 0, 255, 255))
+
+def _ase(cels: list[list[Cel]], tags: list[Tag] | None = None) -> AsepriteFile:
+    header = AsepriteFileHeader(len(cels), Point(8, 6), 32, 0b11, 100, 0, 0, Point(1, 1), Rect(0, 0, 16, 16))
+    return AsepriteFile(
+        header, None, [Layer(0b11, LayerType.NORMAL, 0, 0, 255, "Layer", None, None)],
+        [Frame(frame_cels, 100 + 10 * i) for i, frame_cels in enumerate(cels)], None, tags, [],
+    )
+
+def _cel(x: int, y: int, w: int, h: int, pixel: bytes) -> Cel:
+    return Cel(0, Point(x, y), 255, CelType.IMG_COMP, 0, (w, h, pixel * (w * h)))
+
+def _sheet_image(sheet: ase_sheet.Sheet, rect: Bounds) -> bytes:
+    return ase_sheet.crop(sheet.pixels, sheet.width, rect)
+
+def test_make_sheet(array_backend):
+    ase = _ase([
+        [_cel(1, 1, 2, 2, RED)],
+        [_cel(1, 1, 2, 2, RED)],    # the same as frame 0
+        [_cel(5, 4, 3, 1, BLUE)],
+        [],                         # fully transparent
+        [_cel(4, 0, 2, 2, RED)],    # the same image as frame 0, elsewhere
+    ])
+    sheet = ase_sheet.make_sheet(ase, "sprite", padding=1)
+
+    assert [frame.name for frame in sheet.frames] == [f"sprite_{i}" for i in range(5)]
+    assert [frame.source for frame in sheet.frames] == [
+        Bounds(1, 1, 2, 2), Bounds(1, 1, 2, 2), Bounds(5, 4, 3, 1), Bounds(0, 0, 1, 1), Bounds(4, 0, 2, 2),
+    ]
+    assert [frame.image for frame in sheet.frames] == [0, 0, 1, 2, 0]
+    assert [frame.duration for frame in sheet.frames] == [100, 110, 120, 130, 140]
+
+    # each image is stored once, and only the trimmed part
+    assert len(sheet.placements) == 3
+    assert _sheet_image(sheet, sheet.placements[0]) == RED * 4
+    assert _sheet_image(sheet, sheet.placements[1]) == BLUE * 3
+    assert _sheet_image(sheet, sheet.placements[2]) == bytes(4)
+    assert not any(_overlap(a, b) for i, a in enumerate(sheet.placements) for b in sheet.placements[i+1:])
+    assert all(x + w <= sheet.width and y + h <= sheet.height for x, y, w, h in sheet.placements)
+
+def test_untrimmed(array_backend):
+    sheet = ase_sheet.make_sheet(_ase([[_cel(1, 1, 2, 2, RED)]]), "sprite", trim=False)
+    assert [frame.name for frame in sheet.frames] == ["sprite"]
+    assert sheet.frames[0].source == Bounds(0, 0, 8, 6)
+    assert (sheet.width, sheet.height) == (8, 6)
+
+def test_metadata(tmp_path):
+    tags = [Tag(0, 1, 0, 0, "idle"), Tag(1, 2, 2, 3, "walk"), Tag(2, 2, 9, 0, "broken")]
+    ase = _ase([[_cel(1, 1, 2, 2, RED)], [_cel(0, 0, 8, 6, BLUE)], [_cel(1, 1, 2, 2, RED)]], tags)
+    sheet = ase_sheet.make_sheet(ase, "sprite", padding=0)
+
+    png = str(tmp_path / "sprite.png")
+    path = str(tmp_path / "sprite.json")
+    ase_sheet.save_sheet(sheet, png, path)
+    with open(path) as f:
+        metadata = json.load(f)
+
+    assert metadata == ase_sheet.sheet_metadata(sheet, "sprite.png")
+    assert set(metadata) == {"frames", "meta"}
+
+    # an array of frames, in order, like aseprite's "Array" export
+    frames = metadata["frames"]
+    assert [frame["filename"] for frame in frames] == ["sprite_0", "sprite_1", "sprite_2"]
+    red = sheet.placements[sheet.frames[0].image]
+    assert frames[0] == {
+        "filename": "sprite_0",
+        "frame": {"x": red.x, "y": red.y, "w": 2, "h": 2},
+        "rotated": False,
+        "trimmed": True,
+        "spriteSourceSize": {"x": 1, "y": 1, "w": 2, "h": 2},
+        "sourceSize": {"w": 8, "h": 6},
+        "duration": 100,
+    }
+    assert frames[1]["trimmed"] is False
+    assert frames[1]["spriteSourceSize"] == {"x": 0, "y": 0, "w": 8, "h": 6}
+    assert frames[2]["frame"] == frames[0]["frame"]
+
+    meta = metadata["meta"]
+    assert meta["image"] == "sprite.png"
+    assert meta["format"] == "RGBA8888"
+    assert meta["size"] == {"w": sheet.width, "h": sheet.height}
+    assert meta["frameTags"] == [
+        {"name": "idle", "from": 0, "to": 1, "direction": "forward"},
+        {"name": "walk", "from": 1, "to": 2, "direction": "pingpong", "repeat": "3"},
+        # unknown directions are read as forward
+        {"name": "broken", "from": 2, "to": 2, "direction": "forward"},
+    ]
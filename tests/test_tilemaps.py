@@ -0,0 +1,144 @@
+"""Tilemap cels and tilesets, rendered to images."""
+from dataclasses import replace
+import os
+import struct
+
+import pytest
+
+from krita_aseprite import ase_file
+from krita_aseprite.ase_file import Point, Tileset, TilesetFlags
+from conftest import tilemap_ase
+
+X_FLIP = 0x20000000
+Y_FLIP = 0x40000000
+D_FLIP = 0x80000000
+
+
+def _tiles_data(tiles: list[int], tiles_w: int) -> ase_file.TilesData:
+    return (tiles_w, len(tiles) // tiles_w, 32, 0x1FFFFFFF, X_FLIP, Y_FLIP, D_FLIP, struct.pack(f"<{len(tiles)}I", *tiles))
+
+# a single tile of 2x2 pixels, 1 byte each (empty tile 0, tile 1 and 2)
+TILESET = Tileset(0, TilesetFlags.TILES, 3, Point(2, 2), 1, "tiles", bytes([0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8]))
+
+@pytest.mark.parametrize("word, expected", [
+    (1,                       [1, 2, 3, 4]),
+    (1 | X_FLIP,              [2, 1, 4, 3]),
+    (1 | Y_FLIP,              [3, 4, 1, 2]),
+    (1 | D_FLIP,              [1, 3, 2, 4]),
+    (1 | X_FLIP | Y_FLIP,     [4, 3, 2, 1]),
+    (1 | D_FLIP | X_FLIP,     [3, 1, 4, 2]),
+    (1 | D_FLIP | Y_FLIP,     [2, 4, 1, 3]),
+    (0,                       [0, 0, 0, 0]),    # empty tile
+    (0 | X_FLIP,              [0, 0, 0, 0]),
+    (7,                       [0, 0, 0, 0]),    # not in the tileset
+])
+def test_flips(array_backend, word, expected):
+    assert ase_file.render_tilemap(_tiles_data([word], 1), TILESET, 1, {}) == (2, 2, bytes(expected))
+
+def test_layout(array_backend):
+    variants: dict[tuple[int, int, int], bytes] = {}
+    w, h, pixels = ase_file.render_tilemap(_tiles_data([1, 2, 2 | X_FLIP, 0, 1, 2], 3), TILESET, 1, variants)
+
+    assert (w, h) == (6, 4)
+    assert pixels == bytes([
+        1, 2, 5, 6, 6, 5,
+        3, 4, 7, 8, 8, 7,
+        0, 0, 1, 2, 5, 6,
+        0, 0, 3, 4, 7, 8,
+    ])
+    # each variant of a tile is only built once
+    assert len(variants) == 4
+
+def _expected_rgba(tiles: list[int], order: dict[int, list[int]]) -> bytes:
+    # the 2x2 map of 2x2 tiles of `tilemap_ase`, with tile pixels in `order`
+    def pixel(tile: int, i: int) -> bytes:
+        tile_id = tile & 0x1FFFFFFF
+        base = {0: None, 1: 0, 2: 128}[tile_id]
+        if base is None:
+            return bytes(4)
+        k = order[tile & ~0x1FFFFFFF][i]
+        return bytes(range(base + k * 4, base + k * 4 + 4))
+
+    rows = []
+    for ty in range(2):
+        for py in range(2):
+            rows.append(b"".join(pixel(tiles[ty * 2 + tx], py * 2 + px) for tx in range(2) for px in range(2)))
+    return b"".join(rows)
+
+ORDER = {0: [0, 1, 2, 3], X_FLIP: [1, 0, 3, 2], Y_FLIP: [2, 3, 0, 1], D_FLIP: [0, 2, 1, 3], D_FLIP | X_FLIP: [2, 0, 3, 1]}
+
+def test_round_trip(tmp_path, array_backend):
+    tiles = [1, 2 | X_FLIP, 1 | D_FLIP | X_FLIP, 0 | Y_FLIP]
+    filename = str(tmp_path / "tilemap.aseprite")
+    ase_file.save_ase_file(tilemap_ase(tiles), filename)
+
+    ase = ase_file.read_ase_file(filename)
+    assert ase.layers[0].tileset_idx == 0
+    [cel] = ase.frames[0].cels
+    tileset = ase.tilesets[0]
+    assert (tileset.num_tiles, tileset.tile_size, tileset.base_index) == (3, Point(2, 2), 1)
+
+    assert ase_file.render_tilemap(cel.data, tileset, 4, {}) == (4, 4, _expected_rgba(tiles, ORDER))
+    [[keyframe]] = ase_file.prepare_keyframes(ase)
+    assert keyframe.pixels == ase_file.swap_red_blue(_expected_rgba(tiles, ORDER))
+
+def _save_external(tmp_path) -> tuple[str, str]:
+    tiles = [1, 2 | X_FLIP, 1 | D_FLIP | X_FLIP, 0]
+    tileset_file = str(tmp_path / "tileset.aseprite")
+    ase_file.save_ase_file(tilemap_ase(tiles), tileset_file)
+
+    # two frames using the tileset of the external file
+    ase = tilemap_ase(tiles, external=True)
+    ase.frames.append(replace(ase.frames[0]))
+    filename = str(tmp_path / "external.aseprite")
+    ase_file.save_ase_file(ase, filename)
+    return filename, tileset_file
+
+def test_external_tileset(tmp_path, array_backend):
+    filename, tileset_file = _save_external(tmp_path)
+    cache = ase_file.TilesetCache()
+
+    ase = ase_file.read_ase_file(filename)
+    ase_file.resolve_external_tilesets(ase, str(tmp_path), cache)
+    tileset = ase.tilesets[0]
+    assert tileset.pixels == ase_file.read_ase_file(tileset_file).tilesets[0].pixels
+    assert tileset.external_file_id == 1
+
+    for frame in ase.frames:
+        [cel] = frame.cels
+        assert ase_file.render_tilemap(cel.data, tileset, 4, {})[2] == _expected_rgba([1, 2 | X_FLIP, 1 | D_FLIP | X_FLIP, 0], ORDER)
+
+def test_tileset_cache(tmp_path):
+    filename, tileset_file = _save_external(tmp_path)
+    cache = ase_file.TilesetCache()
+
+    first = ase_file.read_ase_file(filename)
+    second = ase_file.read_ase_file(filename)
+    ase_file.resolve_external_tilesets(first, str(tmp_path), cache)
+    ase_file.resolve_external_tilesets(second, str(tmp_path), cache)
+
+    # decoded once, and shared
+    assert first.tilesets[0].pixels is second.tilesets[0].pixels
+    assert cache.get(tileset_file) is cache.get(tileset_file)
+
+    # read again once the file changes
+    old = cache.get(tileset_file)
+    ase = tilemap_ase([0])
+    ase.tilesets[0] = replace(ase.tilesets[0], pixels=bytes(reversed(ase.tilesets[0].pixels)))
+    ase_file.save_ase_file(ase, tileset_file)
+    mtime = os.stat(tileset_file).st_mtime_ns + 1_000_000_000
+    os.utime(tileset_file, ns=(mtime, mtime))
+
+    new = cache.get(tileset_file)
+    assert new is not old
+    assert new[0].pixels == ase.tilesets[0].pixels
+
+def test_missing_external_tileset(tmp_path):
+    filename, tileset_file = _save_external(tmp_path)
+    os.remove(tileset_file)
+
+    ase = ase_file.read_ase_file(filename)
+    assert ase.tilesets[0].pixels is None
+    # missing tiles are empty
+    [cel] = ase.frames[0].cels
+    assert ase_file.render_tilemap(cel.data, ase.tilesets[0], 4, {})[2] == bytes(4 * 4 * 4)